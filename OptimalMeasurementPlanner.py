@@ -25,7 +25,8 @@ Workflow:
 4. Layers are added to the QGIS project for visualization.
 5. Additional tools allow highlighting of optimal met mast locations.
 
-This script contains the main plugin class, UI integration, and all processing logic.
+This script contains the main plugin class, UI integration and the QGIS side of the
+processing; the TRIX, RSS, solver and IDW computations live in the compute package.
 """
 from qgis.PyQt.QtCore import *
 from qgis.PyQt.QtGui import *
@@ -46,19 +47,133 @@ import processing
 from datetime import datetime, UTC
 import numpy as np
 from itertools import combinations
-import io
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from osgeo import gdal, ogr, osr
+from .compute import PipelineCanceled, raster, solvers, trix
 # Suppress deprecation warnings from QGIS
 warnings.filterwarnings("ignore", category=DeprecationWarning)
 
+
+class PipelineStageTask(QgsTask):
+    """
+    One stage of a pipeline run, as a subtask of PipelineTask.
+
+    run() brings the stage up to date in the background (see
+    OptimalMeasurementPlanner.run_stage); finished() runs on the GUI thread
+    and shows the stage's layers. Canceling the task cancels the stage's
+    feedback, which the TRIX parser and the IDW tiles check.
+    """
+
+    def __init__(self, planner, pipeline, stage):
+        super().__init__(stage['name'], QgsTask.CanCancel)
+        self.planner = planner
+        self.pipeline = pipeline
+        self.stage = stage
+        self.feedback = QgsFeedback()
+        self.feedback.progressChanged.connect(self.setProgress)
+
+    def cancel(self):
+        self.feedback.cancel()
+        super().cancel()
+
+    def run(self):
+        try:
+            self.planner.run_stage(self.pipeline, self.stage, self.feedback)
+        except PipelineCanceled:
+            return False
+        except Exception as e:
+            self.pipeline['error'] = e
+            return False
+        return not self.isCanceled()
+
+    def finished(self, result):
+        if result:
+            self.planner.show_stage(self.stage)
+
+
+class PipelineTask(QgsTask):
+    """
+    Background run of the main process pipeline: one PipelineStageTask per
+    stage, depending on the subtasks of the stages it reads from. The task
+    manager starts every subtask as soon as its dependencies are done, so
+    independent stages (the turbine layer and the met mast layer/IDW
+    branch) run at the same time.
+    """
+
+    def __init__(self, planner, pipeline):
+        super().__init__('Optimal Measurement Planner', QgsTask.CanCancel)
+        self.planner = planner
+        self.pipeline = pipeline
+        stage_tasks = {}
+        for stage in pipeline['stages']:
+            stage_task = PipelineStageTask(planner, pipeline, stage)
+            self.addSubTask(stage_task, [stage_tasks[dep] for dep in stage['deps']],
+                            QgsTask.ParentDependsOnSubTask)
+            stage_tasks[stage['name']] = stage_task
+
+    def run(self):
+        return 'error' not in self.pipeline and not self.isCanceled()
+
+    def finished(self, result):
+        self.planner.pipeline_finished(self.pipeline, result)
+
+
+class BestKMastsTask(QgsTask):
+    """
+    Background search of the best set of k met masts.
+
+    run() only solves (see OptimalMeasurementPlanner.solve_best_k_met_mast);
+    finished() runs on the GUI thread and writes and adds the result layer.
+    The search checks the task for cancellation through its progress
+    callback.
+    """
+
+    def __init__(self, planner, search):
+        super().__init__(f"Best {search['k']} met masts", QgsTask.CanCancel)
+        self.planner = planner
+        self.search = search
+
+    def progress(self, percent):
+        if self.isCanceled():
+            raise PipelineCanceled()
+        self.setProgress(percent)
+
+    def run(self):
+        try:
+            self.search['solution'] = self.planner.solve_best_k_met_mast(
+                self.search['k'], self.search['solver'], self.search['time_budget'], progress=self.progress)
+        except PipelineCanceled:
+            return False
+        except Exception as e:
+            self.search['error'] = e
+            return False
+        return True
+
+    def finished(self, result):
+        self.planner.best_k_finished(self.search, result)
+
+
 class OptimalMeasurementPlanner:
     """QGIS Plugin Implementation."""
 
+    # Bump trix.PIPELINE_VERSION when the processed TRIX columns change,
+    # invalidates cached parses and stage fingerprints
+    PIPELINE_VERSION = trix.PIPELINE_VERSION
+    # Size limit of the parsed TRIX cache, least recently used entries go first
+    TRIX_CACHE_MAX_BYTES = trix.TRIX_CACHE_MAX_BYTES
+    # Single container of a run in the GeoPackage output layout
+    GEOPACKAGE_NAME = 'met_mast_results.gpkg'
+
     def __init__(self, iface):
         """Constructor.
 
         :param iface: An interface instance that will be passed to this class
             which provides the hook by which you can manipulate the QGIS
-            application at run time.
+            application at run time. None runs the planner headless (see
+            batch.py): messages are printed instead.
         :type iface: QgsInterface
         """
         # Save reference to the QGIS interface
@@ -66,7 +181,7 @@ class OptimalMeasurementPlanner:
         # initialize plugin directory
         self.plugin_dir = os.path.dirname(__file__)
         # initialize locale
-        locale = QSettings().value('locale/userLocale')[0:2]
+        locale = (QSettings().value('locale/userLocale') or 'en')[0:2]
         locale_path = os.path.join(
             self.plugin_dir,
             'i18n',
@@ -79,13 +194,53 @@ class OptimalMeasurementPlanner:
 
         # Declare instance attributes
         self.actions = []
+        self.provider = None
         self.menu = self.tr(u'&OptimalMeasurementPlanner')
 
         # Check if plugin was started the first time in current QGIS session
         # Must be set in initGui() to survive plugin reloads
         self.cities_by_country = None
         self.output_direcory = None
+        # Folder of the stage files, output_direcory unless the outputs go to a GeoPackage
+        self.work_direcory = None
         self.df_data = None
+        # Positional ID indexes (matrix position <-> ID <-> coordinates)
+        self.turbine_index = None
+        self.mast_index = None
+        # Dense turbine x mast RSS matrix, accumulated while the TRIX file is read
+        self.rss_matrix = None
+        self.rss_turbine_ids = None
+        self.rss_mast_ids = None
+        # Parsed TRIX cache location, defaults to the user cache directory
+        self.cache_dir = None
+        self.trix_hashes = {}
+        # Heatmap interpolation settings
+        self.pixel_size = 5
+        self.idw_power = 2
+        # Optional IDW cutoff: nearest points only / points within a radius
+        self.idw_neighbours = None
+        self.idw_radius = None
+        self.idw_workers = 1
+        # Resolution: 'fixed' uses pixel_size, 'auto' picks it from the site
+        # within pixel_budget, 'refine' also writes a finer raster around the
+        # masts and turbines
+        self.pixel_mode = 'fixed'
+        self.pixel_budget = 4000000
+        self.refine_factor = 4
+        self.refine_distance = None
+        # Raster output: 'gtiff' (tiled GeoTIFF) or 'cog' (Cloud-Optimized
+        # GeoTIFF, compressed with internal overviews)
+        self.raster_format = 'gtiff'
+        self.cog_compression = 'ZSTD'
+        # Output layout: 'files' (one file per output) or 'gpkg' (one
+        # GeoPackage per run, see write_geopackage)
+        self.output_layout = 'files'
+        # Layers of the last pipeline run, by stage output
+        self.pipeline_layers = {}
+        # Headless only: QgsFeedback receiving the messages (Processing log)
+        self.message_feedback = None
+        self.pipeline_task = None
+        self.best_k_task = None
         
     # noinspection PyMethodMayBeStatic
     def tr(self, message):
@@ -187,6 +342,125 @@ class OptimalMeasurementPlanner:
         
         result = processing.run("native:savefeatures", params)
         return result['OUTPUT']  # Returns the saved file path
+
+    # OGR field types of the field type names used by the point writers
+    OGR_FIELD_TYPES = {'integer': ogr.OFTInteger, 'double': ogr.OFTReal, 'text': ogr.OFTString}
+
+    def write_point_features(self, outpath, crs, fields, features, layer_name=None):
+        """
+        Write point features straight to a vector file with OGR, in one
+        transaction, without building a memory layer or going through
+        QGIS Processing. The format follows the extension (.shp or .gpkg)
+        and an existing file is replaced.
+
+        :param outpath: Output path
+        :param crs: CRS as an authority id, e.g. 'EPSG:32632'
+        :param fields: List of (name, type, width, precision), type being
+            'integer', 'double' or 'text'
+        :param features: Iterable of (x, y, attributes), attributes in the
+            order of fields
+        :param layer_name: Layer name, defaults to the file name
+        :returns: outpath
+        :rtype: str
+        """
+        if layer_name is None:
+            layer_name = os.path.splitext(os.path.basename(outpath))[0]
+        driver_name = 'GPKG' if outpath.lower().endswith('.gpkg') else 'ESRI Shapefile'
+        driver = ogr.GetDriverByName(driver_name)
+        if os.path.exists(outpath):
+            driver.DeleteDataSource(outpath)
+
+        srs = osr.SpatialReference()
+        srs.SetFromUserInput(crs)
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        options = ['ENCODING=UTF-8'] if driver_name == 'ESRI Shapefile' else []
+
+        datasource = driver.CreateDataSource(outpath)
+        if datasource is None:
+            raise Exception(f"Failed to create {outpath}")
+        layer = datasource.CreateLayer(layer_name, srs, ogr.wkbPoint, options)
+        for name, type_name, width, precision in fields:
+            field = ogr.FieldDefn(name, self.OGR_FIELD_TYPES[type_name])
+            field.SetWidth(width)
+            field.SetPrecision(precision)
+            layer.CreateField(field)
+
+        definition = layer.GetLayerDefn()
+        layer.StartTransaction()
+        for x, y, attributes in features:
+            feature = ogr.Feature(definition)
+            for index, value in enumerate(attributes):
+                if value is None or (isinstance(value, float) and math.isnan(value)):
+                    feature.SetFieldNull(index)
+                else:
+                    feature.SetField(index, value)
+            point = ogr.Geometry(ogr.wkbPoint)
+            point.AddPoint_2D(float(x), float(y))
+            feature.SetGeometry(point)
+            layer.CreateFeature(feature)
+        layer.CommitTransaction()
+        datasource = None
+        return outpath
+
+    def write_geopackage(self, gpkg_path, vectors=(), tables=(), rasters=(), append=False):
+        """
+        Collect outputs in one GeoPackage.
+
+        Vector files become layers with a spatial index and CSV files
+        attribute tables (column types detected), all copied in a single
+        transaction; rasters are added as tiled raster tables afterwards.
+        Tables are named after their files. Unless append is set the
+        GeoPackage is built next to gpkg_path and replaces it once
+        complete; with append the tables are added to (or replace those of)
+        the existing GeoPackage.
+
+        :param vectors: Paths of vector files
+        :param tables: Paths of CSV files
+        :param rasters: List of (path, tile format), TIFF for Float32
+            rasters, PNG for RGBA
+        :returns: gpkg_path
+        :rtype: str
+        """
+        target = gpkg_path if append else gpkg_path + '.tmp'
+        if not append and os.path.exists(target):
+            os.remove(target)
+        if os.path.exists(target):
+            datasource = ogr.Open(target, 1)
+        else:
+            datasource = ogr.GetDriverByName('GPKG').CreateDataSource(target)
+        if datasource is None:
+            raise Exception(f"Failed to open {target}")
+
+        def table_name(path):
+            return os.path.splitext(os.path.basename(path))[0]
+
+        datasource.StartTransaction()
+        try:
+            for path in vectors:
+                source = ogr.Open(path)
+                datasource.CopyLayer(source.GetLayer(0), table_name(path), ['SPATIAL_INDEX=YES', 'OVERWRITE=YES'])
+                source = None
+            for path in tables:
+                source = gdal.OpenEx(path, gdal.OF_VECTOR, open_options=['AUTODETECT_TYPE=YES'])
+                datasource.CopyLayer(source.GetLayer(0), table_name(path), ['OVERWRITE=YES'])
+                source = None
+            datasource.CommitTransaction()
+        except Exception:
+            datasource.RollbackTransaction()
+            raise
+        finally:
+            datasource = None
+
+        for path, tile_format in rasters:
+            dataset = gdal.Translate(target, path, format='GPKG',
+                                     creationOptions=['APPEND_SUBDATASET=YES', f'RASTER_TABLE={table_name(path)}',
+                                                      f'TILE_FORMAT={tile_format}'])
+            if dataset is None:
+                raise Exception(f"Failed to add {path} to {target}")
+            dataset = None
+        if not append:
+            os.replace(target, gpkg_path)
+        return gpkg_path
             
     def initGui(self):
         """Create the menu entries and toolbar icons inside the QGIS GUI."""
@@ -201,6 +475,14 @@ class OptimalMeasurementPlanner:
         # will be set False in run()
         self.first_start = True
 
+        self.initProcessing()
+
+    def initProcessing(self):
+        """Register the Processing provider (also called by qgis_process)."""
+        from .OptimalMeasurementPlanner_provider import OptimalMeasurementPlannerProvider
+        self.provider = OptimalMeasurementPlannerProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
+
 
     def unload(self):
         """Removes the plugin menu item and icon from QGIS GUI."""
@@ -209,6 +491,16 @@ class OptimalMeasurementPlanner:
                 self.tr(u'&OptimalMeasurementPlanner'),
                 action)
             self.iface.removeToolBarIcon(action)
+        if self.provider is not None:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
+
+    def headless_message(self, message: str):
+        """Message of a planner without interface: to message_feedback, or printed."""
+        if self.message_feedback is not None:
+            self.message_feedback.pushInfo(message)
+        else:
+            print(message)
 
     def display_info(self, message: str):
         """
@@ -216,6 +508,9 @@ class OptimalMeasurementPlanner:
         :param message: String
         :return:
         """
+        if self.iface is None:
+            self.headless_message(message)
+            return
         messageBar = self.iface.messageBar().createMessage(message)
         self.iface.messageBar().pushWidget(messageBar, level=Qgis.Info, duration=3)
 
@@ -225,6 +520,9 @@ class OptimalMeasurementPlanner:
         :param message: String
         :return:
         """
+        if self.iface is None:
+            self.headless_message(f"Warning: {message}")
+            return
         messageBar = self.iface.messageBar().createMessage(message)
         self.iface.messageBar().pushWidget(messageBar, level=Qgis.Warning, duration=3)
 
@@ -234,9 +532,29 @@ class OptimalMeasurementPlanner:
         :param message: String
         :return:
         """
+        if self.iface is None:
+            self.headless_message(message)
+            return
         messageBar = self.iface.messageBar().createMessage(message)
         self.iface.messageBar().pushWidget(messageBar, level=Qgis.Success, duration=3)
 
+    def create_progress_bar(self, message: str):
+        """
+        Push a message bar item holding a progress bar
+        :param message: String
+        :return: (message bar item, QProgressBar), (None, None) when headless
+        """
+        if self.iface is None:
+            self.headless_message(message)
+            return None, None
+        progressMessageBar = self.iface.messageBar().createMessage(message)
+        progress = QProgressBar()
+        progress.setMaximum(100)
+        progress.setAlignment(Qt.AlignLeft | Qt.AlignVCenter)
+        progressMessageBar.layout().addWidget(progress)
+        self.iface.messageBar().pushWidget(progressMessageBar, Qgis.Info)
+        return progressMessageBar, progress
+
     def style_point_layer(self, layer, style, color, size) :
             
         # Apply basic styling
@@ -380,156 +698,223 @@ class OptimalMeasurementPlanner:
 
         return crs_code                  
             
-    def get_crs(self):
-        coords = self.get_coordinates(self.dlg.country_input.currentText(),self.dlg.city_input.currentText())
+    def get_crs(self, country_name=None, city_name=None):
+        """UTM CRS of a city, by default the one selected in the dialog."""
+        if country_name is None:
+            country_name, city_name = self.dlg.country_input.currentText(), self.dlg.city_input.currentText()
+        coords = self.get_coordinates(country_name, city_name)
+        if coords is None:
+            raise Exception(f"Unknown city {city_name} ({country_name})")
         return self.get_utm_crs_from_lonlat(coords[0], coords[1])
             
     def create_turbine_shapefile(self, csv_path, outpath, crs_epsg):
         """
-        Creates a turbine shapefile directly from CSV data.
+        Creates a turbine shapefile directly from CSV data and adds it to the project.
         
         :param csv_path: Path to CSV file containing turbine data
         :param outpath: Output path for the shapefile
         :param crs_epsg: EPSG code for the CRS
         """
-        # Read CSV data
-        turbines = []
-        with open(csv_path, 'r') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                turbines.append({
-                    'x': float(row['WTG X [m]']),
-                    'y': float(row['WTG Y [m]']),
-                    'z': float(row['WTG Z [m]']),
-                    'rix': float(row['WTG RIX [%]'])
-                })
-        
-        # Create vector layer
-        vl = QgsVectorLayer(f"Point?crs={crs_epsg}", "wind_turbines", "memory")
-        pr = vl.dataProvider()
-        
-        # Add fields
-        pr.addAttributes([
-            QgsField("id", QMetaType.Int, "integer"),  # Integer field (32-bit)
-            QgsField("x_coord", QMetaType.Double, "double", 20, 6),  # 20 digits, 6 decimal places
-            QgsField("y_coord", QMetaType.Double, "double", 20, 6),
-            QgsField("elevation", QMetaType.Double, "double", 10, 2),  # 10 digits, 2 decimal places
-            QgsField("rix", QMetaType.Double, "double", 10, 4),  # 10 digits, 4 decimal places
-            QgsField("turbine_id", QMetaType.QString, "text", 50)  # Text field with max 50 chars
-        ])
-        vl.updateFields()
-        
-        # Add features
-        for idx, turbine in enumerate(turbines, start=1):
-            feat = QgsFeature()
-            feat.setGeometry(QgsGeometry.fromPointXY(
-                QgsPointXY(turbine['x'], turbine['y'])
-            ))
-            feat.setAttributes([
-                idx,
-                turbine['x'],
-                turbine['y'],
-                turbine['z'],
-                turbine['rix'],
-                f"WTG_{idx:02d}"
-            ])
-            pr.addFeature(feat)
-        
-        # Save to shapefile
-        noerror = self.save_as_shp(vl, outpath, crs_epsg)
-        
-        if noerror :
+        if self.write_turbine_points(csv_path, outpath, crs_epsg):
             layer = QgsVectorLayer(outpath, "Wind Turbines", "ogr")
             layer = self.style_point_layer(layer, 'star','red', '4')   
             QgsProject.instance().addMapLayer(layer)
             return layer
-  
-  
-    def create_met_mast_layer(self, text_file_path, crs, outpath):
+
+    def write_turbine_points(self, csv_path, outpath, crs_epsg):
+        """
+        Write the turbine point file of a turbine CSV, without creating a
+        layer (safe outside the GUI thread).
+
+        :returns: outpath
+        :rtype: str
+        """
+        # Read CSV data
+        turbines = pd.read_csv(csv_path, usecols=['WTG X [m]', 'WTG Y [m]', 'WTG Z [m]', 'WTG RIX [%]'],
+                               dtype=np.float64)
         
-        # Create the point layer (shapefile or memory layer)
         fields = [
-            QgsField('Reference_Point_X_m', QMetaType.Double, 'double', 20, 6),
-            QgsField('Reference_Point_Y_m', QMetaType.Double, 'double', 20, 6),
-            QgsField('Reference_Point_Z_m', QMetaType.Double, 'double', 20, 6),
-            QgsField('Reference_RIX_percent', QMetaType.Double, 'double', 10, 2),
-            QgsField('RSS_uncertainty_increases_percent', QMetaType.Double, 'double', 10, 2)
+            ("id", "integer", 0, 0),  # Integer field (32-bit)
+            ("x_coord", "double", 20, 6),  # 20 digits, 6 decimal places
+            ("y_coord", "double", 20, 6),
+            ("elevation", "double", 10, 2),  # 10 digits, 2 decimal places
+            ("rix", "double", 10, 4),  # 10 digits, 4 decimal places
+            ("turbine_id", "text", 50, 0)  # Text field with max 50 chars
         ]
+        features = (
+            (x, y, [idx, x, y, z, rix, f"WTG_{idx:02d}"])
+            for idx, (x, y, z, rix) in enumerate(turbines[['WTG X [m]', 'WTG Y [m]', 'WTG Z [m]',
+                                                           'WTG RIX [%]']].itertuples(index=False), start=1)
+        )
         
-        # Create memory layer (type=QGIS.Point)
-        vector_mast_layer = QgsVectorLayer("Point?crs="+crs, "Met Mast Points", "memory")
+        # Save to shapefile
+        return self.write_point_features(outpath, crs_epsg, fields, features, "wind_turbines")
+  
+  
+    def create_met_mast_layer(self, text_file_path, crs, outpath):
         
-        # Set fields (attributes)
-        vector_mast_layer.dataProvider().addAttributes(fields)
-        vector_mast_layer.updateFields()
-
-        # Open the CSV file and read it
-        with open(text_file_path, 'r') as file:
-            reader = csv.DictReader(file)
-            features = []
-            for row in reader:
-                x = float(row['Reference Point X [m]'])
-                y = float(row['Reference Point Y [m]'])
-                z = float(row['Reference Point Z [m]'])
-                rix = float(row['Reference RIX [%]'])
-                # Only use new RSS uncertainty
-                uncertainty = float(row['adj_RSS_uncertainty'])
-                point = QgsPointXY(x, y)
-                point_geometry = QgsGeometry.fromPointXY(point)
-                feature = QgsFeature()
-                feature.setGeometry(point_geometry)
-                feature.setAttributes([x, y, z, rix, uncertainty])
-                features.append(feature)
-            vector_mast_layer.dataProvider().addFeatures(features)
-            vector_mast_layer.updateExtents()
-        noerror = self.save_as_shp(vector_mast_layer, outpath, crs)
-        if noerror:
+        if self.write_met_mast_points(text_file_path, crs, outpath):
             layer = QgsVectorLayer(outpath, "Met Mass Points", "ogr")
             layer = self.style_point_layer(layer, 'circle','magenta', '1.8')   
             return layer
 
-    def generate_idw_raster(self, vector_mast_layer, vector_mast_path, output_idw_raster):
+    def write_met_mast_points(self, text_file_path, crs, outpath):
+        """
+        Write the met mast point file of the mean RSS per mast CSV, without
+        creating a layer (safe outside the GUI thread).
 
-        
-        param = {
-            'INTERPOLATION_DATA':'{}::~::0::~::4::~::0'.format(vector_mast_path),
-            'DISTANCE_COEFFICIENT':2,
-            'EXTENT':vector_mast_layer.extent(),
-            'PIXEL_SIZE':5,
-            'OUTPUT': output_idw_raster
-        }
-        raster_layer = processing.run("qgis:idwinterpolation",  param)['OUTPUT']
-    
+        :returns: outpath
+        :rtype: str
+        """
+        # Fields of the point layer
+        fields = [
+            ('Reference_Point_X_m', 'double', 20, 6),
+            ('Reference_Point_Y_m', 'double', 20, 6),
+            ('Reference_Point_Z_m', 'double', 20, 6),
+            ('Reference_RIX_percent', 'double', 10, 2),
+            ('RSS_uncertainty_increases_percent', 'double', 10, 2)
+        ]
+
+        # Read the CSV file, only use new RSS uncertainty
+        columns = ['Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]',
+                   'Reference RIX [%]', 'adj_RSS_uncertainty']
+        masts = pd.read_csv(text_file_path, usecols=columns, dtype=np.float64)
+        features = ((x, y, [x, y, z, rix, uncertainty])
+                    for x, y, z, rix, uncertainty in masts[columns].itertuples(index=False))
+        return self.write_point_features(outpath, crs, fields, features, "Met Mast Points")
 
-    def apply_color_ramp(self, raster_layer):
+    def idw_points(self, vector_mast_layer, field=4):
+        """
+        Interpolation points of a met mast layer: the point coordinates and
+        their RSS uncertainty (attribute 4, or the given field name or
+        index). Features without a value are skipped, as
+        qgis:idwinterpolation does.
 
+        :returns: (points, values) float64 arrays of shape (n, 2) and (n,)
+        :rtype: tuple
+        """
+        points, values = [], []
+        for feature in vector_mast_layer.getFeatures():
+            value = feature.attribute(field)
+            if value is None or feature.geometry().isNull():
+                continue
+            point = feature.geometry().asPoint()
+            points.append((point.x(), point.y()))
+            values.append(float(value))
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        values = np.asarray(values, dtype=np.float64)
+        valid = np.isfinite(values)
+        return points[valid], values[valid]
+
+    def generate_idw_raster(self, vector_mast_layer, output_idw_raster, pixel_size=5, power=2,
+                            k_neighbours=None, search_radius=None, workers=1, tile_size=256,
+                            block_bytes=64 * 1024 ** 2, pixel_budget=None, refine_factor=1,
+                            refine_points=None, refine_distance=None, cog=False,
+                            heatmap_raster=None, ramp_stops=None, ramp_colors=None, feedback=None,
+                            value_field=4):
+        """
+        Interpolate the met mast RSS uncertainty to a GeoTIFF with inverse
+        distance weighting.
+
+        Reads the points, extent and CRS of the layer and interpolates them
+        with raster.interpolate_idw, which holds the grid, cutoff,
+        automatic resolution and refinement logic.
+
+        :param vector_mast_layer: Met mast point layer
+        :param output_idw_raster: Output GeoTIFF path
+        :param pixel_size: Requested pixel size in layer units
+        :param power: IDW distance coefficient
+        :param k_neighbours: Only use the k nearest points
+        :param search_radius: Only use the points within this distance
+        :param workers: Number of worker processes, 1 evaluates in process
+        :param tile_size: Tile width and height in pixels
+        :param block_bytes: Memory budget of a block of pixel/point distances
+        :param pixel_budget: Maximum number of pixels, enables the automatic
+            pixel size
+        :param refine_factor: Subdivision of the refined raster, 1 disables it
+        :param refine_points: Extra points to refine around, shape (n, 2)
+        :param refine_distance: Refinement distance, defaults to half the
+            median mast spacing (at least two pixels)
+        :param cog: Write Cloud-Optimized GeoTIFFs (see raster.write_cog)
+        :param heatmap_raster: Also write the colorized RGBA heatmap of the
+            base raster to this path, in the same tile pass
+        :param ramp_stops: Colour ramp of the heatmap, [(value, QColor)],
+            defaults to heatmap_ramp_stops of the mast value range
+        :param ramp_colors: Colours of the default ramp_stops, see
+            heatmap_ramp_colors; read them on the GUI thread before running
+            this in the background
+        :param feedback: QgsFeedback for the progress, checked for
+            cancellation between tiles (raises PipelineCanceled); a
+            QgsProcessingFeedback also gets the grid/tile statistics
+        :param value_field: Interpolated attribute, see idw_points
+        :returns: (min, max) of the written values
+        :rtype: tuple
+        """
+        points, values = self.idw_points(vector_mast_layer, value_field)
+        extent = vector_mast_layer.extent()
+        bounds = (extent.xMinimum(), extent.yMinimum(), extent.xMaximum(), extent.yMaximum())
+        ramp = None
+        if heatmap_raster is not None:
+            if ramp_stops is None:
+                ramp_stops = self.heatmap_ramp_stops((values.min(), values.max()) if len(values) else (0.0, 0.0),
+                                                     colors=ramp_colors)
+            ramp = ([value for value, _ in ramp_stops], [color.getRgb() for _, color in ramp_stops])
+        return raster.interpolate_idw(points, values, bounds, vector_mast_layer.crs().toWkt(), output_idw_raster,
+                                      pixel_size, power, k_neighbours, search_radius, workers, tile_size,
+                                      block_bytes, pixel_budget, refine_factor, refine_points, refine_distance,
+                                      cog=cog, heatmap_raster=heatmap_raster, ramp=ramp, feedback=feedback,
+                                      compression=self.cog_compression)
+
+    def heatmap_ramp_colors(self, num_classes=5):
+        """
+        Colours of the heatmap ramp stops: RdYlGn inverted (high uncertainty
+        red). Reads the QGIS style, so call it on the GUI thread.
+
+        :returns: List of num_classes QColor
+        :rtype: list
+        """
+        color_ramp = QgsStyle().defaultStyle().colorRamp('RdYlGn')
+        return [color_ramp.color(1.0 - (float(i) / (num_classes - 1))) for i in range(num_classes)]
+
+    def heatmap_ramp_stops(self, value_range, num_classes=5, colors=None):
+        """
+        Stops of the heatmap colour ramp: num_classes stops evenly spread
+        over value_range.
+
+        :param colors: Colours of heatmap_ramp_colors, read from the QGIS
+            style when None
+        :returns: List of (value, QColor)
+        :rtype: list
+        """
+        if colors is None:
+            colors = self.heatmap_ramp_colors(num_classes)
+        min_value, max_value = value_range
+        class_interval = (max_value - min_value) / (len(colors) - 1)
+        return [(min_value + i * class_interval, color) for i, color in enumerate(colors)]
+
+    def apply_color_ramp(self, raster_layer, value_range=None, sample_size=250000):
+        """
+        Style a raster with the inverted RdYlGn ramp in 5 classes.
+
+        The classes only need the band min/max: value_range when given (the
+        IDW step returns it), else the statistics stored in the raster,
+        else statistics of a sample of sample_size pixels, so the raster is
+        never scanned in full.
+        """
         provider = raster_layer.dataProvider()
-        stats = provider.bandStatistics(1)
-        min_value = stats.minimumValue
-        max_value = stats.maximumValue
-        num_classes =5
-        class_interval = (max_value - min_value) / (num_classes - 1)
+        if value_range is None:
+            value_range = raster.raster_value_range(raster_layer.source())
+        if value_range is None:
+            stats = provider.bandStatistics(1, QgsRasterBandStats.Min | QgsRasterBandStats.Max,
+                                            QgsRectangle(), sample_size)
+            value_range = (stats.minimumValue, stats.maximumValue)
+        min_value, max_value = value_range
 
         shader = QgsRasterShader()
         color_ramp_shader = QgsColorRampShader()
         color_ramp_shader.setColorRampType(QgsColorRampShader.Interpolated)
-        color_ramp_name = 'RdYlGn'
-
-        color_ramp = QgsStyle().defaultStyle().colorRamp(color_ramp_name)
-        color_ramp_items = []
-        
-        for i in range(num_classes):
-        
-            value = min_value + i * class_interval
-            # Check if the color ramp is 'RdYIGn' to invert it
-            if color_ramp_name == 'RdYlGn':
-            
-                position = 1.0 - (float(i) / (num_classes - 1))
-                #position = float(i) / (num_classes - 1)
-                color = color_ramp.color(position)
-                color_ramp_items.append(QgsColorRampShader.ColorRampItem(value, color, f"{value:.2f}"))
-                color_ramp_shader.setColorRampItemList(color_ramp_items)
-         
+        color_ramp_items = [QgsColorRampShader.ColorRampItem(value, color, f"{value:.2f}")
+                            for value, color in self.heatmap_ramp_stops(value_range)]
         color_ramp_shader.setColorRampItemList(color_ramp_items)
          
         shader.setRasterShaderFunction(color_ramp_shader)
@@ -566,7 +951,7 @@ class OptimalMeasurementPlanner:
                                 extent,
                                 crs)
 
-    def save_rendred_raster(self, raster_layer, out_colorized_raster_path):
+    def save_rendred_raster(self, raster_layer, out_colorized_raster_path, cog=False):
         """
         Save a raster layer with its current renderer (colormap/style) applied.
         Uses QGIS Processing (GDAL) instead of deprecated QgsRasterFileWriter.
@@ -574,10 +959,15 @@ class OptimalMeasurementPlanner:
         Args:
             raster_layer: QgsRasterLayer to export
             out_colorized_raster_path: Output file path (e.g., .tif, .png)
+            cog: Write a Cloud-Optimized GeoTIFF (see raster.write_cog)
         
         Returns:
             Path to the saved raster if successful
         """
+        if cog:
+            return raster.write_cog(raster_layer.source(), out_colorized_raster_path,
+                                    compression=self.cog_compression)
+
         params = {
             'INPUT': raster_layer,
             'TARGET_CRS': raster_layer.crs(),
@@ -595,9 +985,9 @@ class OptimalMeasurementPlanner:
             
     def highlight_best_met(self) :
     
-        output_best_pair_shp_path = os.path.join(self.output_direcory,'Optimal_pair_met_mast.shp')
-        output_best_single_shp_path = os.path.join(self.output_direcory,'Optimal_single_met_mast.shp')
-        output_mast_points_file = os.path.join(self.output_direcory,'mast_points_data.csv')
+        output_best_pair_shp_path = os.path.join(self.work_direcory,'Optimal_pair_met_mast.shp')
+        output_best_single_shp_path = os.path.join(self.work_direcory,'Optimal_single_met_mast.shp')
+        output_mast_points_file = os.path.join(self.work_direcory,'mast_points_data.csv')
         
         input_trix_file = self.dlg.trix_file.text()
         crs = self.dlg.crs.crs().authid()
@@ -608,77 +998,105 @@ class OptimalMeasurementPlanner:
             else:
                 crs = self.get_crs()
             
-            if str(crs) != '' :   
-                choice = self.dlg.comboBox.currentText()
-                if choice == 'Single' :
-                    if not self.layer_exists('Optimal_single_met_mast') :
-                        #self.display_info('Generating Optimal_single_met_mast')
-                        self.process_best_single_met_mast(output_mast_points_file, output_best_single_shp_path, crs)
-                        self.display_success('Optimal_single_met_mast Successfully Generated')
-                    else :
-                        self.display_warning('Optimal_single_met_mast Already Generated')     
+        if str(crs) != '' :   
+            choice = self.dlg.comboBox.currentText()
+            if choice == 'Single' :
+                if not self.layer_exists('Optimal_single_met_mast') :
+                    #self.display_info('Generating Optimal_single_met_mast')
+                    self.process_best_single_met_mast(output_mast_points_file, output_best_single_shp_path, crs)
+                    self.store_highlight(output_best_single_shp_path)
+                    self.display_success('Optimal_single_met_mast Successfully Generated')
+                else :
+                    self.display_warning('Optimal_single_met_mast Already Generated')     
                         
-                elif choice == 'Pair'  :
-                    if not self.layer_exists('Optimal_pair_met_mast') :
-                        #self.display_info('Generating Optimal_pair_met_mast')
-                        self.process_best_two_met_mast(input_trix_file, output_best_pair_shp_path, crs)
-                        self.display_success('Optimal_pair_met_mast Successfully Generated')
-                    else :
-                        self.display_warning('Optimal_pair_met_mast Already Generated')
-                else:
-                    self.display_warning('Select an option for optimal met Mast')
+            elif choice == 'Pair'  :
+                if not self.layer_exists('Optimal_pair_met_mast') :
+                    #self.display_info('Generating Optimal_pair_met_mast')
+                    max_avg_rss = self.dlg.pair_threshold.value() or None
+                    self.process_best_two_met_mast(input_trix_file, output_best_pair_shp_path, crs,
+                                                   self.dlg.top_pairs.value(), max_avg_rss,
+                                                   self.dlg.export_all_pairs.isChecked())
+                    self.store_highlight(output_best_pair_shp_path)
+                    self.display_success('Optimal_pair_met_mast Successfully Generated')
+                else :
+                    self.display_warning('Optimal_pair_met_mast Already Generated')
+
+            elif choice == 'k masts'  :
+                k = self.dlg.k_masts.value()
+                layer_name = f'Optimal_{k}_met_mast'
+                if self.best_k_task is not None :
+                    self.display_warning('A Met Mast Search Is Already Running')
+                elif not self.layer_exists(layer_name) :
+                    if self.valid_k_masts(k) :
+                        output_best_k_shp_path = os.path.join(self.work_direcory, layer_name + '.shp')
+                        solver = 'heuristic' if self.dlg.k_solver.currentText() == 'Greedy + swap' else 'exact'
+                        self.start_best_k_task(k, output_best_k_shp_path, crs, solver, self.dlg.time_budget.value())
+                else :
+                    self.display_warning(f'{layer_name} Already Generated')
+            else:
+                self.display_warning('Select an option for optimal met Mast')
                     
-    def process_best_single_met_mast(self, file_path, output_shapefile_path, crs):
+    def store_highlight(self, outpath):
+        """
+        In the GeoPackage layout, copy a highlighted mast layer and its CSV
+        summaries into the run's GeoPackage and point the map layer at it.
+        """
+        if self.output_layout != 'gpkg' or not os.path.exists(outpath):
+            return
+        gpkg_path = os.path.join(self.output_direcory, self.GEOPACKAGE_NAME)
+        base = os.path.splitext(outpath)[0]
+        layer_name = os.path.basename(base)
+        tables = [base + suffix for suffix in ('_top_pairs.csv', '_masts.csv') if os.path.exists(base + suffix)]
+        self.write_geopackage(gpkg_path, vectors=[outpath], tables=tables, append=True)
+        for layer in QgsProject.instance().mapLayersByName(layer_name):
+            layer.setDataSource(f"{gpkg_path}|layername={layer_name}", layer_name, 'ogr')
 
-        
-        # Step 1: Load the data into a DataFrame
-        data = pd.read_csv(file_path, delimiter=',')  # Assuming the delimiter is a comma, change if needed
+    def process_best_single_met_mast(self, file_path, output_shapefile_path, crs, add_layer=True):
 
-        # Step 2: Find the row with the lowest RSS of uncertainty increases [%]
-        if 'adj_RSS_uncertainty' in data.columns:
-            lowest_rss_row = data.loc[data['adj_RSS_uncertainty'].idxmin()]
+        
+        if self.rss_matrix is not None:
+            # Mean RSS per mast straight from the cached turbine x mast matrix,
+            # coordinates from the mast index
+            rss_values, _, _ = self.get_rss_matrix()
+            best, best_rss = solvers.best_single_mast(rss_values)
             rss_col = 'adj_RSS_uncertainty'
+            lowest_rss_row = dict(zip(self.mast_index['columns'], self.mast_index['coords'][best]))
+            lowest_rss_row[rss_col] = best_rss
         else:
-            lowest_rss_row = data.loc[data['RSS of uncertainty increases [%]'].idxmin()]
-            rss_col = 'RSS of uncertainty increases [%]'
-
-        # Step 3: Create a point feature with the coordinates
-        point = QgsPointXY(lowest_rss_row['Reference Point X [m]'], lowest_rss_row['Reference Point Y [m]'])
-
-        # Create a QgsFeature and set its geometry to the point
-        feature = QgsFeature()
-        feature.setGeometry(QgsGeometry.fromPointXY(point))
-
-        # Step 4: Create a new memory layer to hold this point
-        fields = QgsFields()
-        fields.append(QgsField("ref_x", QMetaType.Double, "double", 20, 6, "Reference Point X [m]"))
-        fields.append(QgsField("ref_y", QMetaType.Double, "double", 20, 6, "Reference Point Y [m]"))
-        fields.append(QgsField("ref_z", QMetaType.Double, "double", 20, 6, "Reference Point Z [m]"))
-        fields.append(QgsField("rix_pct", QMetaType.Double, "double", 10, 2, "Reference RIX [%]"))
-        fields.append(QgsField("rss_uncert_pct", QMetaType.Double, "double", 10, 2, rss_col))
-        # Create a memory vector layer
-        layer = QgsVectorLayer('Point?crs='+crs, 'Optimal_single_met_mast', 'memory')
-        pr = layer.dataProvider()
-
-        # Add fields to the layer
-        pr.addAttributes(fields)
-        layer.updateFields()
-        
-        # Set the feature attributes
-        feature.setAttributes([
-            lowest_rss_row['Reference Point X [m]'],
-            lowest_rss_row['Reference Point Y [m]'],
-            lowest_rss_row['Reference Point Z [m]'],
-            lowest_rss_row['Reference RIX [%]'],
-            lowest_rss_row[rss_col]
-        ])
-        
-        # Add the feature to the layer
-        pr.addFeature(feature)
+            # Step 1: Load the data into a DataFrame
+            data = pd.read_csv(file_path, delimiter=',')  # Assuming the delimiter is a comma, change if needed
+
+            # Step 2: Find the row with the lowest RSS of uncertainty increases [%]
+            if 'adj_RSS_uncertainty' in data.columns:
+                lowest_rss_row = data.loc[data['adj_RSS_uncertainty'].idxmin()]
+                rss_col = 'adj_RSS_uncertainty'
+            else:
+                lowest_rss_row = data.loc[data['RSS of uncertainty increases [%]'].idxmin()]
+                rss_col = 'RSS of uncertainty increases [%]'
+
+        # Step 3: Fields of the point layer
+        fields = [
+            ("ref_x", "double", 20, 6),  # Reference Point X [m]
+            ("ref_y", "double", 20, 6),  # Reference Point Y [m]
+            ("ref_z", "double", 20, 6),  # Reference Point Z [m]
+            ("rix_pct", "double", 10, 2),  # Reference RIX [%]
+            ("rss_uncert_pct", "double", 10, 2)  # rss_col
+        ]
+
+        # Step 4: A point feature at the best mast with its attributes
+        attributes = [
+            float(lowest_rss_row['Reference Point X [m]']),
+            float(lowest_rss_row['Reference Point Y [m]']),
+            float(lowest_rss_row['Reference Point Z [m]']),
+            float(lowest_rss_row['Reference RIX [%]']),
+            float(lowest_rss_row[rss_col])
+        ]
 
-        # Step 5: Save the layer as a shapefile          
+        # Step 5: Save the point as a shapefile          
 
-        noerror = self.save_as_shp(layer, output_shapefile_path, crs)
+        noerror = self.write_point_features(output_shapefile_path, crs, fields,
+                                            [(attributes[0], attributes[1], attributes)],
+                                            'Optimal_single_met_mast')
         
         if noerror :
             print("Shapefile created successfully!")
@@ -686,121 +1104,286 @@ class OptimalMeasurementPlanner:
         # Step 6: Styling the layer
         
 
-        layer = QgsVectorLayer(output_shapefile_path, "Optimal_single_met_mast", "ogr")
-        layer = self.style_point_layer(layer, 'circle','#4bff4b', '3.5')
+        if add_layer:
+            layer = QgsVectorLayer(output_shapefile_path, "Optimal_single_met_mast", "ogr")
+            layer = self.style_point_layer(layer, 'circle','#4bff4b', '3.5')
         
-        # Step 7: Add the layer to the QGIS project
-        QgsProject.instance().addMapLayer(layer)
+            # Step 7: Add the layer to the QGIS project
+            QgsProject.instance().addMapLayer(layer)
                            
-    def process_best_two_met_mast(self, input_trix_file, outpath, crs_epsg):
-    
-        # Extract unique turbines and met masts using their coordinates
-        turbines = self.df_data[['WTG X [m]', 'WTG Y [m]', 'WTG Z [m]']].drop_duplicates().reset_index(drop=True)
-        masts = self.df_data[['Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]']].drop_duplicates().reset_index(drop=True)
-
-        # Also get mast IDs for name field
-        ref_cols = ['Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]', 'Reference RIX [%]', 'mast_id']
-        unique_masts = self.df_data[ref_cols].drop_duplicates().reset_index(drop=True)
-
-        # Create a matrix where rows represent turbines and columns represent met masts
-        rss_matrix = pd.DataFrame(
-            index=pd.MultiIndex.from_arrays([turbines['WTG X [m]'], turbines['WTG Y [m]'], turbines['WTG Z [m]']]),
-            columns=pd.MultiIndex.from_arrays([masts['Reference Point X [m]'], masts['Reference Point Y [m]'], masts['Reference Point Z [m]']])
-        )
+    def get_rss_matrix(self):
+        """
+        Return the turbine x mast RSS matrix of the current run.
+
+        Rows and columns are the positions of turbine_id and mast_id in the
+        turbine and mast indexes (WTG_01 is row 0 and Mast_01 is column 0);
+        turbine/mast combinations missing from the TRIX file are NaN. The
+        matrix is accumulated by aggregate_process_trix_file while the TRIX
+        file is streamed.
+
+        :returns: (rss_matrix, turbine_ids, mast_ids) where rss_matrix is a
+            float32 array of shape (n_turbines, n_masts)
+        :rtype: tuple
+        """
+        return self.rss_matrix, self.rss_turbine_ids, self.rss_mast_ids
 
-        # Instead of using loc, use `at` for efficient assignment
-        for _, row in self.df_data.iterrows():
-            turbine = (row['WTG X [m]'], row['WTG Y [m]'], row['WTG Z [m]'])
-            mast = (row['Reference Point X [m]'], row['Reference Point Y [m]'], row['Reference Point Z [m]'])
-            rss_matrix.at[turbine, mast] = row['adj_RSS_uncertainty']
-
-        # Convert to numpy array for efficient computation
-        rss_values = rss_matrix.to_numpy()
-
-        # Find the best pair of met masts
-        best_pair = None
-        best_total = float('inf')
-        best_min_rss = None
-
-        # Try all combinations of two met masts
-        for (i, j) in combinations(range(len(masts)), 2):
-            # For each turbine, select the minimum RSS between the two masts
-            min_rss = np.minimum(rss_values[:, i], rss_values[:, j])
-            total_rss = np.sum(min_rss)
-            # Track the best combination
-            if total_rss < best_total:
-                best_total = total_rss
-                best_pair = (i, j)
-                best_min_rss = min_rss
+    def process_best_two_met_mast(self, input_trix_file, outpath, crs_epsg, top_k=100, max_avg_rss=None,
+                                  export_all_pairs=False, add_layer=True):
+        """
+        Find the optimal pair of met masts and save it as a shapefile, along
+        with a CSV of the best ranked pairs.
+
+        :param input_trix_file: Path to the TRIX file
+        :param outpath: Output path for the shapefile
+        :param crs_epsg: EPSG code for the CRS
+        :param top_k: Number of ranked pairs written to _top_pairs.csv,
+            None for every pair below max_avg_rss
+        :param max_avg_rss: Optional maximum average RSS of a ranked pair
+        :param export_all_pairs: Also write the total RSS of every pair, in
+            itertools.combinations order of the mast_id codes, to
+            _all_pairs.npy
+        :param add_layer: Add the styled result layer to the project
+        """
+        # Turbine x mast RSS matrix; columns follow the mast index positions
+        rss_values, turbine_ids, mast_ids = self.get_rss_matrix()
+        num_turbines = len(turbine_ids)
+        mast_coords = self.mast_index['coords']
+
+        # Score all pairs of met masts in one blocked pass
+        n_pairs = len(mast_ids) * (len(mast_ids) - 1) // 2
+        all_pairs = None
+        if export_all_pairs and n_pairs > 0:
+            all_pairs = np.lib.format.open_memmap(
+                os.path.splitext(outpath)[0] + '_all_pairs.npy', mode='w+', dtype=np.float64, shape=(n_pairs,))
+        score_threshold = max_avg_rss * num_turbines if max_avg_rss is not None else None
+        best, top_pairs, all_pairs = solvers.evaluate_mast_pairs(
+            rss_values, top_k=top_k, score_threshold=score_threshold, scores_out=all_pairs)
+        if all_pairs is not None:
+            all_pairs.flush()
+            del all_pairs
+        if best is None:
+            self.display_warning('No met mast pair covers every turbine')
+            return
+        best_pair = (best[0], best[1])
+        best_total = best[2]
 
         # Prepare results
-        mast_coords = masts.to_numpy()
         mast1_coords = mast_coords[best_pair[0]]
         mast2_coords = mast_coords[best_pair[1]]
-        # Find mast_id for each mast by matching coordinates
-        def get_mast_id(coords):
-            match = unique_masts[(unique_masts['Reference Point X [m]'] == coords[0]) &
-                                 (unique_masts['Reference Point Y [m]'] == coords[1]) &
-                                 (unique_masts['Reference Point Z [m]'] == coords[2])]
-            if not match.empty:
-                return match.iloc[0]['mast_id']
-            else:
-                return ""
-        mast_ids = [get_mast_id(mast1_coords), get_mast_id(mast2_coords)]
-        pair_total_rss = best_total / len(turbines) if len(turbines) > 0 else float('nan')
-
-        vl = QgsVectorLayer("Point?crs={}".format(crs_epsg), "Optimal_pair_met_mast", "memory")
-        pr = vl.dataProvider()
-
-        # Add attributes (no individual_rss)
-        pr.addAttributes([
-            QgsField("name", QMetaType.QString, "text", 255),  # String field with max 255 characters
-            QgsField("x", QMetaType.Double, "double", 20, 6),  # 20 digits total, 6 decimal places
-            QgsField("y", QMetaType.Double, "double", 20, 6),
-            QgsField("z", QMetaType.Double, "double", 10, 2),   # 10 digits total, 2 decimal places
-            QgsField("pair_total_rss", QMetaType.Double, "double", 20, 6)
-        ])
-        vl.updateFields()
-
-        # Create features
-        for name, coords in zip(mast_ids, [mast1_coords, mast2_coords]):
-            feat = QgsFeature()
-            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(coords[0], coords[1])))
-            feat.setAttributes([
-                name,
-                coords[0],
-                coords[1],
-                coords[2],
-                float(pair_total_rss)
-            ])
-            pr.addFeature(feat)
+        best_mast_ids = [mast_ids[best_pair[0]], mast_ids[best_pair[1]]]
+        pair_total_rss = best_total / num_turbines if num_turbines > 0 else float('nan')
+
+        # Attributes (no individual_rss)
+        fields = [
+            ("name", "text", 255, 0),  # String field with max 255 characters
+            ("x", "double", 20, 6),  # 20 digits total, 6 decimal places
+            ("y", "double", 20, 6),
+            ("z", "double", 10, 2),   # 10 digits total, 2 decimal places
+            ("pair_total_rss", "double", 20, 6)
+        ]
+        features = [
+            (coords[0], coords[1], [str(name), float(coords[0]), float(coords[1]), float(coords[2]),
+                                    float(pair_total_rss)])
+            for name, coords in zip(best_mast_ids, [mast1_coords, mast2_coords])
+        ]
 
-        noerror = self.save_as_shp(vl, outpath, crs_epsg)
+        noerror = self.write_point_features(outpath, crs_epsg, fields, features, "Optimal_pair_met_mast")
 
         if noerror:
             print("Successfully created shapefile at:", outpath)
             # Add layer to QGIS project
-            layer = QgsVectorLayer(outpath, "Optimal_pair_met_mast", "ogr")
-            layer = self.style_point_layer(layer, 'square', '#4bff4b', '3.5')
-            QgsProject.instance().addMapLayer(layer)
+            if add_layer:
+                layer = QgsVectorLayer(outpath, "Optimal_pair_met_mast", "ogr")
+                layer = self.style_point_layer(layer, 'square', '#4bff4b', '3.5')
+                QgsProject.instance().addMapLayer(layer)
             
-            # Output all pairs and their uncertainties to CSV
-            all_pairs_csv = outpath.replace('.shp', '_all_pairs.csv')
-            num_turbines = len(turbines)
-            with open(all_pairs_csv, 'w', newline='') as csvfile:
+            # Output the ranked pairs and their uncertainties to CSV
+            top_pairs_csv = os.path.splitext(outpath)[0] + '_top_pairs.csv'
+            with open(top_pairs_csv, 'w', newline='') as csvfile:
                 writer = csv.writer(csvfile)
-                writer.writerow(['mast_id_1', 'mast_id_2', 'total_rss', 'avg_rss', 'is_best'])
-                for (i, j) in combinations(range(len(masts)), 2):
-                    min_rss = np.minimum(rss_values[:, i], rss_values[:, j])
-                    total_rss = np.sum(min_rss)
+                writer.writerow(['rank', 'mast_id_1', 'mast_id_2', 'total_rss', 'avg_rss', 'is_best'])
+                for rank, (i, j, total_rss) in enumerate(top_pairs, start=1):
                     avg_rss = total_rss / num_turbines if num_turbines > 0 else float('nan')
-                    mast1_coords = masts.iloc[i].values
-                    mast2_coords = masts.iloc[j].values
-                    mast_ids_pair = [get_mast_id(mast1_coords), get_mast_id(mast2_coords)]
                     is_best = (i, j) == best_pair
-                    writer.writerow([mast_ids_pair[0], mast_ids_pair[1], total_rss, avg_rss, is_best])
+                    writer.writerow([rank, mast_ids[i], mast_ids[j], total_rss, avg_rss, is_best])
             
             
+    def valid_k_masts(self, k):
+        """
+        Check that k met masts can be placed on the current RSS matrix,
+        warn otherwise.
+
+        :param k: Number of met masts to place
+        :rtype: bool
+        """
+        n_masts = len(self.get_rss_matrix()[2])
+        if not 1 <= k <= n_masts:
+            self.display_warning(f'Choose between 1 and {n_masts} met masts, got {k}')
+            return False
+        return True
+
+    def solve_best_k_met_mast(self, k, solver='exact', time_budget=30, progress=None):
+        """
+        Search the optimal set of k met masts in the current RSS matrix.
+        Uses no QGIS object, so it can run in a BestKMastsTask.
+
+        :param k: Number of met masts to place, see valid_k_masts
+        :param solver: 'exact' (branch-and-bound) or 'heuristic' (greedy + swap)
+        :param time_budget: Time budget in seconds of the heuristic solver
+        :param progress: Optional callable receiving the progress in percent,
+            raising PipelineCanceled stops the search
+
+        :returns: (selected, total, lower_bound), see solvers.approximate_k_masts
+        :rtype: tuple
+        """
+        rss_values, _, _ = self.get_rss_matrix()
+        if solver == 'heuristic':
+            return solvers.approximate_k_masts(rss_values, k, time_budget=time_budget, progress=progress)
+        selected, best_total = solvers.optimize_k_masts(rss_values, k, progress=progress)
+        return selected, best_total, best_total
+
+    def start_best_k_task(self, k, outpath, crs_epsg, solver='exact', time_budget=30):
+        """
+        Search the best set of k met masts in a BestKMastsTask. Progress goes
+        to a message bar item whose Cancel button (or the QGIS task manager)
+        stops the search; the layer is added when the task finishes.
+        """
+        search = {'k': k, 'outpath': outpath, 'crs': crs_epsg, 'solver': solver, 'time_budget': time_budget}
+        task = BestKMastsTask(self, search)
+        search['message'], search['progress_bar'] = self.create_progress_bar(f'Searching best {k} met masts...')
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(task.cancel)
+        search['message'].layout().addWidget(cancel_button)
+        task.progressChanged.connect(lambda progress: self.best_k_progress(search, progress))
+        self.best_k_task = task
+        QgsApplication.taskManager().addTask(task)
+        return task
+
+    def best_k_progress(self, search, progress):
+        """Progress of a BestKMastsTask (GUI thread)."""
+        try:
+            search['progress_bar'].setValue(int(progress))
+        except RuntimeError:  # Message bar item closed by the user
+            pass
+
+    def best_k_finished(self, search, result):
+        """Write and show the result of a BestKMastsTask (GUI thread)."""
+        try:
+            self.iface.messageBar().popWidget(search['message'])
+        except RuntimeError:  # Message bar item closed by the user
+            pass
+        self.best_k_task = None
+        layer_name = f"Optimal_{search['k']}_met_mast"
+        if result:
+            if self.write_best_k_met_mast(search['k'], search['outpath'], search['crs'], search['solution'],
+                                          search['solver']):
+                self.store_highlight(search['outpath'])
+                self.display_success(f'{layer_name} Successfully Generated')
+        elif 'error' in search:
+            self.display_warning(f"{layer_name} Failed: {search['error']}")
+        else:
+            self.display_warning(f'{layer_name} Canceled')
+
+    def process_best_k_met_mast(self, k, outpath, crs_epsg, solver='exact', time_budget=30, add_layer=True,
+                                feedback=None):
+        """
+        Find the optimal set of k met masts and save it as a shapefile plus a
+        CSV summary of the selected masts.
+
+        :param k: Number of met masts to place
+        :param outpath: Output path for the shapefile
+        :param crs_epsg: EPSG code for the CRS
+        :param solver: 'exact' (branch-and-bound) or 'heuristic' (greedy + swap)
+        :param time_budget: Time budget in seconds of the heuristic solver
+        :param add_layer: Add the styled result layer to the project
+        :param feedback: Optional QgsFeedback receiving the progress, the
+            search raises PipelineCanceled when it is canceled
+        :returns: True if the shapefile was written
+        """
+        if not self.valid_k_masts(k):
+            return False
+        feedback = feedback if feedback is not None else self.message_feedback
+        progressMessageBar, progress_bar = None, None
+        if feedback is None:
+            progressMessageBar, progress_bar = self.create_progress_bar(f'Searching best {k} met masts...')
+
+        def update_progress(percent):
+            if progress_bar is not None:
+                progress_bar.setValue(int(percent))
+                QCoreApplication.processEvents()
+            elif feedback is not None:
+                if feedback.isCanceled():
+                    raise PipelineCanceled()
+                feedback.setProgress(percent)
+
+        try:
+            solution = self.solve_best_k_met_mast(k, solver, time_budget, progress=update_progress)
+        finally:
+            if progressMessageBar is not None:
+                self.iface.messageBar().popWidget(progressMessageBar)
+
+        return self.write_best_k_met_mast(k, outpath, crs_epsg, solution, solver, add_layer)
+
+    def write_best_k_met_mast(self, k, outpath, crs_epsg, solution, solver='exact', add_layer=True):
+        """
+        Save a set of k met masts found by solve_best_k_met_mast as a
+        shapefile plus a CSV summary of the selected masts.
+
+        :param solution: (selected, total, lower_bound) of solve_best_k_met_mast
+        :returns: True if the shapefile was written
+        """
+        rss_values, turbine_ids, mast_ids = self.get_rss_matrix()
+        num_turbines = len(turbine_ids)
+        mast_coords = self.mast_index['coords']
+        selected, best_total, lower_bound = solution
+
+        if not np.isfinite(best_total):
+            self.display_warning(f'No set of {k} met masts covers every turbine')
+            return False
+
+        if solver == 'heuristic':
+            gap = (best_total - lower_bound) / best_total * 100 if best_total > 0 else 0.0
+            self.display_info(f'Greedy + swap solution within {gap:.2f}% of the optimum')
+
+        # Turbines served by each selected mast (the one with the lowest RSS)
+        selected_rss = np.where(np.isnan(rss_values[:, selected]), np.inf, rss_values[:, selected])
+        served = np.bincount(np.argmin(selected_rss, axis=1), minlength=len(selected))
+        avg_rss = best_total / num_turbines if num_turbines > 0 else float('nan')
+
+        fields = [
+            ("name", "text", 255, 0),
+            ("x", "double", 20, 6),
+            ("y", "double", 20, 6),
+            ("z", "double", 10, 2),
+            ("n_turbines", "integer", 0, 0),
+            ("avg_rss", "double", 20, 6)
+        ]
+        features = [
+            (mast_coords[mast][0], mast_coords[mast][1],
+             [str(mast_ids[mast]), float(mast_coords[mast][0]), float(mast_coords[mast][1]),
+              float(mast_coords[mast][2]), int(n_served), float(avg_rss)])
+            for mast, n_served in zip(selected, served)
+        ]
+
+        noerror = self.write_point_features(outpath, crs_epsg, fields, features, f"Optimal_{k}_met_mast")
+
+        if noerror:
+            print("Successfully created shapefile at:", outpath)
+            if add_layer:
+                layer = QgsVectorLayer(outpath, f"Optimal_{k}_met_mast", "ogr")
+                layer = self.style_point_layer(layer, 'diamond', '#4bff4b', '3.5')
+                QgsProject.instance().addMapLayer(layer)
+
+            # Output the selected masts and the set uncertainty to CSV
+            masts_csv = os.path.splitext(outpath)[0] + '_masts.csv'
+            with open(masts_csv, 'w', newline='') as csvfile:
+                writer = csv.writer(csvfile)
+                writer.writerow(['mast_id', 'x', 'y', 'z', 'turbines_served', 'total_rss', 'avg_rss', 'lower_bound'])
+                for mast, n_served in zip(selected, served):
+                    coords = mast_coords[mast]
+                    writer.writerow([mast_ids[mast], coords[0], coords[1], coords[2], int(n_served), best_total, avg_rss, lower_bound])
+        return noerror
+
     def process_best_two_met_mast0(self, input_trix_file, outpath, crs_epsg):
                             
             # Extract unique turbines and met masts using their coordinates
@@ -874,82 +1457,87 @@ class OptimalMeasurementPlanner:
                 layer = self.style_point_layer(layer, 'square','#4bff4b', '3.5')
                 QgsProject.instance().addMapLayer(layer)
      
-    def aggregate_process_trix_file(self, input_trix_file, output_turbine_file, output_mast_points_file):
-        # Optimized file reading: read until stop marker is found
-        with open(input_trix_file, 'r') as f:
-            data_lines = []
-            while True:
-                line = f.readline()
-                # Stop when we hit EOF or our markers
-                if not line or line.startswith(('Assumptions:', '*')):
-                    break
-                data_lines.append(line)
-        
-        # Create DataFrame and clean columns
-        self.df_data = pd.read_csv(io.StringIO(''.join(data_lines)), sep='\t', engine='c')
-        self.df_data.columns = self.df_data.columns.str.strip()
-
-        # Assign unique turbine_id
-        turbine_cols = ['WTG X [m]', 'WTG Y [m]', 'WTG Z [m]', 'WTG RIX [%]']
-        unique_turbines = self.df_data[turbine_cols].drop_duplicates().reset_index(drop=True)
-        unique_turbines['turbine_id'] = ['WTG_{:02d}'.format(i+1) for i in range(len(unique_turbines))]
-        self.df_data = pd.merge(self.df_data, unique_turbines, on=turbine_cols, how='left')
-
-        # Assign unique mast_id
-        ref_cols = ['Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]', 'Reference RIX [%]']
-        unique_masts = self.df_data[ref_cols].drop_duplicates().reset_index(drop=True)
-        unique_masts['mast_id'] = ['Mast_{:02d}'.format(i+1) for i in range(len(unique_masts))]
-        self.df_data = pd.merge(self.df_data, unique_masts, on=ref_cols, how='left')
-
-        # Ensure all relevant columns are numeric to avoid TypeError
-        cols_to_numeric = [
-            'Horiz. Uc increase due to horiz. distance [%]',
-            'Horizontal Distance [m]',
-            'Horiz. Uc increase due to vert. distance [%]',
-            'Vertical uncertainty increase [%]'
-        ]
-        for col in cols_to_numeric:
-            self.df_data[col] = pd.to_numeric(self.df_data[col], errors='coerce')
-
-        # If any of these columns is null, set it to 100 before arithmetic
-        self.df_data['Horiz. Uc increase due to horiz. distance [%]'] = self.df_data['Horiz. Uc increase due to horiz. distance [%]'].fillna(100)
-        self.df_data['Horiz. Uc increase due to vert. distance [%]'] = self.df_data['Horiz. Uc increase due to vert. distance [%]'].fillna(100)
-
-        # --- Begin corrected RSS uncertainty logic ---
-        # 1. Add (Horizontal Distance [m] / 1000) to Horiz. Uc increase due to horiz. distance [%]
-        self.df_data['adj_horiz_uc_horiz_dist'] = (
-            self.df_data['Horiz. Uc increase due to horiz. distance [%]'] +
-            (self.df_data['Horizontal Distance [m]'] / 1000)
-        )
-
-        # 2. Sum with Horiz. Uc increase due to vert. distance [%]
-        self.df_data['adj_sum_horiz_uc'] = (
-            self.df_data['adj_horiz_uc_horiz_dist'] +
-            self.df_data['Horiz. Uc increase due to vert. distance [%]']
-        )
+    def trix_file_key(self, input_trix_file):
+        """
+        Path, size and modification time of a TRIX file: identifies its
+        content without reading it, e.g. on the GUI thread.
 
-        # 3. New RSS uncertainty
-        self.df_data['adj_RSS_uncertainty'] = np.sqrt(
-            self.df_data['adj_sum_horiz_uc']**2 +
-            self.df_data['Vertical uncertainty increase [%]']**2
-        )
+        :rtype: list
+        """
+        stat = os.stat(input_trix_file)
+        return [os.path.abspath(input_trix_file), stat.st_size, stat.st_mtime_ns]
 
-        # 4. Save the full DataFrame before grouping/averaging
-        pre_avg_csv = output_mast_points_file.replace('.csv', '_full.csv')
-        self.df_data.to_csv(pre_avg_csv, index=False)
+    def trix_content_hash(self, input_trix_file):
+        """
+        Hex digest of the content of a TRIX file. Digests are remembered per
+        trix_file_key, so a file is hashed once per change. Reads the whole
+        file, keep it off the GUI thread.
+        """
+        key = tuple(self.trix_file_key(input_trix_file))
+        if key not in self.trix_hashes:
+            self.trix_hashes[key] = trix.trix_content_hash(input_trix_file)
+        return self.trix_hashes[key]
+
+    def trix_cache_dir(self):
+        """Directory of the parsed TRIX cache, in the user cache location."""
+        if self.cache_dir is None:
+            base = QStandardPaths.writableLocation(QStandardPaths.CacheLocation)
+            self.cache_dir = os.path.join(base, 'OptimalMeasurementPlanner', 'trix')
+        return self.cache_dir
+
+    def aggregate_process_trix_file(self, input_trix_file, output_turbine_file, output_mast_points_file,
+                                    chunksize=100000, coerce=False, use_cache=True, write_outputs=True,
+                                    feedback=None):
+        """
+        Stream a TRIX file and write the turbine/mast tables.
+
+        The file is aggregated by trix.aggregate_trix, chunksize rows at a
+        time, into the unique turbines and masts, the turbine x mast RSS
+        matrix and the mean RSS per mast, which are kept on the planner for
+        the solvers and writers. The full CSV is written while streaming.
+
+        The processed rows are cached as binary columns keyed by the TRIX
+        content hash and PIPELINE_VERSION. When the same file is processed
+        again the cached columns are memory-mapped instead of parsing the text.
+
+        :param input_trix_file: Path to the TRIX file
+        :param output_turbine_file: Output CSV of the unique turbines
+        :param output_mast_points_file: Output CSV of the mean RSS per mast
+        :param chunksize: Number of TRIX rows parsed at a time
+        :param coerce: Parse the uncertainty columns as text and coerce them,
+            used automatically when they do not parse as numbers
+        :param use_cache: Read and write the parsed TRIX cache
+        :param write_outputs: Write the CSV tables; without it only the IDs,
+            indexes and RSS matrix of the run are loaded
+        :param feedback: QgsFeedback for the progress, checked for
+            cancellation between chunks (raises PipelineCanceled)
+        """
+        self.rss_matrix = None
+        cache_entry = None
+        if use_cache:
+            cache_entry = trix.trix_cache_entry(self.trix_cache_dir(), self.trix_content_hash(input_trix_file))
+        full_csv = output_mast_points_file.replace('.csv', '_full.csv') if write_outputs else None
+        result = trix.aggregate_trix(input_trix_file, chunksize, coerce, cache_entry, self.TRIX_CACHE_MAX_BYTES,
+                                     full_csv, feedback)
+
+        # Positional indexes shared by the matrix, solvers and writers
+        self.turbine_index = result['turbine_index']
+        self.mast_index = result['mast_index']
+        self.rss_matrix = result['rss_matrix']
+        self.rss_turbine_ids = self.turbine_index['ids']
+        self.rss_mast_ids = self.mast_index['ids']
+        if not write_outputs:
+            return
 
         # Save unique met masts with mast_id
         met_masts_csv = output_mast_points_file.replace('mast_points_data.csv', 'met_masts_locations.csv')
-        unique_masts.to_csv(met_masts_csv, index=False)
+        result['masts'].to_csv(met_masts_csv, index=False)
 
-        # Group reference points and calculate mean of new RSS uncertainty, keeping mast_id
-        grouped_ref = self.df_data.groupby(ref_cols + ['mast_id'], as_index=False, observed=True).agg({
-            'adj_RSS_uncertainty': 'mean'
-        })
-        grouped_ref.to_csv(output_mast_points_file, index=False)
+        # Mean RSS uncertainty per reference point, keeping mast_id
+        result['mast_rss'].to_csv(output_mast_points_file, index=False)
 
         # Save unique turbines with turbine_id
-        unique_turbines.to_csv(output_turbine_file, index=False)
+        result['turbines'].to_csv(output_turbine_file, index=False)
     
   
     def init_ui(self):
@@ -960,9 +1548,12 @@ class OptimalMeasurementPlanner:
         self.dlg.out_dir_sele.setIcon(icon)
         self.dlg.out_dir_sele.setIcon(icon)
 
-        self.dlg.setFixedSize(402, 473)
+        self.dlg.setFixedSize(402, 503)
         
-        self.dlg.comboBox.addItems(['Single', 'Pair'])
+        self.dlg.comboBox.addItems(['Single', 'Pair', 'k masts'])
+        self.dlg.k_solver.addItems(['Exact', 'Greedy + swap'])
+        self.dlg.idw_workers.setValue(os.cpu_count() or 1)
+        self.dlg.pixel_mode.addItems(['Fixed (5 m)', 'Automatic', 'Automatic + refinement'])
         list_countries = self.cities_by_country['country'].drop_duplicates()
         self.dlg.country_input.addItems(list_countries)
 
@@ -974,26 +1565,399 @@ class OptimalMeasurementPlanner:
         self.dlg.start_process.clicked.connect(self.main_process)
         self.dlg.pushButton.clicked.connect(self.highlight_best_met)
         
+    def stage_fingerprint(self, params, upstream):
+        """
+        Fingerprint of a pipeline stage: a hash of its own parameters and of
+        the fingerprints of the stages it reads from, so a change anywhere
+        upstream makes the stage stale.
+        """
+        payload = json.dumps({'params': params, 'upstream': upstream}, sort_keys=True, default=str)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).hexdigest()
+
+    def load_pipeline_state(self, output_dir):
+        """Stage fingerprints recorded in a results folder, empty if none."""
+        state_path = os.path.join(output_dir, 'pipeline_state.json')
+        if not os.path.exists(state_path):
+            return {}
+        with open(state_path) as f:
+            return json.load(f)
+
+    def save_pipeline_state(self, output_dir, state):
+        state_path = os.path.join(output_dir, 'pipeline_state.json')
+        with open(state_path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(state_path + '.tmp', state_path)
+
+    def find_results_folder(self, out_dir, trix_hash=None, trix_file=None):
+        """
+        Most recent results folder of out_dir produced from the same TRIX
+        content, or None. The content is matched by its trix_content_hash,
+        or by the trix_file_key of the file last processed in the folder.
+        """
+        if not os.path.isdir(out_dir):
+            return None
+        candidates = sorted(
+            (name for name in os.listdir(out_dir) if name.startswith('met_mast_process_results_')),
+            reverse=True)
+        for name in candidates:
+            folder = os.path.join(out_dir, name)
+            state = self.load_pipeline_state(folder)
+            if ((trix_hash is not None and state.get('trix') == trix_hash)
+                    or (trix_file is not None and state.get('trix_file') == trix_file)):
+                return folder
+        return None
+
+    def results_folder(self, out_dir, trix_hash=None, trix_file=None):
+        """
+        Results folder of a TRIX file in out_dir: the latest one made from
+        the same TRIX content (see find_results_folder), else a new
+        timestamped folder. The folder is created.
+        """
+        output_dir = self.find_results_folder(out_dir, trix_hash, trix_file)
+        if output_dir is None:
+            current_datetime = datetime.now(UTC).strftime("%Y-%m-%d_%H-%M")
+            warnings.filterwarnings(action="ignore", message=r"datetime.datetime.utcnow")
+            output_dir = os.path.join(out_dir, 'met_mast_process_results_'+current_datetime) 
+            suffix = 1
+            while os.path.exists(output_dir):
+                suffix += 1
+                output_dir = os.path.join(out_dir, f'met_mast_process_results_{current_datetime}_{suffix}')
+        os.makedirs(output_dir, exist_ok=True)
+        return output_dir
+
+    def work_directory(self, output_dir):
+        """
+        Folder of the stage files of a results folder: the folder itself, or
+        in the GeoPackage layout a folder in the user cache, so only the
+        GeoPackage is written to output_dir (often a network share) while
+        unchanged stages can still be reused.
+        """
+        if self.output_layout != 'gpkg':
+            return output_dir
+        key = hashlib.blake2b(os.path.abspath(output_dir).encode('utf-8'), digest_size=8).hexdigest()
+        work_dir = os.path.join(os.path.dirname(self.trix_cache_dir()), 'runs', key)
+        os.makedirs(work_dir, exist_ok=True)
+        return work_dir
+
+    def pipeline_stages(self, input_trix_file, output_dir, crs):
+        """
+        Stage graph of the main process.
+
+        Every stage lists the stages it reads from ('deps'), the parameters
+        that change its result ('params', or a callable returning them when
+        they are costly to get, evaluated by run_stage), the files it writes
+        ('outputs') and how to produce them ('run'). 'load' restores what
+        later steps need when the stage is up to date and is skipped. Both
+        take a QgsFeedback (or None), only do file work and may run in a
+        background task; 'show' then creates the stage's layers and adds them
+        to the project, on the GUI thread.
+
+        :returns: List of stages in dependency order
+        :rtype: list
+        """
+        work_dir = self.work_directory(output_dir)
+        output_mast_points_file = os.path.join(work_dir, 'mast_points_data.csv')
+        output_turbine_file = os.path.join(work_dir, 'turbines_locations.csv')
+        output_met_mast_points_shp_path = os.path.join(work_dir, 'met_mast_points.shp')
+        output_turbins_shp_path = os.path.join(work_dir, 'wind_turbins.shp')
+        output_idw_raster = os.path.join(work_dir, 'idw_met_mast.tif')
+        output_refined_raster = os.path.join(work_dir, 'idw_met_mast_refined.tif')
+        refine = self.pixel_mode == 'refine'
+        value_ranges = {}
+        out_colorized_raster_path = os.path.join(work_dir, 'idw_met_mast_heatmap.tif')
+        gpkg_path = os.path.join(output_dir, self.GEOPACKAGE_NAME)
+        layers = self.pipeline_layers
+        # The stages may run in a background task, read the style here
+        ramp_colors = self.heatmap_ramp_colors()
+
+        def aggregate(feedback=None, write_outputs=True):
+            self.aggregate_process_trix_file(input_trix_file, output_turbine_file, output_mast_points_file,
+                                             write_outputs=write_outputs, feedback=feedback)
+
+        def met_mast_layer(feedback=None):
+            self.write_met_mast_points(output_mast_points_file, crs, output_met_mast_points_shp_path)
+
+        def show_met_mast_layer():
+            layer = QgsVectorLayer(output_met_mast_points_shp_path, "Met Mass Points", "ogr")
+            layers['met_mast'] = self.style_point_layer(layer, 'circle', 'magenta', '1.8')
+            QgsProject.instance().addMapLayer(layers['met_mast'])
+            self.set_layer_visibility(layers['met_mast'], visible=False)
+
+        def idw_range(feedback=None):
+            # IDW values lie within the mast values: colour by that range so
+            # the heatmap, written while interpolating, and the styled base
+            # and refined layers all match
+            if 'idw' not in value_ranges:
+                mast_layer = QgsVectorLayer(output_met_mast_points_shp_path, "Met Mass Points", "ogr")
+                _, values = self.idw_points(mast_layer)
+                value_ranges['idw'] = (float(values.min()), float(values.max())) if len(values) else None
+            return value_ranges['idw']
+
+        def idw(feedback=None):
+            pixel_budget = None if self.pixel_mode == 'fixed' else self.pixel_budget
+            refine_points = self.turbine_index['coords'][:, :2] if refine else None
+            value_range = idw_range()
+            self.generate_idw_raster(
+                QgsVectorLayer(output_met_mast_points_shp_path, "Met Mass Points", "ogr"), output_idw_raster,
+                self.pixel_size, self.idw_power, self.idw_neighbours, self.idw_radius, self.idw_workers,
+                pixel_budget=pixel_budget, refine_factor=self.refine_factor if refine else 1,
+                refine_points=refine_points, refine_distance=self.refine_distance,
+                cog=self.raster_format == 'cog', heatmap_raster=out_colorized_raster_path,
+                ramp_stops=self.heatmap_ramp_stops(value_range or (0.0, 0.0), colors=ramp_colors),
+                feedback=feedback)
+
+        def show_heatmap():
+            raster_layer = QgsRasterLayer(output_idw_raster, "idw_met_mast_heatmap")
+            layers['heatmap'] = self.apply_color_ramp(raster_layer, idw_range())
+            QgsProject.instance().addMapLayer(layers['heatmap'])
+            if refine:
+                raster_layer = QgsRasterLayer(output_refined_raster, "idw_met_mast_refined")
+                layers['refined'] = self.apply_color_ramp(raster_layer, idw_range())
+                QgsProject.instance().addMapLayer(layers['refined'])
+
+        def geopackage(feedback=None):
+            highlights = sorted(name for name in os.listdir(work_dir) if name.startswith('Optimal_'))
+            self.write_geopackage(
+                gpkg_path,
+                vectors=[output_met_mast_points_shp_path, output_turbins_shp_path]
+                + [os.path.join(work_dir, name) for name in highlights if name.endswith('.shp')],
+                tables=[output_mast_points_file, output_turbine_file,
+                        output_mast_points_file.replace('.csv', '_full.csv'),
+                        os.path.join(work_dir, 'met_masts_locations.csv')]
+                + [os.path.join(work_dir, name) for name in highlights if name.endswith('.csv')],
+                rasters=[(output_idw_raster, 'TIFF'), (out_colorized_raster_path, 'PNG')]
+                + ([(output_refined_raster, 'TIFF')] if refine else []))
+
+        def show_geopackage():
+            # Same layers and styles, read from the GeoPackage
+            for key, path in (('met_mast', output_met_mast_points_shp_path), ('turbines', output_turbins_shp_path)):
+                if key not in layers:
+                    continue
+                table = os.path.splitext(os.path.basename(path))[0]
+                layers[key].setDataSource(f"{gpkg_path}|layername={table}", layers[key].name(), 'ogr')
+            for key, table in (('heatmap', 'idw_met_mast'), ('refined', 'idw_met_mast_refined')):
+                if key in layers:
+                    layers[key].setDataSource(f"GPKG:{gpkg_path}:{table}", layers[key].name(), 'gdal')
+                    self.apply_color_ramp(layers[key], idw_range())
+
+        def turbines(feedback=None):
+            self.write_turbine_points(output_turbine_file, output_turbins_shp_path, crs)
+
+        def show_turbines():
+            layer = QgsVectorLayer(output_turbins_shp_path, "Wind Turbines", "ogr")
+            layers['turbines'] = self.style_point_layer(layer, 'star', 'red', '4')
+            QgsProject.instance().addMapLayer(layers['turbines'])
+
+        return [
+            {'name': 'aggregate', 'deps': [],
+             # Hashing reads the whole TRIX file, done in the stage's task
+             'params': lambda: {'trix': self.trix_content_hash(input_trix_file), 'version': self.PIPELINE_VERSION},
+             'outputs': [output_mast_points_file, output_turbine_file,
+                         output_mast_points_file.replace('.csv', '_full.csv'),
+                         os.path.join(work_dir, 'met_masts_locations.csv')],
+             'run': aggregate, 'load': lambda feedback=None: aggregate(feedback, write_outputs=False),
+             'show': None},
+            {'name': 'met_mast_layer', 'deps': ['aggregate'], 'params': {'crs': crs},
+             'outputs': [output_met_mast_points_shp_path],
+             'run': met_mast_layer, 'load': None, 'show': show_met_mast_layer},
+            {'name': 'idw', 'deps': ['met_mast_layer'],
+             'params': {'pixel_size': self.pixel_size, 'power': self.idw_power,
+                        'neighbours': self.idw_neighbours, 'radius': self.idw_radius,
+                        'pixel_mode': self.pixel_mode, 'pixel_budget': self.pixel_budget,
+                        'refine_factor': self.refine_factor if refine else 1,
+                        'refine_distance': self.refine_distance if refine else None,
+                        'format': self.raster_format, 'compression': self.cog_compression},
+             'outputs': [output_idw_raster, out_colorized_raster_path]
+                        + ([output_refined_raster] if refine else []),
+             'run': idw, 'load': None, 'show': None},
+            {'name': 'heatmap', 'deps': ['idw'], 'params': {}, 'outputs': [],
+             'run': idw_range, 'load': idw_range, 'show': show_heatmap},
+            {'name': 'turbines', 'deps': ['aggregate'], 'params': {'crs': crs},
+             'outputs': [output_turbins_shp_path], 'run': turbines, 'load': None, 'show': show_turbines},
+        ] + ([{'name': 'geopackage', 'deps': ['aggregate', 'met_mast_layer', 'idw', 'heatmap', 'turbines'],
+               'params': {}, 'outputs': [gpkg_path], 'run': geopackage, 'load': None,
+               'show': show_geopackage}]
+             if self.output_layout == 'gpkg' else [])
+
+    def start_pipeline(self, input_trix_file, output_dir, crs):
+        """
+        Set up a run of the main process stages (see run_stage).
+
+        :returns: Pipeline run: the results folder, its recorded state, the
+            trix_file_key of the TRIX file, the stages, their fingerprints so
+            far, the recomputed stages and the lock guarding them while stages
+            run concurrently
+        :rtype: dict
+        """
+        self.pipeline_layers.clear()
+        return {'output_dir': output_dir, 'state': self.load_pipeline_state(output_dir),
+                'trix_file': self.trix_file_key(input_trix_file),
+                'stages': self.pipeline_stages(input_trix_file, output_dir, crs),
+                'fingerprints': {}, 'recomputed': [], 'lock': threading.Lock()}
+
+    def run_stage(self, pipeline, stage, feedback=None):
+        """
+        Bring one stage of a pipeline run up to date.
+
+        A stage is stale when its fingerprint differs from the one recorded
+        in the results folder's pipeline_state.json, one of its outputs is
+        missing or a stage it reads from was recomputed. Stale stages are
+        run, up to date stages are skipped and only their outputs loaded.
+        Does no GUI work (see show_stage) and may run in several threads at
+        once for stages that do not depend on each other; the stages it
+        reads from must be done.
+
+        :param pipeline: Pipeline run of start_pipeline
+        :param feedback: QgsFeedback passed to the stage
+        :returns: True when the stage was recomputed
+        :rtype: bool
+        """
+        output_dir, state = pipeline['output_dir'], pipeline['state']
+        fingerprints, recomputed = pipeline['fingerprints'], pipeline['recomputed']
+        params = stage['params']() if callable(stage['params']) else stage['params']
+        with pipeline['lock']:
+            fingerprint = self.stage_fingerprint(params, [fingerprints[dep] for dep in stage['deps']])
+            fingerprints[stage['name']] = fingerprint
+            stale = (any(dep in recomputed for dep in stage['deps'])
+                     or state.get('stages', {}).get(stage['name']) != fingerprint
+                     or not all(os.path.exists(path) for path in stage['outputs']))
+            # Forget the old fingerprint first, a failed or canceled run stays stale
+            if stale and state.get('stages', {}).pop(stage['name'], None) is not None:
+                self.save_pipeline_state(output_dir, state)
+        if not stale:
+            if stage['load'] is not None:
+                stage['load'](feedback)
+            return False
+
+        stage['run'](feedback)
+        with pipeline['lock']:
+            recomputed.append(stage['name'])
+            if stage['name'] in ('aggregate', 'met_mast_layer'):
+                # Highlighted masts are made on demand from the TRIX data
+                # in the CRS, drop them so they are generated again
+                work_dir = self.work_directory(output_dir)
+                for name in os.listdir(work_dir):
+                    if name.startswith('Optimal_'):
+                        os.remove(os.path.join(work_dir, name))
+            state.setdefault('stages', {})[stage['name']] = fingerprint
+            if stage['name'] == 'aggregate':
+                state['trix'] = params['trix']
+                state['trix_file'] = pipeline['trix_file']
+            self.save_pipeline_state(output_dir, state)
+        return True
+
+    def show_stage(self, stage):
+        """Add the layers of a finished stage to the project (GUI thread)."""
+        if stage['show'] is not None:
+            stage['show']()
+
+    def run_pipeline(self, input_trix_file, output_dir, crs, feedback=None, show=True, workers=1):
+        """
+        Run the stale stages of the main process and wait for them
+        (main_process runs them as a PipelineTask instead).
+
+        Stages are started on a thread pool as soon as the stages they read
+        from are done, so with workers > 1 independent stages run at the same
+        time. Layers are only added to the project from the calling thread,
+        when their stage is done.
+
+        :param feedback: QgsFeedback passed to every stage and checked for
+            cancellation before a stage is started
+        :param show: Add the layers of every stage to the project
+        :param workers: Number of stages run at the same time
+        :returns: Names of the stages that were recomputed
+        :rtype: list
+        """
+        pipeline = self.start_pipeline(input_trix_file, output_dir, crs)
+        pending = list(pipeline['stages'])
+        running = {}
+        done = set()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or running:
+                for stage in [stage for stage in pending if all(dep in done for dep in stage['deps'])]:
+                    if feedback is not None and feedback.isCanceled():
+                        raise PipelineCanceled()
+                    pending.remove(stage)
+                    running[executor.submit(self.run_stage, pipeline, stage, feedback)] = stage
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    future.result()
+                    done.add(stage['name'])
+                    if show:
+                        self.show_stage(stage)
+        return pipeline['recomputed']
+
+    def pipeline_progress(self, pipeline, task_id, progress):
+        """Show the progress of the running pipeline task in the dialog and message bar."""
+        if task_id != pipeline.get('task_id'):
+            return
+        self.dlg.process.setText(f"Processing... {progress:.0f} %")
+        try:
+            pipeline['progress_bar'].setValue(int(progress))
+        except RuntimeError:  # Message bar item closed by the user
+            pass
+
+    def pipeline_finished(self, pipeline, result):
+        """Report the end of a pipeline task (GUI thread)."""
+        QgsApplication.taskManager().progressChanged.disconnect(pipeline['progress_slot'])
+        try:
+            self.iface.messageBar().popWidget(pipeline['message'])
+        except RuntimeError:  # Message bar item closed by the user
+            pass
+        self.pipeline_task = None
+        self.dlg.start_process.setEnabled(True)
+        if result:
+            self.dlg.process.setText("Done")
+            if pipeline['recomputed']:
+                self.display_success("Process Successfully Done !")
+            else:
+                self.display_success("Outputs Up To Date, Nothing To Recompute")
+            self.dlg.tabWidget.setTabEnabled(1, True)
+        elif 'error' in pipeline:
+            self.dlg.process.setText("Failed")
+            self.display_warning(f"Process Failed: {pipeline['error']}")
+        else:
+            self.dlg.process.setText("Canceled")
+            self.display_warning("Process Canceled, Finished Stages Are Kept")
+
+    def start_pipeline_task(self, input_trix_file, output_dir, crs):
+        """
+        Run the main process stages in the background as a PipelineTask.
+
+        Every stage is a subtask started when the previous one is done; the
+        layers of a stage are added to the project when it finishes. Progress
+        goes to the process label and a message bar item whose Cancel button
+        (or the QGIS task manager) stops the run between chunks or tiles.
+        """
+        pipeline = self.start_pipeline(input_trix_file, output_dir, crs)
+        task = PipelineTask(self, pipeline)
+        pipeline['message'], pipeline['progress_bar'] = self.create_progress_bar("Processing TRIX file...")
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(task.cancel)
+        pipeline['message'].layout().addWidget(cancel_button)
+
+        task_manager = QgsApplication.taskManager()
+        pipeline['progress_slot'] = lambda task_id, progress: self.pipeline_progress(pipeline, task_id, progress)
+        task_manager.progressChanged.connect(pipeline['progress_slot'])
+        self.pipeline_task = task
+        self.dlg.start_process.setEnabled(False)
+        self.dlg.process.setText("Processing...")
+        pipeline['task_id'] = task_manager.addTask(task)
+        return task
+
     def main_process(self):
            
           
         input_trix_file = self.dlg.trix_file.text()
         
         out_dir = self.dlg.out_dir.text()
-        if input_trix_file != '':
+        if self.pipeline_task is not None:
+            self.display_warning('A Process Is Already Running')
+        elif input_trix_file != '':
             if out_dir != '':
                 
 
-                current_datetime = datetime.now(UTC).strftime("%Y-%m-%d_%H-%M")
-                warnings.filterwarnings(action="ignore", message=r"datetime.datetime.utcnow")
-                self.output_direcory = os.path.join(out_dir, 'met_mast_process_results_'+current_datetime) 
-                output_mast_points_file = os.path.join(self.output_direcory,'mast_points_data.csv')
-                output_turbine_file = os.path.join(self.output_direcory,'turbines_locations.csv')
-                output_met_mast_points_shp_path = os.path.join(self.output_direcory,'met_mast_points.shp')
-                output_turbins_shp_path = os.path.join(self.output_direcory,'wind_turbins.shp')
-                output_idw_raster = os.path.join(self.output_direcory,'idw_met_mast.tif')
-                out_colorized_raster_path = os.path.join(self.output_direcory,'idw_met_mast_heatmap.tif')
-                
                 crs = self.dlg.crs.crs().authid()
 
                 if str(crs) == '' :
@@ -1003,35 +1967,26 @@ class OptimalMeasurementPlanner:
                         crs = self.get_crs()
                 
                 if str(crs) != '' :   
-                    if not os.path.exists(self.output_direcory):
-                        os.makedirs(self.output_direcory)
-                        
-                        #self.display_info('Processing Heatmap')
-                      
-                        self.dlg.process.setStyleSheet("""
-                                                QLabel {
-                                                    font-weight: bold;
-                                                    color: #3498db;  /* Nice blue color */
-                                                }
-                                            """)
-
-                        self.aggregate_process_trix_file(input_trix_file, output_turbine_file, output_mast_points_file)               
-                        met_mast_layer = self.create_met_mast_layer(output_mast_points_file, crs, output_met_mast_points_shp_path)
-                        
-                        self.add_osm_basemap()
-                        self.generate_idw_raster(met_mast_layer, output_met_mast_points_shp_path, output_idw_raster)
-                        
-                        raster_layer = QgsRasterLayer(output_idw_raster, "idw_met_mast_heatmap")
-                        raster_layer = self.apply_color_ramp(raster_layer)
-                        
-                        self.save_rendred_raster(raster_layer, out_colorized_raster_path)
+                    # Re-use the latest results of the same TRIX file, only
+                    # the stages whose inputs changed are recomputed
+                    self.output_direcory = self.results_folder(out_dir, trix_file=self.trix_file_key(input_trix_file))
                         
-                        QgsProject.instance().addMapLayer(raster_layer)
-                        QgsProject.instance().addMapLayer(met_mast_layer)
-                        self.set_layer_visibility(met_mast_layer, visible=False)
-                        self.create_turbine_shapefile(output_turbine_file, output_turbins_shp_path, crs)
-                        self.display_success("Process Successfully Done !")
-                        self.dlg.tabWidget.setTabEnabled(1, True)
+                    #self.display_info('Processing Heatmap')
+                  
+                    self.dlg.process.setStyleSheet("""
+                                            QLabel {
+                                                font-weight: bold;
+                                                color: #3498db;  /* Nice blue color */
+                                            }
+                                        """)
+
+                    self.add_osm_basemap()
+                    self.idw_workers = self.dlg.idw_workers.value()
+                    self.pixel_mode = ['fixed', 'auto', 'refine'][self.dlg.pixel_mode.currentIndex()]
+                    self.raster_format = 'cog' if self.dlg.cog_output.isChecked() else 'gtiff'
+                    self.output_layout = 'gpkg' if self.dlg.gpkg_output.isChecked() else 'files'
+                    self.work_direcory = self.work_directory(self.output_direcory)
+                    self.start_pipeline_task(input_trix_file, self.output_direcory, crs)
                         
             else: 
                 self.display_warning('Please Choose Output Directory')  
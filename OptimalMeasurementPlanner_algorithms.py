@@ -0,0 +1,362 @@
+# -*- coding: utf-8 -*-
+"""
+Processing algorithms of the OptimalMeasurementPlanner provider.
+
+Every algorithm runs a headless OptimalMeasurementPlanner (no interface):
+its messages and progress go to the Processing feedback and its results are
+written to the algorithm outputs instead of being added to the project, so
+the algorithms can run in the background, in batch mode and with
+qgis_process.
+"""
+import os
+
+import numpy as np
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import (
+    QgsProcessing,
+    QgsProcessingAlgorithm,
+    QgsProcessingException,
+    QgsProcessingOutputFile,
+    QgsProcessingOutputNumber,
+    QgsProcessingOutputRasterLayer,
+    QgsProcessingParameterBoolean,
+    QgsProcessingParameterCrs,
+    QgsProcessingParameterDefinition,
+    QgsProcessingParameterEnum,
+    QgsProcessingParameterField,
+    QgsProcessingParameterFile,
+    QgsProcessingParameterFolderDestination,
+    QgsProcessingParameterNumber,
+    QgsProcessingParameterRasterDestination,
+    QgsProcessingParameterVectorDestination,
+    QgsProcessingParameterVectorLayer,
+    QgsProcessingUtils,
+)
+
+from .compute import PipelineCanceled
+from .OptimalMeasurementPlanner import OptimalMeasurementPlanner
+
+
+class PlannerAlgorithm(QgsProcessingAlgorithm):
+    """Base of the provider's algorithms: the headless planner and the TRIX inputs."""
+
+    INPUT = 'INPUT'
+    CRS = 'CRS'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return type(self)()
+
+    def group(self):
+        return self.tr('Met mast planning')
+
+    def groupId(self):
+        return 'metmastplanning'
+
+    def planner(self, feedback):
+        """Planner without interface, reporting to the algorithm feedback."""
+        planner = OptimalMeasurementPlanner(None)
+        planner.message_feedback = feedback
+        return planner
+
+    def add_trix_parameters(self):
+        self.addParameter(QgsProcessingParameterFile(self.INPUT, self.tr('TRIX file'), extension='txt'))
+        self.addParameter(QgsProcessingParameterCrs(self.CRS, self.tr('Project CRS')))
+
+    def parameter_as_crs(self, parameters, context):
+        """CRS parameter as an authority id, or WKT for a custom CRS."""
+        crs = self.parameterAsCrs(parameters, self.CRS, context)
+        if not crs.isValid():
+            raise QgsProcessingException(self.tr('Invalid project CRS'))
+        return crs.authid() or crs.toWkt()
+
+    def load_trix(self, planner, parameters, context, feedback):
+        """
+        Parse the TRIX file into the planner's RSS matrix and ID indexes
+        (served from the parsed TRIX cache when the file was seen before),
+        without writing the CSV tables.
+
+        :returns: Path of the TRIX file
+        :rtype: str
+        """
+        trix_file = self.parameterAsFile(parameters, self.INPUT, context)
+        folder = QgsProcessingUtils.tempFolder()
+        self.run_planner(planner.aggregate_process_trix_file, trix_file,
+                         os.path.join(folder, 'turbines_locations.csv'),
+                         os.path.join(folder, 'mast_points_data.csv'), write_outputs=False, feedback=feedback)
+        return trix_file
+
+    def run_planner(self, method, *args, **kwargs):
+        """Call a planner method, a canceled run becomes a QgsProcessingException."""
+        try:
+            return method(*args, **kwargs)
+        except PipelineCanceled:
+            raise QgsProcessingException(self.tr('Canceled'))
+
+    def check_outputs(self, *paths):
+        """Raise a QgsProcessingException when the planner did not write an output."""
+        for path in paths:
+            if not os.path.exists(path):
+                raise QgsProcessingException(self.tr('No output written to {}, see the log').format(path))
+
+
+class AggregateTrixAlgorithm(PlannerAlgorithm):
+
+    OUTPUT_FOLDER = 'OUTPUT_FOLDER'
+    OUTPUT_MASTS = 'OUTPUT_MASTS'
+    OUTPUT_TURBINES = 'OUTPUT_TURBINES'
+
+    def name(self):
+        return 'aggregatetrix'
+
+    def displayName(self):
+        return self.tr('TRIX aggregation')
+
+    def shortHelpString(self):
+        return self.tr('Reads a WindPRO TRIX file, assigns turbine and met mast IDs and writes the '
+                       'mean RSS uncertainty per met mast as a point layer, the turbines as a point '
+                       'layer and the TRIX tables as CSV files.')
+
+    def initAlgorithm(self, config=None):
+        self.add_trix_parameters()
+        self.addParameter(QgsProcessingParameterFolderDestination(self.OUTPUT_FOLDER, self.tr('CSV tables')))
+        self.addParameter(QgsProcessingParameterVectorDestination(
+            self.OUTPUT_MASTS, self.tr('Met mast points'), QgsProcessing.TypeVectorPoint))
+        self.addParameter(QgsProcessingParameterVectorDestination(
+            self.OUTPUT_TURBINES, self.tr('Wind turbines'), QgsProcessing.TypeVectorPoint))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        planner = self.planner(feedback)
+        trix_file = self.parameterAsFile(parameters, self.INPUT, context)
+        crs = self.parameter_as_crs(parameters, context)
+        folder = self.parameterAsString(parameters, self.OUTPUT_FOLDER, context)
+        masts_path = self.parameterAsOutputLayer(parameters, self.OUTPUT_MASTS, context)
+        turbines_path = self.parameterAsOutputLayer(parameters, self.OUTPUT_TURBINES, context)
+        os.makedirs(folder, exist_ok=True)
+
+        mast_points_file = os.path.join(folder, 'mast_points_data.csv')
+        turbine_file = os.path.join(folder, 'turbines_locations.csv')
+        self.run_planner(planner.aggregate_process_trix_file, trix_file, turbine_file, mast_points_file,
+                         feedback=feedback)
+        planner.write_met_mast_points(mast_points_file, crs, masts_path)
+        planner.write_turbine_points(turbine_file, turbines_path, crs)
+        return {self.OUTPUT_FOLDER: folder, self.OUTPUT_MASTS: masts_path, self.OUTPUT_TURBINES: turbines_path}
+
+
+class MastHeatmapAlgorithm(PlannerAlgorithm):
+
+    FIELD = 'FIELD'
+    PIXEL_SIZE = 'PIXEL_SIZE'
+    IDW_POWER = 'IDW_POWER'
+    RESOLUTION = 'RESOLUTION'
+    TURBINES = 'TURBINES'
+    WORKERS = 'WORKERS'
+    COG = 'COG'
+    OUTPUT_HEATMAP = 'OUTPUT_HEATMAP'
+    OUTPUT_REFINED = 'OUTPUT_REFINED'
+    MINIMUM = 'MINIMUM'
+    MAXIMUM = 'MAXIMUM'
+    RESOLUTIONS = ['fixed', 'auto', 'refine']
+
+    def name(self):
+        return 'mastheatmap'
+
+    def displayName(self):
+        return self.tr('Met mast heatmap')
+
+    def shortHelpString(self):
+        return self.tr('Interpolates the RSS uncertainty of met mast points (e.g. from TRIX aggregation) '
+                       'with inverse distance weighting, as qgis:idwinterpolation does, and writes the '
+                       'colorized heatmap in the same pass. Automatic resolution picks the pixel size '
+                       'from the site within a pixel budget (the pixel size is then the finest size); '
+                       'refinement also writes a finer raster near the masts and turbines.')
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.INPUT, self.tr('Met mast points'), [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterField(
+            self.FIELD, self.tr('Interpolated field'), 'RSS_uncertainty_increases_percent', self.INPUT,
+            QgsProcessingParameterField.Numeric))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.PIXEL_SIZE, self.tr('Pixel size'), QgsProcessingParameterNumber.Double, 5, minValue=0.001))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.IDW_POWER, self.tr('IDW power'), QgsProcessingParameterNumber.Double, 2, minValue=0))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.RESOLUTION, self.tr('Resolution'),
+            [self.tr('Fixed pixel size'), self.tr('Automatic'), self.tr('Automatic + refinement')], defaultValue=0))
+        self.addParameter(QgsProcessingParameterVectorLayer(
+            self.TURBINES, self.tr('Wind turbines (refinement)'), [QgsProcessing.TypeVectorPoint], optional=True))
+        advanced = [
+            QgsProcessingParameterNumber(self.WORKERS, self.tr('Worker processes'),
+                                         QgsProcessingParameterNumber.Integer, 1, minValue=1),
+            QgsProcessingParameterBoolean(self.COG, self.tr('Cloud-Optimized GeoTIFF'), False),
+        ]
+        for parameter in advanced:
+            parameter.setFlags(parameter.flags() | QgsProcessingParameterDefinition.FlagAdvanced)
+            self.addParameter(parameter)
+        self.addParameter(QgsProcessingParameterRasterDestination(self.OUTPUT, self.tr('IDW raster')))
+        self.addParameter(QgsProcessingParameterRasterDestination(
+            self.OUTPUT_HEATMAP, self.tr('Heatmap (RGBA)'), optional=True))
+        self.addOutput(QgsProcessingOutputRasterLayer(self.OUTPUT_REFINED, self.tr('Refined IDW raster')))
+        self.addOutput(QgsProcessingOutputNumber(self.MINIMUM, self.tr('Minimum value')))
+        self.addOutput(QgsProcessingOutputNumber(self.MAXIMUM, self.tr('Maximum value')))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        # Runs on the main thread: read the heatmap colours from the QGIS
+        # style here, processAlgorithm may run in a background thread
+        self.ramp_colors = self.planner(feedback).heatmap_ramp_colors()
+        return True
+
+    def processAlgorithm(self, parameters, context, feedback):
+        planner = self.planner(feedback)
+        layer = self.parameterAsVectorLayer(parameters, self.INPUT, context)
+        field = self.parameterAsString(parameters, self.FIELD, context)
+        pixel_size = self.parameterAsDouble(parameters, self.PIXEL_SIZE, context)
+        power = self.parameterAsDouble(parameters, self.IDW_POWER, context)
+        resolution = self.RESOLUTIONS[self.parameterAsEnum(parameters, self.RESOLUTION, context)]
+        turbines = self.parameterAsVectorLayer(parameters, self.TURBINES, context)
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        heatmap = self.parameterAsOutputLayer(parameters, self.OUTPUT_HEATMAP, context) or None
+
+        refine_points = None
+        if resolution == 'refine' and turbines is not None:
+            refine_points = np.array([(point.x(), point.y()) for point in
+                                      (feature.geometry().asPoint() for feature in turbines.getFeatures()
+                                       if not feature.geometry().isNull())], dtype=np.float64).reshape(-1, 2)
+        value_range = self.run_planner(
+            planner.generate_idw_raster, layer, output, pixel_size, power,
+            workers=self.parameterAsInt(parameters, self.WORKERS, context),
+            pixel_budget=None if resolution == 'fixed' else planner.pixel_budget,
+            refine_factor=planner.refine_factor if resolution == 'refine' else 1,
+            refine_points=refine_points, cog=self.parameterAsBoolean(parameters, self.COG, context),
+            heatmap_raster=heatmap, ramp_colors=self.ramp_colors, feedback=feedback, value_field=field)
+
+        results = {self.OUTPUT: output, self.MINIMUM: float(value_range[0]), self.MAXIMUM: float(value_range[1])}
+        if heatmap is not None:
+            results[self.OUTPUT_HEATMAP] = heatmap
+        if resolution == 'refine':
+            results[self.OUTPUT_REFINED] = os.path.splitext(output)[0] + '_refined.tif'
+        return results
+
+
+class BestSingleMastAlgorithm(PlannerAlgorithm):
+
+    def name(self):
+        return 'bestsinglemast'
+
+    def displayName(self):
+        return self.tr('Best single met mast')
+
+    def shortHelpString(self):
+        return self.tr('Finds the met mast position with the lowest mean RSS uncertainty over the turbines '
+                       'of a TRIX file.')
+
+    def initAlgorithm(self, config=None):
+        self.add_trix_parameters()
+        self.addParameter(QgsProcessingParameterVectorDestination(
+            self.OUTPUT, self.tr('Best single met mast'), QgsProcessing.TypeVectorPoint))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        planner = self.planner(feedback)
+        crs = self.parameter_as_crs(parameters, context)
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        self.load_trix(planner, parameters, context, feedback)
+        planner.process_best_single_met_mast(None, output, crs, add_layer=False)
+        self.check_outputs(output)
+        return {self.OUTPUT: output}
+
+
+class BestMastPairAlgorithm(PlannerAlgorithm):
+
+    TOP_PAIRS = 'TOP_PAIRS'
+    MAX_AVG_RSS = 'MAX_AVG_RSS'
+    OUTPUT_TOP_PAIRS = 'OUTPUT_TOP_PAIRS'
+
+    def name(self):
+        return 'bestmastpair'
+
+    def displayName(self):
+        return self.tr('Best met mast pair')
+
+    def shortHelpString(self):
+        return self.tr('Finds the pair of met masts with the lowest total RSS uncertainty, every turbine '
+                       'being served by the better mast of the pair, and writes the best ranked pairs '
+                       '(the top pairs and/or the pairs below a maximum average RSS) to a CSV file.')
+
+    def initAlgorithm(self, config=None):
+        self.add_trix_parameters()
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TOP_PAIRS, self.tr('Ranked pairs'), QgsProcessingParameterNumber.Integer, 100, minValue=1))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.MAX_AVG_RSS, self.tr('Maximum average RSS of the ranked pairs'),
+            QgsProcessingParameterNumber.Double, optional=True, minValue=0))
+        self.addParameter(QgsProcessingParameterVectorDestination(
+            self.OUTPUT, self.tr('Best met mast pair'), QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputFile(self.OUTPUT_TOP_PAIRS, self.tr('Ranked pairs')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        planner = self.planner(feedback)
+        crs = self.parameter_as_crs(parameters, context)
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        max_avg_rss = None
+        if parameters.get(self.MAX_AVG_RSS) is not None:
+            max_avg_rss = self.parameterAsDouble(parameters, self.MAX_AVG_RSS, context)
+        trix_file = self.load_trix(planner, parameters, context, feedback)
+        planner.process_best_two_met_mast(trix_file, output, crs,
+                                          self.parameterAsInt(parameters, self.TOP_PAIRS, context),
+                                          max_avg_rss, add_layer=False)
+        top_pairs = os.path.splitext(output)[0] + '_top_pairs.csv'
+        self.check_outputs(output, top_pairs)
+        return {self.OUTPUT: output, self.OUTPUT_TOP_PAIRS: top_pairs}
+
+
+class BestKMastsAlgorithm(PlannerAlgorithm):
+
+    K = 'K'
+    SOLVER = 'SOLVER'
+    TIME_BUDGET = 'TIME_BUDGET'
+    OUTPUT_MASTS = 'OUTPUT_MASTS'
+    SOLVERS = ['exact', 'heuristic']
+
+    def name(self):
+        return 'bestkmasts'
+
+    def displayName(self):
+        return self.tr('Best k met masts')
+
+    def shortHelpString(self):
+        return self.tr('Finds the set of k met masts with the lowest total RSS uncertainty, every turbine '
+                       'being served by its best mast of the set. The exact solver is a branch-and-bound '
+                       'search; Greedy + swap finds a near-optimal set within the time budget for large '
+                       'candidate sets and reports its gap to a lower bound.')
+
+    def initAlgorithm(self, config=None):
+        self.add_trix_parameters()
+        self.addParameter(QgsProcessingParameterNumber(
+            self.K, self.tr('Number of met masts'), QgsProcessingParameterNumber.Integer, 3, minValue=1))
+        self.addParameter(QgsProcessingParameterEnum(
+            self.SOLVER, self.tr('Solver'), [self.tr('Exact'), self.tr('Greedy + swap')], defaultValue=0))
+        self.addParameter(QgsProcessingParameterNumber(
+            self.TIME_BUDGET, self.tr('Time budget of Greedy + swap (s)'), QgsProcessingParameterNumber.Double,
+            30, minValue=0))
+        self.addParameter(QgsProcessingParameterVectorDestination(
+            self.OUTPUT, self.tr('Best k met masts'), QgsProcessing.TypeVectorPoint))
+        self.addOutput(QgsProcessingOutputFile(self.OUTPUT_MASTS, self.tr('Selected masts')))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        planner = self.planner(feedback)
+        crs = self.parameter_as_crs(parameters, context)
+        output = self.parameterAsOutputLayer(parameters, self.OUTPUT, context)
+        k = self.parameterAsInt(parameters, self.K, context)
+        self.load_trix(planner, parameters, context, feedback)
+        self.run_planner(planner.process_best_k_met_mast, k, output, crs,
+                         self.SOLVERS[self.parameterAsEnum(parameters, self.SOLVER, context)],
+                         self.parameterAsDouble(parameters, self.TIME_BUDGET, context),
+                         add_layer=False, feedback=feedback)
+        masts = os.path.splitext(output)[0] + '_masts.csv'
+        self.check_outputs(output, masts)
+        return {self.OUTPUT: output, self.OUTPUT_MASTS: masts}
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""
+Processing provider of the OptimalMeasurementPlanner plugin.
+
+Makes the TRIX aggregation, the met mast heatmap and the optimal mast
+solvers available in the Processing toolbox, the Graphical Modeler, the
+batch runner and qgis_process.
+"""
+import os
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import QgsProcessingProvider
+
+from .OptimalMeasurementPlanner_algorithms import (
+    AggregateTrixAlgorithm,
+    MastHeatmapAlgorithm,
+    BestSingleMastAlgorithm,
+    BestMastPairAlgorithm,
+    BestKMastsAlgorithm,
+)
+
+
+class OptimalMeasurementPlannerProvider(QgsProcessingProvider):
+
+    def loadAlgorithms(self):
+        for algorithm in (AggregateTrixAlgorithm, MastHeatmapAlgorithm, BestSingleMastAlgorithm,
+                          BestMastPairAlgorithm, BestKMastsAlgorithm):
+            self.addAlgorithm(algorithm())
+
+    def id(self):
+        """Provider id, the prefix of the algorithm ids (e.g. optimalmeasurementplanner:bestkmasts)."""
+        return 'optimalmeasurementplanner'
+
+    def name(self):
+        return self.tr('Optimal Measurement Planner')
+
+    def longName(self):
+        return self.name()
+
+    def icon(self):
+        return QIcon(os.path.join(os.path.dirname(__file__), 'icon.png'))
+
+    def supportedOutputVectorLayerExtensions(self):
+        # Point layers are written with OGR, see write_point_features
+        return ['gpkg', 'shp']
+
+    def defaultVectorFileExtension(self, hasGeometry=True):
+        return 'gpkg'
+
+    def supportedOutputRasterLayerExtensions(self):
+        return ['tif']
+
+    def defaultRasterFileExtension(self):
+        return 'tif'
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch runner of the OptimalMeasurementPlanner main process.
+
+Processes many TRIX files without the dialog: every file goes through the
+same pipeline as the Process button (aggregation, met mast and turbine
+layers, IDW heatmap) and, optionally, the optimal mast solvers. Files are
+processed in parallel by a pool of worker processes, each running its own
+headless QgsApplication.
+
+Run it from the QGIS plugins folder with the Python of the QGIS install
+(e.g. the OSGeo4W shell)::
+
+    python -m OptimalMeasurementPlanner.batch "exports/*.txt" -o results --crs EPSG:32632 --workers 4
+    python -m OptimalMeasurementPlanner.batch exports -o results --country Denmark --city Aarhus \\
+        --analysis single pair k --k 3
+
+Every TRIX file gets a subfolder of the output directory, named after the
+file, holding its results folder; running the batch again only recomputes
+the stale stages (see OptimalMeasurementPlanner.run_pipeline). A summary of
+the run is written to batch_summary.csv.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+# Headless QGIS application and planner class of a worker process, filled
+# by init_worker
+worker_state = {}
+
+
+def find_trix_files(inputs):
+    """
+    TRIX files of directories (every .txt file in them) and glob patterns,
+    in the given order without duplicates.
+    """
+    files = []
+    for path in inputs:
+        if os.path.isdir(path):
+            matches = sorted(glob.glob(os.path.join(path, '*.txt')))
+        else:
+            matches = sorted(glob.glob(path))
+        for match in matches:
+            match = os.path.abspath(match)
+            if os.path.isfile(match) and match not in files:
+                files.append(match)
+    return files
+
+
+def result_names(trix_files):
+    """Output subfolder of every TRIX file: its name, made unique with a suffix."""
+    names = {}
+    used = set()
+    for trix_file in trix_files:
+        stem = os.path.splitext(os.path.basename(trix_file))[0]
+        name, suffix = stem, 1
+        while name in used:
+            suffix += 1
+            name = f'{stem}_{suffix}'
+        used.add(name)
+        names[trix_file] = name
+    return names
+
+
+def init_worker(prefix_path=None):
+    """Pool initializer: start a headless QGIS application once per worker."""
+    from qgis.core import QgsApplication
+    if prefix_path:
+        QgsApplication.setPrefixPath(prefix_path, True)
+    app = QgsApplication([], False)
+    app.initQgis()
+    # QGIS Processing, imported by the plugin module, lives with the core plugins
+    sys.path.append(os.path.join(QgsApplication.pkgDataPath(), 'python', 'plugins'))
+    from .OptimalMeasurementPlanner import OptimalMeasurementPlanner
+    worker_state.update(app=app, planner_class=OptimalMeasurementPlanner, cities_by_country=None)
+
+
+def create_planner(settings):
+    """Headless planner with the processing settings of the batch."""
+    planner = worker_state['planner_class'](None)
+    planner.pixel_size = settings['pixel_size']
+    planner.idw_power = settings['idw_power']
+    planner.idw_workers = settings['idw_workers']
+    planner.pixel_mode = settings['pixel_mode']
+    planner.raster_format = 'cog' if settings['cog'] else 'gtiff'
+    planner.output_layout = 'gpkg' if settings['gpkg'] else 'files'
+    if settings['crs'] is None and worker_state['cities_by_country'] is None:
+        cities_by_country_file = os.path.join(planner.plugin_dir, 'cities_by_country', 'cities_by_country.xlsx')
+        worker_state['cities_by_country'] = pd.read_excel(cities_by_country_file)
+    planner.cities_by_country = worker_state['cities_by_country']
+    return planner
+
+
+def process_trix_file(trix_file, out_dir, settings):
+    """
+    Pool task: run the main process, and the requested optimal mast
+    analyses, for one TRIX file.
+
+    :param trix_file: Path to the TRIX file
+    :param out_dir: Output directory of the file, its results folder is
+        created or re-used in there
+    :param settings: Batch settings, see main
+    :returns: Summary of the file: results folder, recomputed stages,
+        analyses, seconds and the error, if any
+    :rtype: dict
+    """
+    start = time.perf_counter()
+    summary = {'trix_file': trix_file, 'results_folder': None, 'recomputed': '', 'analysis': '',
+               'seconds': None, 'error': None}
+    try:
+        planner = create_planner(settings)
+        crs = settings['crs'] or planner.get_crs(settings['country'], settings['city'])
+        planner.output_direcory = planner.results_folder(out_dir, planner.trix_content_hash(trix_file))
+        planner.work_direcory = planner.work_directory(planner.output_direcory)
+        summary['results_folder'] = planner.output_direcory
+        recomputed = planner.run_pipeline(trix_file, planner.output_direcory, crs, show=False,
+                                          workers=settings['stage_workers'])
+        summary['recomputed'] = ' '.join(recomputed)
+
+        work_dir = planner.work_direcory
+        for analysis in settings['analysis']:
+            if analysis == 'single':
+                outpath = os.path.join(work_dir, 'Optimal_single_met_mast.shp')
+                planner.process_best_single_met_mast(os.path.join(work_dir, 'mast_points_data.csv'), outpath, crs,
+                                                     add_layer=False)
+            elif analysis == 'pair':
+                outpath = os.path.join(work_dir, 'Optimal_pair_met_mast.shp')
+                planner.process_best_two_met_mast(trix_file, outpath, crs, settings['top_pairs'],
+                                                  settings['max_avg_rss'], add_layer=False)
+            else:
+                outpath = os.path.join(work_dir, f"Optimal_{settings['k']}_met_mast.shp")
+                planner.process_best_k_met_mast(settings['k'], outpath, crs, settings['solver'],
+                                                settings['time_budget'], add_layer=False)
+            planner.store_highlight(outpath)
+        summary['analysis'] = ' '.join(settings['analysis'])
+    except Exception:
+        summary['error'] = traceback.format_exc(limit=-3).strip()
+    summary['seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m OptimalMeasurementPlanner.batch',
+        description='Process TRIX files with the OptimalMeasurementPlanner pipeline, without QGIS Desktop.')
+    parser.add_argument('inputs', nargs='+', help='TRIX files, directories of TRIX files (*.txt) or glob patterns')
+    parser.add_argument('-o', '--output-dir', required=True, help='Output directory')
+    parser.add_argument('--crs', help='Project CRS, e.g. EPSG:32632')
+    parser.add_argument('--country', help='Project country, with --city instead of --crs')
+    parser.add_argument('--city', help='Project city, the UTM zone of the city is used')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of TRIX files processed at the same time (default: CPU count)')
+    parser.add_argument('--stage-workers', type=int, default=2,
+                        help='Independent pipeline stages run at the same time per file (default: 2)')
+    parser.add_argument('--idw-workers', type=int, default=1,
+                        help='IDW worker processes per file (default: 1)')
+    parser.add_argument('--pixel-mode', choices=['fixed', 'auto', 'refine'], default='fixed',
+                        help='IDW resolution: fixed pixel size, automatic, automatic + refinement')
+    parser.add_argument('--pixel-size', type=float, default=5, help='IDW pixel size (default: 5)')
+    parser.add_argument('--idw-power', type=float, default=2, help='IDW distance coefficient (default: 2)')
+    parser.add_argument('--cog', action='store_true', help='Write Cloud-Optimized GeoTIFFs')
+    parser.add_argument('--gpkg', action='store_true', help='Write the results to one GeoPackage per file')
+    parser.add_argument('--analysis', nargs='*', choices=['single', 'pair', 'k'], default=[],
+                        help='Optimal mast analyses to run after processing')
+    parser.add_argument('--k', type=int, default=3, help='Number of masts of the k analysis (default: 3)')
+    parser.add_argument('--solver', choices=['exact', 'heuristic'], default='exact',
+                        help='Solver of the k analysis (default: exact)')
+    parser.add_argument('--time-budget', type=float, default=30,
+                        help='Time budget in seconds of the heuristic solver (default: 30)')
+    parser.add_argument('--top-pairs', type=int, default=100, help='Ranked pairs kept by the pair analysis')
+    parser.add_argument('--max-avg-rss', type=float, help='Also keep the pairs below this average RSS')
+    parser.add_argument('--qgis-prefix', default=os.environ.get('QGIS_PREFIX_PATH'),
+                        help='QGIS install prefix (default: $QGIS_PREFIX_PATH)')
+    args = parser.parse_args(argv)
+    if args.crs is None and (args.country is None or args.city is None):
+        parser.error('give --crs, or --country and --city')
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    trix_files = find_trix_files(args.inputs)
+    if not trix_files:
+        print('No TRIX files found')
+        return 1
+
+    settings = {
+        'crs': args.crs, 'country': args.country, 'city': args.city, 'stage_workers': args.stage_workers,
+        'idw_workers': args.idw_workers, 'pixel_mode': args.pixel_mode, 'pixel_size': args.pixel_size,
+        'idw_power': args.idw_power, 'cog': args.cog, 'gpkg': args.gpkg, 'analysis': args.analysis,
+        'k': args.k, 'solver': args.solver, 'time_budget': args.time_budget, 'top_pairs': args.top_pairs,
+        'max_avg_rss': args.max_avg_rss,
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    names = result_names(trix_files)
+    workers = max(1, min(args.workers, len(trix_files)))
+    print(f"Processing {len(trix_files)} TRIX file(s) on {workers} worker(s)")
+
+    start = time.perf_counter()
+    summaries = []
+    # Spawned workers: forking a process holding QGIS/Qt state is not safe
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(args.qgis_prefix,)) as executor:
+        futures = [executor.submit(process_trix_file, trix_file,
+                                   os.path.join(args.output_dir, names[trix_file]), settings)
+                   for trix_file in trix_files]
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries.append(summary)
+            status = 'failed' if summary['error'] else (summary['recomputed'] or 'up to date')
+            print(f"[{len(summaries)}/{len(trix_files)}] {os.path.basename(summary['trix_file'])}: "
+                  f"{status} ({summary['seconds']} s)")
+            if summary['error']:
+                print(summary['error'])
+
+    summary_path = os.path.join(args.output_dir, 'batch_summary.csv')
+    pd.DataFrame(summaries).to_csv(summary_path, index=False)
+    failed = sum(1 for summary in summaries if summary['error'])
+    print(f"Done in {time.perf_counter() - start:.1f} s, {failed} failed, summary in {summary_path}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
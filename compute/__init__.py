@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+Compute core of the OptimalMeasurementPlanner plugin.
+
+The TRIX parsing, turbine/mast ID assignment, corrected RSS uncertainty,
+turbine x mast RSS matrix, optimal mast solvers and IDW interpolation work
+on files, pandas DataFrames and NumPy arrays only (plus GDAL for the
+rasters). Nothing in this package imports QGIS, so it loads quickly in
+worker processes, scripts and benchmarks; the plugin class adapts it to
+QGIS layers, the project and the GUI.
+
+- trix: TRIX parsing, IDs, RSS, the RSS matrix and the parsed TRIX cache
+- solvers: best single mast, mast pair and set of k masts
+- idw: IDW grid planning and tile evaluation (also in worker processes)
+- raster: IDW rasters, heatmaps and Cloud-Optimized GeoTIFFs (GDAL)
+"""
+
+
+class PipelineCanceled(Exception):
+    """Raised between chunks or tiles when a pipeline run is canceled."""
@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""
+IDW interpolation for the OptimalMeasurementPlanner heatmap.
+
+Plans the raster grid (pixel size, tiles, refinement tiles) of a set of
+points and evaluates its tiles, either in the calling process or by a pool
+of worker processes. Workers receive the interpolation points through
+shared memory once, when the pool starts, and only tile coordinates travel
+with each task, so spawned workers start with NumPy (and SciPy for the
+neighbour/radius cutoff) only.
+"""
+import math
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+from multiprocessing import shared_memory
+try:
+    from scipy.spatial import cKDTree
+except ImportError:  # SciPy is optional, IDW cutoffs then use a brute-force search
+    cKDTree = None
+
+# Per-process state of a pool worker, filled by init_idw_worker
+worker_state = {}
+
+
+def idw_values(pixels, points, values, power=2, k_neighbours=None, search_radius=None, tree=None):
+    """
+    Inverse distance weighted values at a block of pixel centres.
+
+    Without cutoff every point contributes, as in QgsIDWInterpolator: the
+    value is sum(v / d**power) / sum(1 / d**power), and a pixel that
+    coincides with a point takes that point's value. k_neighbours keeps
+    the nearest points only, search_radius the points within that
+    distance; both use the KD-tree when given.
+
+    :param pixels: float64 array of shape (p, 2)
+    :param points: float64 array of shape (n, 2)
+    :param values: float64 array of shape (n,)
+    :param tree: cKDTree of points, or None for a brute-force search
+    :returns: float64 array of shape (p,), NaN where no point is in range
+    :rtype: ndarray
+    """
+    n_points = len(points)
+    if n_points == 0:
+        return np.full(len(pixels), np.nan)
+    radius = np.inf if search_radius is None else search_radius
+
+    if tree is not None and (k_neighbours is not None or search_radius is not None):
+        if k_neighbours is None:
+            # Radius only: sparse pixel/point pairs within the radius
+            pairs = cKDTree(pixels).sparse_distance_matrix(tree, radius, output_type='ndarray')
+            pixel, point, distance = pairs['i'], pairs['j'], pairs['v']
+            with np.errstate(divide='ignore'):
+                weights = 1.0 / np.power(distance, power)
+            finite = np.isfinite(weights)
+            numerator = np.bincount(pixel[finite], weights[finite] * values[point[finite]], len(pixels))
+            denominator = np.bincount(pixel[finite], weights[finite], len(pixels))
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.where(denominator > 0, numerator / denominator, np.nan)
+            exact = distance < np.finfo(np.float64).tiny
+            first = np.full(len(pixels), n_points)
+            np.minimum.at(first, pixel[exact], point[exact])
+            hit = first < n_points
+            result[hit] = values[first[hit]]
+            return result
+        k = min(k_neighbours, n_points)
+        distance, point = tree.query(pixels, k=k, distance_upper_bound=radius)
+        squared = np.square(distance.reshape(len(pixels), k))
+        point = np.minimum(point.reshape(len(pixels), k), n_points - 1)
+        neighbour_values = values[point]
+    else:
+        dx = pixels[:, 0, None] - points[None, :, 0]
+        dy = pixels[:, 1, None] - points[None, :, 1]
+        squared = dx * dx
+        squared += dy * dy
+        neighbour_values = np.broadcast_to(values, squared.shape)
+        if k_neighbours is not None and k_neighbours < n_points:
+            nearest = np.argpartition(squared, k_neighbours - 1, axis=1)[:, :k_neighbours]
+            nearest.sort(axis=1)
+            squared = np.take_along_axis(squared, nearest, axis=1)
+            neighbour_values = values[nearest]
+        if search_radius is not None:
+            squared = np.where(squared <= radius * radius, squared, np.inf)
+
+    # Weights from squared distances, 1 / d**power without the square root
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = 1.0 / squared if power == 2 else np.power(squared, -power / 2)
+        weights[np.isinf(squared)] = 0.0
+        exact = squared == 0
+        weights[exact] = 0.0
+        numerator = np.einsum('ij,ij->i', weights, neighbour_values)
+        denominator = weights.sum(axis=1)
+        result = np.where(denominator > 0, numerator / denominator, np.nan)
+    hit = exact.any(axis=1)
+    result[hit] = neighbour_values[hit, exact[hit].argmax(axis=1)]
+    return result
+
+
+def colorize(block, stop_values, stop_colors):
+    """
+    RGBA colours of IDW values with an interpolated colour ramp, as
+    QgsColorRampShader (Interpolated) shades them: below the first stop
+    the first colour, above the last stop the last colour, in between the
+    channels are interpolated linearly and truncated. NaN is transparent.
+
+    :param block: float64 array of shape (rows, cols)
+    :param stop_values: Increasing stop values, length s
+    :param stop_colors: uint8 array of shape (s, 4), RGBA of each stop
+    :returns: uint8 array of shape (4, rows, cols)
+    :rtype: ndarray
+    """
+    stop_values = np.asarray(stop_values, dtype=np.float64)
+    stop_colors = np.asarray(stop_colors, dtype=np.float64)
+    rgba = np.zeros(block.shape + (4,), dtype=np.uint8)
+    valid = ~np.isnan(block)
+    value = block[valid]
+    index = np.searchsorted(stop_values, value, side='left')
+    colors = np.empty((len(value), 4))
+    colors[index == 0] = stop_colors[0]
+    colors[index >= len(stop_values)] = stop_colors[-1]
+    between = (index > 0) & (index < len(stop_values))
+    upper = index[between]
+    lower = upper - 1
+    scale = (value[between] - stop_values[lower]) / (stop_values[upper] - stop_values[lower])
+    colors[between] = np.trunc(stop_colors[lower] + (stop_colors[upper] - stop_colors[lower]) * scale[:, None])
+    rgba[valid] = colors
+    return np.moveaxis(rgba, 2, 0)
+
+
+def build_tree(points, settings):
+    """KD-tree of the points when a cutoff is set and SciPy is available."""
+    if cKDTree is None or not len(points):
+        return None
+    if settings['k_neighbours'] is None and settings['search_radius'] is None:
+        return None
+    return cKDTree(points)
+
+
+def evaluate_idw_tile(tile, points, values, tree, settings):
+    """
+    Evaluate one raster tile.
+
+    The tile is processed in row blocks whose pixel/point distances fit in
+    settings['block_bytes'].
+
+    :param tile: (row, col, rows, cols) of the tile in the raster
+    :param settings: dict with the grid origin 'x0'/'y0' (top left corner),
+        'cell_x'/'cell_y', 'power', 'k_neighbours', 'search_radius',
+        'block_bytes' and 'ramp', (stop values, stop colours) to colorize the
+        tile or None
+    :returns: (tile, values, rgba, seconds, pid) where values is a float32
+        array of shape (rows, cols), NaN where no point is in range, and rgba
+        the colorized tile (see colorize) or None
+    :rtype: tuple
+    """
+    start = time.perf_counter()
+    row, col, rows, cols = tile
+    per_pixel = len(points)
+    if tree is not None and settings['k_neighbours'] is not None:
+        per_pixel = min(settings['k_neighbours'], len(points))
+    rows_per_block = max(1, settings['block_bytes'] // (32 * max(per_pixel, 1) * cols))
+
+    x = settings['x0'] + settings['cell_x'] * (np.arange(col, col + cols) + 0.5)
+    block = np.empty((rows, cols))
+    for first in range(0, rows, rows_per_block):
+        n_rows = min(rows_per_block, rows - first)
+        y = settings['y0'] - settings['cell_y'] * (np.arange(row + first, row + first + n_rows) + 0.5)
+        pixels = np.column_stack((np.tile(x, n_rows), np.repeat(y, cols)))
+        block[first:first + n_rows] = idw_values(
+            pixels, points, values, settings['power'], settings['k_neighbours'],
+            settings['search_radius'], tree).reshape(n_rows, cols)
+    # Colours of the values as stored in the Float32 raster
+    block = block.astype(np.float32)
+    rgba = None
+    if settings['ramp'] is not None:
+        rgba = colorize(block.astype(np.float64), *settings['ramp'])
+    return tile, block, rgba, time.perf_counter() - start, os.getpid()
+
+
+def share_points(points, values):
+    """
+    Copy points and values into a new shared memory block as an (n, 3)
+    float64 array. The caller closes and unlinks the block.
+    """
+    data = np.column_stack((points, values)) if len(points) else np.empty((0, 3))
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+    return shm
+
+
+def init_idw_worker(shm_name, n_points, settings):
+    """Pool initializer: attach the shared points and build the KD-tree once."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    data = np.ndarray((n_points, 3), dtype=np.float64, buffer=shm.buf)
+    points = np.ascontiguousarray(data[:, :2])
+    worker_state.update(shm=shm, points=points, values=data[:, 2], settings=settings,
+                        tree=build_tree(points, settings))
+
+
+def idw_tile(tile):
+    """Pool task: evaluate a tile with the worker's shared points."""
+    return evaluate_idw_tile(tile, worker_state['points'], worker_state['values'],
+                             worker_state['tree'], worker_state['settings'])
+
+
+def idw_grid(bounds, pixel_size):
+    """
+    Raster grid of qgis:idwinterpolation for an extent and pixel size.
+
+    The number of columns/rows is round(size / pixel_size) + 1 and the cell
+    size is stretched so the cells exactly cover the extent.
+
+    :param bounds: (xmin, ymin, xmax, ymax)
+    :returns: (columns, rows, cell_size_x, cell_size_y)
+    :rtype: tuple
+    """
+    xmin, ymin, xmax, ymax = bounds
+    columns = max(round((xmax - xmin) / pixel_size) + 1, 1)
+    rows = max(round((ymax - ymin) / pixel_size) + 1, 1)
+    cell_x = (xmax - xmin) / columns or pixel_size
+    cell_y = (ymax - ymin) / rows or pixel_size
+    return columns, rows, cell_x, cell_y
+
+
+def process_context():
+    """
+    Spawn context for the IDW worker pool. Forking the QGIS process is not
+    safe, and inside QGIS sys.executable is the QGIS binary, so spawned
+    workers are pointed at the bundled Python interpreter.
+    """
+    context = multiprocessing.get_context('spawn')
+    executable = os.path.basename(sys.executable).lower()
+    if not executable.startswith('python'):
+        name = 'pythonw.exe' if os.name == 'nt' else 'python3'
+        folder = sys.exec_prefix if os.name == 'nt' else os.path.join(sys.exec_prefix, 'bin')
+        context.set_executable(os.path.join(folder, name))
+    return context
+
+
+def nearest_spacing(points):
+    """Median distance from each point to its nearest neighbour, 0 if undefined."""
+    if len(points) < 2:
+        return 0.0
+    if cKDTree is not None:
+        distance = cKDTree(points).query(points, k=2)[0][:, 1]
+    else:
+        distance = np.empty(len(points))
+        for start in range(0, len(points), 1024):
+            block = points[start:start + 1024]
+            squared = ((block[:, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+            squared[np.arange(len(block)), np.arange(start, start + len(block))] = np.inf
+            distance[start:start + len(block)] = np.sqrt(squared.min(axis=1))
+    return float(np.median(distance))
+
+
+def auto_pixel_size(bounds, points, pixel_budget, min_pixel_size):
+    """
+    Pixel size for the automatic resolution mode.
+
+    A tenth of the median mast spacing resolves the field between
+    neighbouring masts; the size is then enlarged until the idw_grid of
+    the extent has at most pixel_budget pixels, and never made finer than
+    min_pixel_size.
+
+    :param bounds: (xmin, ymin, xmax, ymax)
+    :param points: Mast coordinates, float64 array of shape (n, 2)
+    :param pixel_budget: Maximum number of pixels of the raster
+    :param min_pixel_size: Finest allowed pixel size
+    :returns: Pixel size
+    :rtype: float
+    """
+    width, height = bounds[2] - bounds[0], bounds[3] - bounds[1]
+    pixel_size = max(math.sqrt(width * height / pixel_budget),
+                     max(width, height) / max(pixel_budget - 1, 1),
+                     nearest_spacing(points) / 10, min_pixel_size)
+    while True:
+        columns, rows, _, _ = idw_grid(bounds, pixel_size)
+        if columns * rows <= pixel_budget:
+            return pixel_size
+        pixel_size *= 1.01
+
+
+def refinement_tiles(grid, tile_size, near_points, distance, pixel_budget):
+    """
+    Tiles of a grid that lie within distance of any of near_points,
+    nearest first, up to pixel_budget pixels in total.
+
+    :param grid: (x0, y0, columns, rows, cell_x, cell_y), (x0, y0) being
+        the top left corner
+    :returns: List of (row, col, rows, cols) tiles
+    :rtype: list
+    """
+    x0, y0, columns, rows, cell_x, cell_y = grid
+    tiles = [(row, col, min(tile_size, rows - row), min(tile_size, columns - col))
+             for row in range(0, rows, tile_size) for col in range(0, columns, tile_size)]
+    if not tiles or not len(near_points):
+        return []
+    shape = np.array([(t[3] * cell_x, t[2] * cell_y) for t in tiles])
+    centres = np.array([(x0 + t[1] * cell_x, y0 - t[0] * cell_y) for t in tiles]) + shape * [0.5, -0.5]
+    if cKDTree is not None:
+        gap = cKDTree(near_points).query(centres)[0]
+    else:
+        gap = np.array([np.sqrt(((near_points - centre) ** 2).sum(axis=1).min()) for centre in centres])
+    gap -= np.hypot(shape[:, 0], shape[:, 1]) / 2
+
+    selected, pixels = [], 0
+    for index in np.argsort(gap, kind='stable'):
+        tile = tiles[index]
+        if gap[index] > distance or pixels + tile[2] * tile[3] > pixel_budget:
+            break
+        selected.append(tile)
+        pixels += tile[2] * tile[3]
+    return selected
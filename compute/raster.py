@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+IDW rasters of the OptimalMeasurementPlanner heatmap, written with GDAL.
+
+The raster is interpolated tile by tile (see idw) and every tile is
+streamed straight into a tiled GeoTIFF, optionally with its colorized RGBA
+heatmap and as Cloud-Optimized GeoTIFFs.
+"""
+import math
+import os
+import time
+
+import numpy as np
+import pandas as pd
+from osgeo import gdal
+
+from . import PipelineCanceled, idw
+
+
+def push_info(feedback, message):
+    """
+    Report a message to the feedback when it takes messages: a
+    QgsProcessingFeedback does, a plain QgsFeedback (pipeline tasks) does not.
+    """
+    if feedback is not None and hasattr(feedback, 'pushInfo'):
+        feedback.pushInfo(message)
+
+
+def interpolate_idw(points, values, bounds, crs_wkt, output_idw_raster, pixel_size=5, power=2,
+                    k_neighbours=None, search_radius=None, workers=1, tile_size=256,
+                    block_bytes=64 * 1024 ** 2, pixel_budget=None, refine_factor=1, refine_points=None,
+                    refine_distance=None, cog=False, heatmap_raster=None, ramp=None, feedback=None,
+                    compression='ZSTD'):
+    """
+    Interpolate point values to a GeoTIFF with inverse distance weighting.
+
+    Uses the grid and formula of qgis:idwinterpolation (see idw.idw_grid
+    and idw.idw_values), so without cutoff the values are the same. With
+    k_neighbours or search_radius only the points found by a KD-tree
+    (SciPy) contribute, which bounds the work per pixel on sites with
+    thousands of masts. Pixels without any point in range are nodata
+    (-9999).
+
+    With pixel_budget the pixel size is chosen automatically (see
+    idw.auto_pixel_size, pixel_size is then the finest allowed size). A
+    refine_factor above 1 also writes <name>_refined.tif, refine_factor
+    times finer, on the same grid but only for the tiles within
+    refine_distance of the points and refine_points (turbines); other
+    tiles are left empty (sparse) and the refined pixels are limited to
+    the same budget.
+
+    :param points: Point coordinates, float64 array of shape (n, 2)
+    :param values: Point values, float64 array of shape (n,)
+    :param bounds: Raster extent (xmin, ymin, xmax, ymax)
+    :param crs_wkt: WKT of the raster CRS
+    :param output_idw_raster: Output GeoTIFF path
+    :param pixel_size: Requested pixel size in CRS units
+    :param power: IDW distance coefficient
+    :param k_neighbours: Only use the k nearest points
+    :param search_radius: Only use the points within this distance
+    :param workers: Number of worker processes, 1 evaluates in process
+    :param tile_size: Tile width and height in pixels
+    :param block_bytes: Memory budget of a block of pixel/point distances
+    :param pixel_budget: Maximum number of pixels, enables the automatic
+        pixel size
+    :param refine_factor: Subdivision of the refined raster, 1 disables it
+    :param refine_points: Extra points to refine around, shape (n, 2)
+    :param refine_distance: Refinement distance, defaults to half the
+        median point spacing (at least two pixels)
+    :param cog: Write Cloud-Optimized GeoTIFFs (see write_cog)
+    :param heatmap_raster: Also write the base raster colorized with ramp
+        to this RGBA GeoTIFF, in the same tile pass
+    :param ramp: Colour ramp of the heatmap, (stop values, RGBA of each
+        stop), see idw.colorize
+    :param feedback: Object with isCanceled() and setProgress(percent)
+        (e.g. a QgsFeedback), checked for cancellation between tiles
+        (raises PipelineCanceled); the grid and tile statistics go to its
+        pushInfo(text) when it has one (e.g. a QgsProcessingFeedback)
+    :param compression: COG compression, see cog_options
+    :returns: (min, max) of the written values
+    :rtype: tuple
+    """
+    if pixel_budget:
+        pixel_size = idw.auto_pixel_size(bounds, points, pixel_budget, pixel_size)
+    columns, rows, cell_x, cell_y = idw.idw_grid(bounds, pixel_size)
+    grid = (bounds[0], bounds[3], columns, rows, cell_x, cell_y)
+    tiles = [(row, col, min(tile_size, rows - row), min(tile_size, columns - col))
+             for row in range(0, rows, tile_size) for col in range(0, columns, tile_size)]
+    push_info(feedback, f"IDW: {columns} x {rows} pixels of {cell_x:.2f} x {cell_y:.2f}")
+    value_range = write_idw_raster(output_idw_raster, crs_wkt, grid, tiles, points, values, power,
+                                   k_neighbours, search_radius, workers, tile_size, block_bytes,
+                                   cog=cog, heatmap_raster=heatmap_raster, ramp=ramp, feedback=feedback,
+                                   compression=compression)
+
+    if refine_factor > 1:
+        fine_grid = (bounds[0], bounds[3], columns * refine_factor, rows * refine_factor,
+                     cell_x / refine_factor, cell_y / refine_factor)
+        if refine_distance is None:
+            refine_distance = max(idw.nearest_spacing(points) / 2, 2 * max(cell_x, cell_y))
+        near_points = points if refine_points is None else np.vstack((points, refine_points))
+        fine_tiles = idw.refinement_tiles(fine_grid, tile_size, near_points, refine_distance,
+                                          pixel_budget or columns * rows)
+        refined_raster = os.path.splitext(output_idw_raster)[0] + '_refined.tif'
+        push_info(feedback, f"IDW refinement: {len(fine_tiles)} tiles within {refine_distance:.1f} "
+                            f"of masts/turbines")
+        fine_range = write_idw_raster(refined_raster, crs_wkt, fine_grid, fine_tiles, points, values,
+                                      power, k_neighbours, search_radius, workers, tile_size,
+                                      block_bytes, sparse=True, cog=cog, feedback=feedback,
+                                      compression=compression)
+        value_range = (min(value_range[0], fine_range[0]), max(value_range[1], fine_range[1]))
+    return value_range
+
+
+def write_idw_raster(output_raster, crs_wkt, grid, tiles, points, values, power=2,
+                     k_neighbours=None, search_radius=None, workers=1, tile_size=256,
+                     block_bytes=64 * 1024 ** 2, sparse=False, cog=False, heatmap_raster=None,
+                     ramp=None, feedback=None, compression='ZSTD'):
+    """
+    Evaluate IDW tiles of a grid and stream them into a tiled GeoTIFF.
+
+    The tiles are evaluated with NumPy, by a pool of worker processes when
+    workers > 1, and every finished tile is written straight into the
+    GeoTIFF, so memory does not grow with the raster size. Tiles that are
+    not listed stay unwritten (with sparse=True they take no space). The
+    time spent on every tile is written next to the raster
+    (<name>_tiles.csv) to tune the worker count and tile size.
+
+    :param grid: (x0, y0, columns, rows, cell_x, cell_y), (x0, y0) being
+        the top left corner
+    :param tiles: List of (row, col, rows, cols) tiles to evaluate
+    :param sparse: Create a sparse GeoTIFF (unwritten tiles are nodata)
+    :param cog: Convert the result to a Cloud-Optimized GeoTIFF
+    :param heatmap_raster: Path of an RGBA GeoTIFF to write the tiles
+        colorized with ramp to, or None
+    :param ramp: Colour ramp of the heatmap, (stop values, RGBA of each
+        stop), see idw.colorize
+    :param feedback: Object with isCanceled() and setProgress(percent)
+        (e.g. a QgsFeedback), checked for cancellation after every tile
+        (raises PipelineCanceled); the tile statistics go to its
+        pushInfo(text) when it has one (e.g. a QgsProcessingFeedback)
+    :param compression: COG compression, see cog_options
+    :returns: (min, max) of the written values
+    :rtype: tuple
+    """
+    x0, y0, columns, rows, cell_x, cell_y = grid
+    settings = {
+        'x0': x0, 'y0': y0, 'cell_x': cell_x, 'cell_y': cell_y, 'power': power,
+        'k_neighbours': k_neighbours, 'search_radius': search_radius, 'block_bytes': block_bytes,
+        'ramp': ramp if heatmap_raster is not None else None,
+    }
+
+    options = ['TILED=YES', f'BLOCKXSIZE={tile_size}', f'BLOCKYSIZE={tile_size}', 'BIGTIFF=IF_SAFER']
+    if sparse:
+        options.append('SPARSE_OK=TRUE')
+    # The COG driver can only copy a finished raster: stream the tiles
+    # into a temporary GeoTIFF first
+    tiles_raster = output_raster + '.tmp.tif' if cog else output_raster
+    driver = gdal.GetDriverByName('GTiff')
+    dataset = driver.Create(tiles_raster, columns, rows, 1, gdal.GDT_Float32, options)
+    dataset.SetGeoTransform((x0, cell_x, 0.0, y0, 0.0, -cell_y))
+    dataset.SetProjection(crs_wkt)
+    band = dataset.GetRasterBand(1)
+    band.SetNoDataValue(-9999)
+    heatmap = None
+    if heatmap_raster is not None:
+        heatmap_tiles = heatmap_raster + '.tmp.tif' if cog else heatmap_raster
+        heatmap = driver.Create(heatmap_tiles, columns, rows, 4, gdal.GDT_Byte,
+                                options + ['PHOTOMETRIC=RGB', 'ALPHA=YES'])
+        heatmap.SetGeoTransform((x0, cell_x, 0.0, y0, 0.0, -cell_y))
+        heatmap.SetProjection(crs_wkt)
+
+    shm = pool = None
+    workers = max(1, min(workers, len(tiles)))
+    start = time.perf_counter()
+    value_min, value_max = np.inf, -np.inf
+    value_sum = value_squares = value_count = 0.0
+    timings = []
+    completed = False
+    try:
+        if workers > 1:
+            shm = idw.share_points(points, values)
+            pool = idw.process_context().Pool(
+                workers, initializer=idw.init_idw_worker, initargs=(shm.name, len(points), settings))
+            results = pool.imap_unordered(idw.idw_tile, tiles)
+        else:
+            tree = idw.build_tree(points, settings)
+            results = (idw.evaluate_idw_tile(tile, points, values, tree, settings) for tile in tiles)
+
+        for (row, col, tile_rows, tile_cols), block, rgba, seconds, pid in results:
+            valid = block[~np.isnan(block)].astype(np.float64)
+            if len(valid):
+                value_min = min(value_min, valid.min())
+                value_max = max(value_max, valid.max())
+                value_sum += valid.sum()
+                value_squares += np.square(valid).sum()
+                value_count += len(valid)
+            band.WriteArray(np.where(np.isnan(block), np.float32(-9999), block), col, row)
+            if heatmap is not None:
+                for index in range(4):
+                    heatmap.GetRasterBand(index + 1).WriteArray(rgba[index], col, row)
+            timings.append((row, col, tile_rows, tile_cols, round(seconds, 4), pid))
+            if feedback is not None:
+                if feedback.isCanceled():
+                    raise PipelineCanceled()
+                feedback.setProgress(100 * len(timings) / len(tiles))
+        completed = True
+    finally:
+        if pool is not None:
+            # Do not wait for the queued tiles of a canceled or failed run
+            if completed:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    if value_count:
+        # Exact statistics of the written pixels, so styling the raster
+        # needs no extra pass over it (see raster_value_range)
+        mean = float(value_sum / value_count)
+        band.SetStatistics(float(value_min), float(value_max), mean,
+                           math.sqrt(max(value_squares / value_count - mean * mean, 0.0)))
+    band.FlushCache()
+    dataset = None
+    if heatmap is not None:
+        heatmap.FlushCache()
+        heatmap = None
+    if cog:
+        write_cog(tiles_raster, output_raster, tile_size, compression=compression)
+        os.remove(tiles_raster)
+        if heatmap_raster is not None:
+            write_cog(heatmap_tiles, heatmap_raster, tile_size, compression=compression)
+            os.remove(heatmap_tiles)
+
+    timings_path = os.path.splitext(output_raster)[0] + '_tiles.csv'
+    pd.DataFrame(timings, columns=['row', 'col', 'rows', 'cols', 'seconds', 'worker']).to_csv(
+        timings_path, index=False)
+    push_info(feedback, f"IDW: {len(tiles)} tiles on {workers} worker(s), {sum(t[4] for t in timings):.2f} s "
+                        f"tile time, {time.perf_counter() - start:.2f} s elapsed")
+    return value_min, value_max
+
+
+def cog_options(tile_size=256, resampling='AVERAGE', compression='ZSTD'):
+    """
+    Creation options of the COG driver: tiles of tile_size, internal
+    overviews and compression (DEFLATE when this GDAL build has no ZSTD).
+    """
+    supported = gdal.GetDriverByName('COG').GetMetadataItem('DMD_CREATIONOPTIONLIST') or ''
+    if compression not in supported:
+        compression = 'DEFLATE'
+    return [f'COMPRESS={compression}', 'PREDICTOR=YES', f'BLOCKSIZE={tile_size}', 'OVERVIEWS=AUTO',
+            f'RESAMPLING={resampling}', 'BIGTIFF=IF_SAFER', 'NUM_THREADS=ALL_CPUS']
+
+
+def write_cog(source_raster, output_raster, tile_size=256, resampling='AVERAGE', compression='ZSTD'):
+    """
+    Copy a raster to a Cloud-Optimized GeoTIFF: tiled, compressed and
+    with internal overviews, so large rasters pan quickly in QGIS and
+    read efficiently over network shares.
+
+    :param source_raster: Path of the raster to copy
+    :param output_raster: Output COG path
+    :param resampling: Overview resampling method
+    :param compression: Compression, see cog_options
+    :returns: output_raster
+    :rtype: str
+    """
+    dataset = gdal.Translate(output_raster, source_raster, format='COG',
+                             creationOptions=cog_options(tile_size, resampling, compression))
+    if dataset is None:
+        raise Exception(f"Failed to write COG: {output_raster}")
+    dataset = None
+    return output_raster
+
+
+def raster_value_range(raster_path):
+    """
+    (min, max) of band 1 from the statistics stored in a raster (as
+    written by write_idw_raster), or None if it has none.
+    """
+    dataset = gdal.Open(raster_path) if os.path.exists(raster_path) else None
+    if dataset is None:
+        return None
+    band = dataset.GetRasterBand(1)
+    value_min = band.GetMetadataItem('STATISTICS_MINIMUM')
+    value_max = band.GetMetadataItem('STATISTICS_MAXIMUM')
+    if value_min is None or value_max is None:
+        return None
+    return float(value_min), float(value_max)
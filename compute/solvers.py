@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""
+Optimal met mast solvers of the OptimalMeasurementPlanner plugin.
+
+All solvers work on the turbine x mast RSS matrix (float32, NaN where a
+mast gives no RSS value for a turbine, see trix.aggregate_trix) and return
+mast positions, i.e. matrix columns. A set of masts covers a turbine when at
+least one of its masts has an RSS value for it; only sets covering every
+turbine get a finite total.
+"""
+import heapq
+import math
+import time
+
+import numpy as np
+
+
+def best_single_mast(rss_values):
+    """
+    Mast with the lowest mean RSS over the turbines.
+
+    :param rss_values: float32 turbine x mast matrix
+    :returns: (position, mean_rss) of the best mast
+    :rtype: tuple
+    """
+    mean_rss = np.nanmean(rss_values, axis=0, dtype=np.float64)
+    best = int(np.nanargmin(mean_rss))
+    return best, float(mean_rss[best])
+
+
+def condensed_pair_index(i, j, n_masts):
+    """
+    Position of the mast pair (i, j), i < j, in the condensed pair vector,
+    i.e. the order of itertools.combinations(range(n_masts), 2).
+    Works element-wise on integer arrays.
+    """
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    return i * n_masts - i * (i + 1) // 2 + (j - i - 1)
+
+
+def pair_from_condensed_index(k, n_masts):
+    """
+    Inverse of condensed_pair_index: mast indices (i, j) of the pair(s) at
+    position k of the condensed pair vector.
+    """
+    k = np.asarray(k, dtype=np.int64)
+    i = (n_masts - 2 - np.floor(np.sqrt(-8 * k + 4 * n_masts * (n_masts - 1) - 7) / 2.0 - 0.5)).astype(np.int64)
+    j = k - condensed_pair_index(i, i + 1, n_masts) + i + 1
+    return i, j
+
+
+def evaluate_mast_pairs(rss_values, top_k=10, score_threshold=None, scores_out=None,
+                        tile_bytes=8 * 1024 * 1024):
+    """
+    Score every pair of met masts in one blocked pass over the RSS matrix.
+
+    The score of a pair (i, j) is the sum over turbines of
+    min(rss[t, i], rss[t, j]), ignoring a missing value when the other mast
+    has one, so the score matches the k = 2 total of optimize_k_masts. Masts are split into blocks sized so that
+    one (n_turbines, block, block) tile stays within tile_bytes; each tile
+    of a block of masts i against a block of masts j is reduced over the
+    turbines in a single NumPy call.
+
+    Only the ranked pairs are kept: a bounded heap holds the top_k pairs
+    whose score is at most score_threshold, so memory does not grow with
+    the number of pairs. The scores of all pairs are only stored when
+    scores_out is given.
+
+    :param rss_values: float32 turbine x mast RSS matrix
+    :param top_k: Number of best pairs to keep, None to keep every pair
+        below score_threshold
+    :param score_threshold: Optional maximum score of a ranked pair
+    :param scores_out: Optional float64 array (e.g. a memory-mapped .npy)
+        of length n_masts * (n_masts - 1) / 2 receiving every pair score
+        in combinations order (NaN when a turbine has an RSS value for
+        neither mast)
+    :param tile_bytes: Memory budget of a single tile
+
+    :returns: (best_pair, top_pairs, scores_out) where best_pair is
+        (i, j, total) or None if no pair has a finite score and top_pairs
+        is a list of (i, j, total) sorted by total
+    :rtype: tuple
+    """
+    n_turbines, n_masts = rss_values.shape
+    best_pair = None
+    best_key = (np.inf, np.inf)
+    # Heap items are (-total, -pair_index): the root is the worst kept pair,
+    # ties keep the first pair in combinations order
+    heap = []
+
+    block = int(math.sqrt(tile_bytes / (max(n_turbines, 1) * rss_values.itemsize)))
+    block = max(1, min(block, n_masts))
+
+    for i0 in range(0, n_masts, block):
+        i1 = min(i0 + block, n_masts)
+        block_i = rss_values[:, i0:i1]
+        for j0 in range(i0, n_masts, block):
+            j1 = min(j0 + block, n_masts)
+            block_j = rss_values[:, j0:j1]
+
+            # (turbines, block_i, block_j) -> (block_i, block_j)
+            tile = np.fmin(block_i[:, :, None], block_j[:, None, :]).sum(axis=0, dtype=np.float64)
+
+            ii, jj = np.meshgrid(np.arange(i0, i1), np.arange(j0, j1), indexing='ij')
+            upper = ii < jj
+            totals = tile[upper]
+            pairs = condensed_pair_index(ii[upper], jj[upper], n_masts)
+            if scores_out is not None:
+                scores_out[pairs] = totals
+
+            finite = np.isfinite(totals)
+            totals, pairs = totals[finite], pairs[finite]
+            if totals.size == 0:
+                continue
+
+            tile_best = totals.min()
+            tile_key = (float(tile_best), int(pairs[totals == tile_best].min()))
+            if tile_key < best_key:
+                best_key = tile_key
+
+            if score_threshold is not None:
+                below = totals <= score_threshold
+                totals, pairs = totals[below], pairs[below]
+            if top_k is not None:
+                if top_k <= 0:
+                    continue
+                if totals.size > top_k:
+                    # Pairs tied with the k-th best stay candidates
+                    keep = totals <= np.partition(totals, top_k - 1)[top_k - 1]
+                    totals, pairs = totals[keep], pairs[keep]
+                if len(heap) == top_k:
+                    better = totals <= -heap[0][0]
+                    totals, pairs = totals[better], pairs[better]
+
+            for total, pair in zip(totals.tolist(), pairs.tolist()):
+                item = (-total, -pair)
+                if top_k is None or len(heap) < top_k:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+    if best_key[1] != np.inf:
+        best_i, best_j = pair_from_condensed_index(best_key[1], n_masts)
+        best_pair = (int(best_i), int(best_j), best_key[0])
+
+    ranked = sorted((-neg_total, -neg_pair) for neg_total, neg_pair in heap)
+    top_pairs = []
+    if ranked:
+        top_i, top_j = pair_from_condensed_index([pair for _, pair in ranked], n_masts)
+        top_pairs = [(int(i), int(j), total) for i, j, (total, _) in zip(top_i, top_j, ranked)]
+
+    return best_pair, top_pairs, scores_out
+
+
+def k_mast_costs(rss_values):
+    """
+    Mast-major cost matrix shared by the k-mast solvers.
+
+    A NaN cell means the mast gives no RSS value for that turbine. It is
+    replaced by a penalty larger than the total of any set covering all
+    turbines, so minimizing the costs prefers covering sets and a total at
+    or above the penalty means no covering set was found.
+
+    :param rss_values: float32 turbine x mast RSS matrix
+    :returns: (costs, penalty) with costs a contiguous float64 array of
+        shape (n_masts, n_turbines)
+    :rtype: tuple
+    """
+    n_turbines = rss_values.shape[0]
+    valid = np.isfinite(rss_values)
+    penalty = (float(rss_values[valid].max()) if valid.any() else 1.0) * n_turbines + 1.0
+    costs = np.ascontiguousarray(np.where(valid, rss_values, penalty).astype(np.float64).T)
+    return costs, penalty
+
+
+def lazy_greedy_k_masts(costs, k):
+    """
+    Lazy greedy facility-location seed: repeatedly add the mast with the
+    largest drop of the summed per-turbine minimum. Marginal gains only
+    shrink as masts are added, so stale gains in the priority queue are
+    upper bounds and only the top of the queue is ever re-evaluated.
+
+    :param costs: Mast-major cost matrix (see k_mast_costs)
+    :param k: Number of masts to place
+    :returns: List of k mast indices in selection order
+    :rtype: list
+    """
+    current = costs.max(axis=0)
+    current_total = float(current.sum())
+    # costs never exceed current, so the first gains are plain row sums
+    gains = current_total - costs.sum(axis=1)
+    queue = [(-gain, mast) for mast, gain in enumerate(gains.tolist())]
+    heapq.heapify(queue)
+    evaluated_at = np.zeros(costs.shape[0], dtype=np.int64)
+
+    selected = []
+    while len(selected) < k:
+        _, mast = heapq.heappop(queue)
+        if evaluated_at[mast] == len(selected):
+            selected.append(mast)
+            current = np.minimum(current, costs[mast])
+            current_total = float(current.sum())
+        else:
+            gain = current_total - float(np.minimum(current, costs[mast]).sum())
+            evaluated_at[mast] = len(selected)
+            heapq.heappush(queue, (-gain, mast))
+    return selected
+
+
+def swap_k_masts(costs, selected, deadline=None):
+    """
+    Improve a set of masts with 1-swap local search. For every position of
+    the set, the best replacement among all masts is found in one
+    vectorized step; passes repeat until no swap improves the total or the
+    deadline (time.monotonic() value) is reached.
+
+    :param costs: Mast-major cost matrix (see k_mast_costs)
+    :param selected: Initial list of mast indices
+    :param deadline: Optional time.monotonic() limit
+    :returns: (selected, total)
+    :rtype: tuple
+    """
+    selected = list(selected)
+    cap = costs.max(axis=0)
+    total = float(np.minimum(cap, costs[selected].min(axis=0)).sum())
+    improved = True
+    while improved:
+        improved = False
+        for pos in range(len(selected)):
+            if deadline is not None and time.monotonic() > deadline:
+                return selected, total
+            rest = selected[:pos] + selected[pos + 1:]
+            others = costs[rest].min(axis=0) if rest else cap
+            totals = np.minimum(others, costs).sum(axis=1)
+            totals[rest] = np.inf
+            mast = int(np.argmin(totals))
+            if totals[mast] < total * (1 - 1e-12):
+                selected[pos] = mast
+                total = float(totals[mast])
+                improved = True
+    return selected, total
+
+
+def k_mast_lower_bound(costs, k, upper, iterations=1000, deadline=None, progress=None):
+    """
+    Lagrangian lower bound of the k-mast problem, relaxing the "every
+    turbine is assigned once" constraints and tuning the multipliers by
+    subgradient ascent. The first evaluation (multipliers equal to the
+    per-turbine minima) is the trivial bound, so the result is never worse.
+
+    :param costs: Mast-major cost matrix (see k_mast_costs)
+    :param k: Number of masts to place
+    :param upper: Total of a known solution, used for the step size
+    :param iterations: Maximum number of subgradient steps
+    :param deadline: Optional time.monotonic() limit
+    :param progress: Optional callable receiving the percentage of steps
+    :returns: (lower_bound, multipliers)
+    :rtype: tuple
+    """
+    n_masts = costs.shape[0]
+    multipliers = costs.min(axis=0)
+    best_lower, best_multipliers = -np.inf, multipliers
+    step = 2.0
+    for iteration in range(iterations):
+        reduced = np.minimum(costs - multipliers, 0.0)
+        mast_rho = reduced.sum(axis=1)
+        opened = np.argpartition(mast_rho, k - 1)[:k] if k < n_masts else np.arange(n_masts)
+        lower = float(multipliers.sum() + mast_rho[opened].sum())
+        if lower > best_lower:
+            best_lower, best_multipliers = lower, multipliers
+        else:
+            step *= 0.99
+        subgradient = 1.0 - (reduced[opened] < 0).sum(axis=0)
+        norm = float(subgradient @ subgradient)
+        if norm == 0 or upper - lower <= 1e-9 * upper or step < 1e-6:
+            break
+        if deadline is not None and time.monotonic() > deadline:
+            break
+        multipliers = multipliers + step * (upper - lower) / norm * subgradient
+        if progress is not None and iteration % 50 == 0:
+            progress(100.0 * iteration / iterations)
+    return best_lower, best_multipliers
+
+
+def optimize_k_masts(rss_values, k, progress=None, iterations=1000):
+    """
+    Exact branch-and-bound search for the k met masts minimizing the sum
+    over turbines of the per-turbine minimum RSS.
+
+    Two lower bounds prune the search tree:
+    - the sum over turbines of the smaller of the current per-turbine
+      minimum and the per-turbine minimum over the masts still available
+      (suffix minima);
+    - the Lagrangian bound of k_mast_lower_bound. Masts are searched in
+      order of their reduced cost, so the bound of every child is a prefix
+      sum of sorted values.
+    All children of a node are bounded in one vectorized step. The upper
+    bound is seeded with the lazy greedy solution improved by 1-swap moves.
+
+    :param rss_values: float32 turbine x mast RSS matrix
+    :param k: Number of masts to place
+    :param progress: Optional callable receiving the search progress in
+        percent, also called every 1024 nodes of the search tree so that it
+        can stop a long search by raising
+    :param iterations: Maximum number of subgradient steps for the bound
+
+    :returns: (selected, total) with selected the sorted list of mast
+        column indices and total the summed per-turbine minimum RSS
+        (inf if no set covers every turbine)
+    :rtype: tuple
+    """
+    n_turbines, n_masts = rss_values.shape
+    if not 1 <= k <= n_masts:
+        raise ValueError(f"k must be between 1 and the number of masts ({n_masts}), got {k}")
+
+    costs, penalty = k_mast_costs(rss_values)
+    cap = costs.max(axis=0)
+    seed, upper = swap_k_masts(costs, lazy_greedy_k_masts(costs, k))
+
+    bound_progress = (lambda percent: progress(percent / 2)) if progress is not None else None
+    _, multipliers = k_mast_lower_bound(costs, k, upper, iterations, progress=bound_progress)
+
+    mast_rho = np.minimum(costs - multipliers, 0.0).sum(axis=1)
+    order = np.argsort(mast_rho, kind='stable')
+    costs = np.ascontiguousarray(costs[order])
+    mast_rho = mast_rho[order]
+    rho_prefix = np.concatenate([[0.0], np.cumsum(mast_rho)])
+    # suffix_min[s] = per-turbine minimum over masts s..n_masts-1
+    suffix_min = np.vstack([
+        np.minimum.accumulate(costs[::-1], axis=0)[::-1],
+        np.full((1, n_turbines), np.inf)
+    ])
+
+    position = np.empty(n_masts, dtype=np.int64)
+    position[order] = np.arange(n_masts)
+    best = {'total': upper, 'masts': [int(position[m]) for m in seed], 'nodes': 0, 'percent': 50.0}
+
+    def branch(current, node_bound, start, remaining, chosen):
+        best['nodes'] += 1
+        if progress is not None and best['nodes'] % 1024 == 0:
+            progress(best['percent'])
+        # Cheap Lagrangian bound of every child before touching the costs
+        last = n_masts - remaining + 1
+        candidates = np.arange(start, last)
+        lagrangian = (node_bound + mast_rho[start:last]
+                      + rho_prefix[candidates + remaining] - rho_prefix[candidates + 1])
+        keep = np.flatnonzero(lagrangian < best['total'])
+        if keep.size == 0:
+            return
+        children = np.minimum(current, costs[start + keep])
+        if remaining == 1:
+            totals = children.sum(axis=1)
+            idx = int(np.argmin(totals))
+            if totals[idx] < best['total']:
+                best['total'] = float(totals[idx])
+                best['masts'] = chosen + [start + int(keep[idx])]
+            return
+
+        child_bounds = np.minimum(children, multipliers).sum(axis=1)
+        bounds = np.maximum(
+            child_bounds + rho_prefix[start + keep + remaining] - rho_prefix[start + keep + 1],
+            np.minimum(children, suffix_min[start + keep + 1]).sum(axis=1)
+        )
+        for done, idx in enumerate(np.argsort(bounds, kind='stable'), start=1):
+            if bounds[idx] < best['total']:
+                mast = start + int(keep[idx])
+                branch(children[idx], child_bounds[idx], mast + 1, remaining - 1, chosen + [mast])
+            if progress is not None and not chosen:
+                best['percent'] = 50.0 + 50.0 * done / keep.size
+                progress(best['percent'])
+
+    branch(cap, float(np.minimum(cap, multipliers).sum()), 0, k, [])
+    if progress is not None:
+        progress(100.0)
+
+    selected = sorted(int(order[m]) for m in best['masts'])
+    total = best['total'] if best['total'] < penalty else float('inf')
+    return selected, total
+
+
+def approximate_k_masts(rss_values, k, time_budget=30.0, progress=None):
+    """
+    Fast approximate k-mast placement for very large candidate sets: lazy
+    greedy seed, vectorized 1-swap local search, then a Lagrangian lower
+    bound to report how far the result can be from the optimum. The swap
+    passes and the bound stop when the time budget is used up.
+
+    :param rss_values: float32 turbine x mast RSS matrix
+    :param k: Number of masts to place
+    :param time_budget: Wall-clock budget in seconds
+    :param progress: Optional callable receiving the progress in percent
+
+    :returns: (selected, total, lower_bound) with selected the sorted list
+        of mast column indices, total the summed per-turbine minimum RSS
+        (inf if no covering set was found) and lower_bound a lower bound of
+        the optimal total
+    :rtype: tuple
+    """
+    n_masts = rss_values.shape[1]
+    if not 1 <= k <= n_masts:
+        raise ValueError(f"k must be between 1 and the number of masts ({n_masts}), got {k}")
+
+    start = time.monotonic()
+    costs, penalty = k_mast_costs(rss_values)
+
+    seed = lazy_greedy_k_masts(costs, k)
+    if progress is not None:
+        progress(10.0)
+    # Local search may use most of the budget, the bound the rest
+    selected, total = swap_k_masts(costs, seed, deadline=start + 0.7 * time_budget)
+    if progress is not None:
+        progress(50.0)
+
+    bound_progress = (lambda percent: progress(50.0 + percent / 2)) if progress is not None else None
+    lower, _ = k_mast_lower_bound(costs, k, total, deadline=start + time_budget, progress=bound_progress)
+    if progress is not None:
+        progress(100.0)
+
+    if total >= penalty:
+        total = float('inf')
+    return sorted(selected), total, min(lower, total)
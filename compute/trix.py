@@ -0,0 +1,562 @@
+# -*- coding: utf-8 -*-
+"""
+TRIX parsing and aggregation of the OptimalMeasurementPlanner pipeline.
+
+A TRIX file is streamed in chunks: every chunk gets its turbine and mast
+IDs and the corrected RSS uncertainty, and is folded into the turbine x
+mast RSS matrix and the per-mast RSS sums. Parsed files are cached as
+memory-mapped binary columns keyed by their content hash.
+"""
+import hashlib
+import io
+import json
+import mmap
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from . import PipelineCanceled
+
+# TRIX columns used by the pipeline and the dtype they are parsed into.
+# Coordinates and uncertainty inputs stay float64 so the written values and
+# the RSS computation are unchanged, RIX and WindPRO's own RSS only need
+# float32.
+TRIX_COLUMNS = {
+    'WTG X [m]': np.float64,
+    'WTG Y [m]': np.float64,
+    'WTG Z [m]': np.float64,
+    'WTG RIX [%]': np.float32,
+    'Reference Point X [m]': np.float64,
+    'Reference Point Y [m]': np.float64,
+    'Reference Point Z [m]': np.float64,
+    'Reference RIX [%]': np.float32,
+    'Horiz. Uc increase due to horiz. distance [%]': np.float64,
+    'Horizontal Distance [m]': np.float64,
+    'Horiz. Uc increase due to vert. distance [%]': np.float64,
+    'Vertical uncertainty increase [%]': np.float64,
+    'RSS of uncertainty increases [%]': np.float32,
+}
+TRIX_OPTIONAL_COLUMNS = ('RSS of uncertainty increases [%]',)
+TRIX_UNCERTAINTY_COLUMNS = (
+    'Horiz. Uc increase due to horiz. distance [%]',
+    'Horizontal Distance [m]',
+    'Horiz. Uc increase due to vert. distance [%]',
+    'Vertical uncertainty increase [%]',
+)
+# Columns identifying a turbine and a met mast (reference point)
+TURBINE_COLUMNS = ['WTG X [m]', 'WTG Y [m]', 'WTG Z [m]', 'WTG RIX [%]']
+MAST_COLUMNS = ['Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]', 'Reference RIX [%]']
+# Bump when the processed TRIX columns change, invalidates cached parses
+PIPELINE_VERSION = 2
+# Size limit of the parsed TRIX cache, least recently used entries go first
+TRIX_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+class TrixSection(io.RawIOBase):
+    """Read-only binary view of the byte range [start, end) of a TRIX file."""
+
+    def __init__(self, path, start, end):
+        super().__init__()
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        data = self.file.read(size)
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+def locate_trix_data(input_trix_file):
+    """
+    Locate the header line and data rows of a TRIX file.
+
+    The file is memory-mapped and searched with byte finds for the first
+    line starting with 'Assumptions:' or '*', so the table boundary is
+    found without reading the file line by line in Python.
+
+    :param input_trix_file: Path to the TRIX file
+    :returns: dict of byte offsets 'header_start', 'header_end' (end of
+        the header line, including its newline), 'data_start' and
+        'data_end' (start of the end-of-data marker line, or file size)
+    :rtype: dict
+    """
+    with open(input_trix_file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            data_end = header_end = 0
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                data_end = size
+                if mapped[:12].startswith((b'Assumptions:', b'*')):
+                    data_end = 0
+                else:
+                    for marker in (b'\nAssumptions:', b'\n*'):
+                        found = mapped.find(marker, 0, data_end)
+                        if found != -1:
+                            data_end = found + 1
+                header_end = mapped.find(b'\n', 0, data_end) + 1 or data_end
+
+    return {
+        'header_start': 0,
+        'header_end': header_end,
+        'data_start': header_end,
+        'data_end': data_end,
+    }
+
+
+def read_trix_columns(input_trix_file, offsets=None):
+    """
+    Raw (unstripped) names of the TRIX columns used by the pipeline.
+
+    Only the header line is parsed. Optional columns that are missing from
+    the file are skipped, missing required columns raise a KeyError.
+
+    :returns: dict mapping each raw column name to its read dtype
+    :rtype: dict
+    """
+    if offsets is None:
+        offsets = locate_trix_data(input_trix_file)
+    section = TrixSection(input_trix_file, offsets['header_start'], offsets['header_end'])
+    with io.BufferedReader(section) as section:
+        header = pd.read_csv(section, sep='\t', engine='c', nrows=0).columns
+
+    raw_names = {name.strip(): name for name in header}
+    missing = [name for name in TRIX_COLUMNS
+               if name not in raw_names and name not in TRIX_OPTIONAL_COLUMNS]
+    if missing:
+        raise KeyError(f"TRIX file is missing columns: {', '.join(missing)}")
+    return {raw_names[name]: dtype for name, dtype in TRIX_COLUMNS.items() if name in raw_names}
+
+
+def read_trix_chunks(input_trix_file, chunksize=100000, offsets=None, coerce=False):
+    """
+    Parse the data table of a TRIX file in chunks of chunksize rows, with
+    stripped column names. The parser reads the located byte range
+    directly and holds one chunk in memory at a time.
+
+    Only the columns in TRIX_COLUMNS are parsed, straight into their
+    declared dtypes. With coerce=True the uncertainty/distance columns are
+    left to type inference, for files holding text in numeric columns
+    (see compute_adj_rss).
+    """
+    if offsets is None:
+        offsets = locate_trix_data(input_trix_file)
+    dtypes = read_trix_columns(input_trix_file, offsets)
+    if coerce:
+        dtypes = {name: dtype for name, dtype in dtypes.items()
+                  if name.strip() not in TRIX_UNCERTAINTY_COLUMNS}
+    section = TrixSection(input_trix_file, offsets['header_start'], offsets['data_end'])
+    size = max(offsets['data_end'] - offsets['header_start'], 1)
+    with io.BufferedReader(section) as buffered:
+        reader = pd.read_csv(buffered, sep='\t', engine='c', chunksize=chunksize,
+                             usecols=lambda name: name.strip() in TRIX_COLUMNS, dtype=dtypes)
+        for chunk in reader:
+            chunk.columns = chunk.columns.str.strip()
+            # Share of the data read so far, for progress reports
+            chunk.attrs['progress'] = 1 - section.remaining / size
+            yield chunk
+
+
+def assign_ids(chunk, key_cols, id_col, id_format, registry):
+    """
+    Assign an ID to every distinct combination of key_cols of a TRIX chunk.
+
+    Combinations are numbered in order of first appearance across all
+    chunks seen so far. Only the distinct combinations of the chunk are
+    looked up in the registry, the rows get their position with one
+    vectorized take.
+
+    :param chunk: DataFrame chunk, id_col is added in place
+    :param key_cols: Columns identifying a turbine or a mast
+    :param id_col: Name of the ID column to add
+    :param id_format: Format of the ID, given the 1-based number
+    :param registry: dict with 'position' (key tuple -> position), 'ids'
+        and 'rows' (key rows) lists and the key 'dtypes', updated in place
+    :returns: Position of every row of the chunk
+    :rtype: ndarray
+    """
+    codes = chunk.groupby(key_cols, sort=False, dropna=False).ngroup().to_numpy()
+    first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+    lookup = np.empty(len(first_rows), dtype=np.intp)
+    for code, row in enumerate(chunk[key_cols].iloc[first_rows].itertuples(index=False, name=None)):
+        # NaN never equals itself, use None so missing values share an ID
+        key = tuple(None if value != value else value for value in row)
+        position = registry['position'].get(key)
+        if position is None:
+            position = len(registry['ids'])
+            registry['position'][key] = position
+            registry['ids'].append(id_format.format(position + 1))
+            registry['rows'].append(row)
+        lookup[code] = position
+    registry['dtypes'] = chunk[key_cols].dtypes
+    positions = lookup[codes]
+    chunk[id_col] = np.asarray(registry['ids'], dtype=object)[positions]
+    return positions
+
+
+def grow_array(values, shape, fill_value):
+    """Return values enlarged (by doubling) to hold at least shape."""
+    if all(n <= size for n, size in zip(shape, values.shape)):
+        return values
+    new_shape = tuple(max(n, 2 * size) for n, size in zip(shape, values.shape))
+    grown = np.full(new_shape, fill_value, dtype=values.dtype)
+    grown[tuple(slice(0, size) for size in values.shape)] = values
+    return grown
+
+
+def compute_adj_rss(chunk):
+    """Add the corrected RSS uncertainty columns to a TRIX chunk in place."""
+    # Ensure all relevant columns are numeric to avoid TypeError. Always
+    # float64: in coerce mode a chunk of whole numbers would otherwise infer
+    # int64, and the cache stores every chunk with the first chunk's dtypes
+    for col in TRIX_UNCERTAINTY_COLUMNS:
+        chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype(np.float64)
+
+    # If any of these columns is null, set it to 100 before arithmetic
+    chunk['Horiz. Uc increase due to horiz. distance [%]'] = chunk['Horiz. Uc increase due to horiz. distance [%]'].fillna(100)
+    chunk['Horiz. Uc increase due to vert. distance [%]'] = chunk['Horiz. Uc increase due to vert. distance [%]'].fillna(100)
+
+    # --- Begin corrected RSS uncertainty logic ---
+    # 1. Add (Horizontal Distance [m] / 1000) to Horiz. Uc increase due to horiz. distance [%]
+    chunk['adj_horiz_uc_horiz_dist'] = (
+        chunk['Horiz. Uc increase due to horiz. distance [%]'] +
+        (chunk['Horizontal Distance [m]'] / 1000)
+    )
+
+    # 2. Sum with Horiz. Uc increase due to vert. distance [%]
+    chunk['adj_sum_horiz_uc'] = (
+        chunk['adj_horiz_uc_horiz_dist'] +
+        chunk['Horiz. Uc increase due to vert. distance [%]']
+    )
+
+    # 3. New RSS uncertainty
+    chunk['adj_RSS_uncertainty'] = np.sqrt(
+        chunk['adj_sum_horiz_uc']**2 +
+        chunk['Vertical uncertainty increase [%]']**2
+    )
+
+
+def trix_content_hash(input_trix_file):
+    """Hex digest of the content of a TRIX file."""
+    with open(input_trix_file, 'rb') as f:
+        return hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+
+
+def trix_cache_entry(cache_dir, content_hash):
+    """Entry directory of a TRIX content hash and the pipeline version in cache_dir."""
+    return os.path.join(cache_dir, f'{content_hash}-v{PIPELINE_VERSION}')
+
+
+def open_trix_cache(entry):
+    """
+    Start writing a cache entry. Columns are written to a temporary
+    directory that only replaces entry once complete.
+
+    :returns: Writer state for append_trix_cache/close_trix_cache, or None
+        if the cache directory is not writable
+    :rtype: dict
+    """
+    try:
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        tmp_dir = f'{entry}.tmp-{os.getpid()}'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+    except OSError:
+        return None
+    return {'entry': entry, 'dir': tmp_dir, 'columns': None, 'files': [], 'rows': 0}
+
+
+def append_trix_cache(cache, chunk, turbine_pos, mast_pos):
+    """
+    Append a processed chunk to a cache entry, one raw binary file per
+    column. ID columns are stored as their positions.
+
+    :returns: cache, or None if writing failed (the entry is dropped)
+    """
+    if cache is None:
+        return None
+    columns = {name: chunk[name].to_numpy() for name in chunk.columns}
+    columns['turbine_id'] = turbine_pos.astype(np.int32)
+    columns['mast_id'] = mast_pos.astype(np.int32)
+    try:
+        if cache['columns'] is None:
+            cache['columns'] = [[name, values.dtype.str] for name, values in columns.items()]
+            cache['files'] = [open(os.path.join(cache['dir'], f'{n}.bin'), 'wb') for n in range(len(columns))]
+        for f, (name, dtype) in zip(cache['files'], cache['columns']):
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        cache['rows'] += len(chunk)
+        return cache
+    except OSError:
+        discard_trix_cache(cache)
+        return None
+
+
+def discard_trix_cache(cache):
+    """Drop an unfinished cache entry."""
+    if cache is not None:
+        for f in cache['files']:
+            f.close()
+        shutil.rmtree(cache['dir'], ignore_errors=True)
+
+
+def close_trix_cache(cache, turbines, masts, max_bytes=TRIX_CACHE_MAX_BYTES):
+    """
+    Finish a cache entry with its metadata (columns, row count and the
+    unique turbine and mast rows), publish it and evict old entries down
+    to max_bytes.
+    """
+    if cache is None:
+        return
+    meta = {
+        'version': PIPELINE_VERSION,
+        'rows': cache['rows'],
+        'columns': cache['columns'] or [],
+    }
+    for name, registry in (('turbines', turbines), ('masts', masts)):
+        dtypes = registry['dtypes'] if registry['dtypes'] is not None else {}
+        meta[name] = {'rows': registry['rows'], 'dtypes': {col: str(dtype) for col, dtype in dtypes.items()}}
+    try:
+        for f in cache['files']:
+            f.close()
+        with open(os.path.join(cache['dir'], 'meta.json'), 'w') as f:
+            json.dump(meta, f, default=float)
+        os.replace(cache['dir'], cache['entry'])
+    except OSError:
+        discard_trix_cache(cache)
+        return
+    evict_trix_cache(os.path.dirname(cache['entry']), max_bytes)
+
+
+def evict_trix_cache(cache_dir, max_bytes=TRIX_CACHE_MAX_BYTES):
+    """
+    Remove the least recently used entries of cache_dir until the cache
+    fits in max_bytes. Entries are touched when they are read.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        meta = os.path.join(path, 'meta.json')
+        if '.tmp-' in name or not os.path.exists(meta):
+            continue
+        size = sum(entry.stat().st_size for entry in os.scandir(path))
+        entries.append((os.path.getmtime(meta), size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+
+def load_trix_cache(entry, chunksize, turbines, masts):
+    """
+    Read a cache entry back in chunks of chunksize rows.
+
+    The column files are memory-mapped, so only the rows of the current
+    chunk are paged in. The registries are filled from the stored unique
+    rows.
+
+    :returns: Iterator of (chunk, turbine_pos, mast_pos), or None if the
+        entry does not exist
+    """
+    meta_path = os.path.join(entry, 'meta.json')
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    os.utime(meta_path)
+
+    for registry, stored, id_format in ((turbines, meta['turbines'], 'WTG_{:02d}'),
+                                        (masts, meta['masts'], 'Mast_{:02d}')):
+        registry['rows'] = [tuple(row) for row in stored['rows']]
+        registry['ids'] = [id_format.format(n + 1) for n in range(len(stored['rows']))]
+        registry['dtypes'] = {name: np.dtype(dtype) for name, dtype in stored['dtypes'].items()}
+
+    n_rows = meta['rows']
+    columns = [(name, np.memmap(os.path.join(entry, f'{n}.bin'), dtype=dtype, mode='r', shape=(n_rows,))
+                if n_rows else np.empty(0, dtype=dtype))
+               for n, (name, dtype) in enumerate(meta['columns'])]
+    turbine_ids = np.asarray(turbines['ids'], dtype=object)
+    mast_ids = np.asarray(masts['ids'], dtype=object)
+
+    def chunks():
+        for start in range(0, n_rows, chunksize):
+            stop = min(start + chunksize, n_rows)
+            chunk = {name: np.array(values[start:stop]) for name, values in columns}
+            progress = stop / n_rows
+            turbine_pos = chunk['turbine_id'].astype(np.intp)
+            mast_pos = chunk['mast_id'].astype(np.intp)
+            chunk['turbine_id'] = turbine_ids[turbine_pos]
+            chunk['mast_id'] = mast_ids[mast_pos]
+            chunk = pd.DataFrame(chunk)
+            chunk.attrs['progress'] = progress
+            yield chunk, turbine_pos, mast_pos
+    return chunks()
+
+
+def parse_trix_chunks(input_trix_file, chunksize, coerce, turbines, masts, offsets=None):
+    """
+    Parse a TRIX file in chunks and give every chunk its IDs and
+    corrected RSS uncertainty.
+
+    :param offsets: Located table of the file (see locate_trix_data)
+    :returns: Iterator of (chunk, turbine_pos, mast_pos)
+    """
+    for chunk in read_trix_chunks(input_trix_file, chunksize, offsets, coerce):
+        # Assign unique turbine_id and mast_id
+        turbine_pos = assign_ids(chunk, TURBINE_COLUMNS, 'turbine_id', 'WTG_{:02d}', turbines)
+        mast_pos = assign_ids(chunk, MAST_COLUMNS, 'mast_id', 'Mast_{:02d}', masts)
+        compute_adj_rss(chunk)
+        yield chunk, turbine_pos, mast_pos
+
+
+def build_id_index(unique_rows, id_col, coord_cols):
+    """
+    Build a positional lookup index for turbines or met masts.
+
+    Position p is row (turbines) or column (masts) p of the RSS matrix, so
+    position -> ID and position -> coordinates are plain array lookups and
+    ID -> position / coordinates -> position are dictionary lookups.
+
+    :param unique_rows: DataFrame with one row per ID, in ID order
+    :param id_col: Name of the ID column ('turbine_id' or 'mast_id')
+    :param coord_cols: Coordinate/attribute columns to keep
+    :returns: dict with 'ids' (object array), 'coords' (float64 array of
+        shape (n, len(coord_cols))), 'columns' (coord_cols),
+        'position' (ID -> position) and 'by_coords' (coordinate tuple ->
+        position)
+    :rtype: dict
+    """
+    ids = unique_rows[id_col].to_numpy()
+    coords = unique_rows[coord_cols].to_numpy(dtype=np.float64)
+    return {
+        'ids': ids,
+        'coords': coords,
+        'columns': list(coord_cols),
+        'position': {item_id: pos for pos, item_id in enumerate(ids)},
+        'by_coords': {tuple(row): pos for pos, row in enumerate(coords.tolist())},
+    }
+
+
+def aggregate_trix(input_trix_file, chunksize=100000, coerce=False, cache_entry=None,
+                   cache_max_bytes=TRIX_CACHE_MAX_BYTES, full_csv=None, feedback=None, offsets=None):
+    """
+    Stream a TRIX file into its unique turbines and masts, the turbine x
+    mast RSS matrix and the mean RSS uncertainty per mast.
+
+    The data table is parsed chunksize rows at a time. Every chunk gets its
+    IDs and corrected RSS uncertainty, while the per-mast RSS sums and the
+    RSS matrix are accumulated, so memory is bounded by the chunk size and
+    the number of turbines and masts rather than by the TRIX size.
+
+    With cache_entry (see trix_cache_entry) the processed rows are read
+    from, or else written to, the parsed TRIX cache, so the same file is
+    memory-mapped instead of parsed the next time.
+
+    :param input_trix_file: Path to the TRIX file
+    :param chunksize: Number of TRIX rows parsed at a time
+    :param coerce: Parse the uncertainty columns as text and coerce them,
+        used automatically when they do not parse as numbers
+    :param cache_entry: Cache entry directory, None disables the cache
+    :param cache_max_bytes: Size limit of the cache directory
+    :param full_csv: Path to write every processed row to, or None
+    :param feedback: Object with isCanceled() and setProgress(percent)
+        (e.g. a QgsFeedback), checked for cancellation between chunks
+        (raises PipelineCanceled)
+    :param offsets: Located table of the file (see locate_trix_data), the
+        file is searched once when it has to be parsed and None is given
+    :returns: dict with 'turbines' and 'masts' (DataFrames of the unique
+        rows with their turbine_id/mast_id), 'turbine_index' and
+        'mast_index' (see build_id_index), 'rss_matrix' (float32 array of
+        shape (n_turbines, n_masts), NaN for missing combinations) and
+        'mast_rss' (masts with their mean adj_RSS_uncertainty, sorted by
+        coordinates)
+    :rtype: dict
+    """
+    turbines = {'position': {}, 'ids': [], 'rows': [], 'dtypes': None}
+    masts = {'position': {}, 'ids': [], 'rows': [], 'dtypes': None}
+    rss_matrix = np.full((0, 0), np.nan, dtype=np.float32)
+    rss_sum = np.zeros(0)
+    rss_count = np.zeros(0)
+
+    chunks = cache = None
+    if cache_entry is not None:
+        chunks = load_trix_cache(cache_entry, chunksize, turbines, masts)
+        if chunks is None:
+            cache = open_trix_cache(cache_entry)
+    if chunks is None:
+        if offsets is None:
+            offsets = locate_trix_data(input_trix_file)
+        chunks = parse_trix_chunks(input_trix_file, chunksize, coerce, turbines, masts, offsets)
+
+    header = True
+    try:
+        for chunk, turbine_pos, mast_pos in chunks:
+            if feedback is not None:
+                if feedback.isCanceled():
+                    raise PipelineCanceled()
+                feedback.setProgress(100 * chunk.attrs.get('progress', 0.0))
+            # Save the full data before grouping/averaging
+            if full_csv is not None:
+                chunk.to_csv(full_csv, mode='w' if header else 'a', header=header, index=False)
+                header = False
+            cache = append_trix_cache(cache, chunk, turbine_pos, mast_pos)
+
+            # Turbine x mast matrix and per-mast running sums
+            rss = chunk['adj_RSS_uncertainty'].to_numpy(dtype=np.float64)
+            n_turbines, n_masts = len(turbines['ids']), len(masts['ids'])
+            rss_matrix = grow_array(rss_matrix, (n_turbines, n_masts), np.nan)
+            rss_matrix[turbine_pos, mast_pos] = rss
+            valid = ~np.isnan(rss)
+            rss_sum = grow_array(rss_sum, (n_masts,), 0.0)
+            rss_count = grow_array(rss_count, (n_masts,), 0.0)
+            rss_sum[:n_masts] += np.bincount(mast_pos[valid], weights=rss[valid], minlength=n_masts)
+            rss_count[:n_masts] += np.bincount(mast_pos[valid], minlength=n_masts)
+    except PipelineCanceled:
+        discard_trix_cache(cache)
+        raise
+    except ValueError:
+        discard_trix_cache(cache)
+        if coerce:
+            raise
+        # Text in an uncertainty column, parse again and coerce it to NaN
+        return aggregate_trix(input_trix_file, chunksize, True, cache_entry, cache_max_bytes, full_csv,
+                              feedback, offsets)
+    close_trix_cache(cache, turbines, masts, cache_max_bytes)
+
+    n_turbines, n_masts = len(turbines['ids']), len(masts['ids'])
+    unique_turbines = pd.DataFrame(turbines['rows'], columns=TURBINE_COLUMNS).astype(turbines['dtypes'])
+    unique_turbines['turbine_id'] = turbines['ids']
+    unique_masts = pd.DataFrame(masts['rows'], columns=MAST_COLUMNS).astype(masts['dtypes'])
+    unique_masts['mast_id'] = masts['ids']
+
+    # Mean RSS uncertainty per reference point, keeping mast_id
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_rss = rss_sum[:n_masts] / rss_count[:n_masts]
+    mast_rss = unique_masts.assign(adj_RSS_uncertainty=mean_rss)
+    mast_rss = mast_rss.dropna(subset=MAST_COLUMNS).sort_values(MAST_COLUMNS, kind='mergesort')
+
+    return {
+        'turbines': unique_turbines,
+        'masts': unique_masts,
+        # Positional indexes shared by the matrix, solvers and writers
+        'turbine_index': build_id_index(unique_turbines, 'turbine_id', TURBINE_COLUMNS),
+        'mast_index': build_id_index(unique_masts, 'mast_id', MAST_COLUMNS),
+        'rss_matrix': np.ascontiguousarray(rss_matrix[:n_turbines, :n_masts]),
+        'mast_rss': mast_rss,
+    }
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the compute package tests.
+
+The compute package does not import QGIS, so the tests put the plugin
+folder on sys.path and import it as the top-level package 'compute'.
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TRIX_HEADER = [
+    'Site', 'WTG X [m]', 'WTG Y [m]', 'WTG Z [m]', 'WTG RIX [%]',
+    'Reference Point X [m]', 'Reference Point Y [m]', 'Reference Point Z [m]', 'Reference RIX [%]',
+    'Horiz. Uc increase due to horiz. distance [%]', 'Horizontal Distance [m]',
+    'Horiz. Uc increase due to vert. distance [%]', 'Vertical uncertainty increase [%]',
+    'RSS of uncertainty increases [%]',
+]
+
+
+def write_trix(path, n_turbines=12, n_masts=30, seed=0, missing=0.1, blank=0.05, text=None):
+    """
+    Write a synthetic WindPRO TRIX file: a tab-separated table with padded
+    column names, followed by the Assumptions section.
+
+    :param missing: Share of turbine/mast combinations left out
+    :param blank: Share of empty 'Horiz. Uc increase due to vert. distance'
+        cells (filled with 100 by compute_adj_rss)
+    :param text: Optional text written in the first row's vertical
+        uncertainty, which makes the parser fall back to coercion; the
+        first row's distance is then a whole number, so a chunk holding
+        only that row infers an integer column
+    :returns: path
+    """
+    rng = np.random.default_rng(seed)
+    turbines = np.column_stack((rng.uniform(0, 5000, (n_turbines, 2)), rng.uniform(80, 120, n_turbines),
+                                rng.uniform(0, 5, n_turbines)))
+    masts = np.column_stack((rng.uniform(0, 5000, (n_masts, 2)), rng.uniform(80, 120, n_masts),
+                             rng.uniform(0, 5, n_masts)))
+    lines = ['\t'.join(name + ' ' for name in TRIX_HEADER)]
+    for turbine in turbines:
+        for mast in masts:
+            if rng.random() < missing:
+                continue
+            distance = float(np.hypot(*(turbine[:2] - mast[:2])))
+            horizontal = distance / 300.0
+            vertical = abs(turbine[2] - mast[2]) / 20.0
+            vertical_text, distance_text = f'{vertical:.3f}', f'{distance:.1f}'
+            if text is not None and len(lines) == 1:
+                vertical_text, distance_text = text, f'{distance:.0f}'
+            horizontal_vertical = '' if rng.random() < blank else f'{rng.uniform(0, 2):.3f}'
+            lines.append('\t'.join([
+                'A', f'{turbine[0]:.1f}', f'{turbine[1]:.1f}', f'{turbine[2]:.1f}', f'{turbine[3]:.2f}',
+                f'{mast[0]:.1f}', f'{mast[1]:.1f}', f'{mast[2]:.1f}', f'{mast[3]:.2f}',
+                f'{horizontal:.3f}', distance_text, horizontal_vertical, vertical_text,
+                f'{np.hypot(horizontal, vertical):.3f}']))
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\nAssumptions:\nModel\tWAsP\n*\n')
+    return path
+
+
+@pytest.fixture
+def trix_file(tmp_path):
+    """Factory of synthetic TRIX files in the test's temporary folder."""
+    def make(name='site.txt', **kwargs):
+        return write_trix(str(tmp_path / name), **kwargs)
+    return make
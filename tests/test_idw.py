@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Tests of compute.idw: tiled evaluation against a per-pixel reference IDW."""
+import numpy as np
+import pytest
+
+from compute import idw
+
+
+def reference_idw(x, y, points, values, power=2, k_neighbours=None, search_radius=None):
+    """
+    IDW value at one pixel centre, as QgsIDWInterpolator computes it: a
+    pixel on a point takes its value, else sum(v / d**power) / sum(1 / d**power)
+    over the points kept by the cutoffs, NaN when none is kept.
+    """
+    distance = np.hypot(points[:, 0] - x, points[:, 1] - y)
+    order = np.argsort(distance, kind='stable')
+    if k_neighbours is not None:
+        order = order[:k_neighbours]
+    if search_radius is not None:
+        order = order[distance[order] <= search_radius]
+    if not len(order):
+        return np.nan
+    if distance[order[0]] == 0:
+        return values[order[0]]
+    weights = 1.0 / distance[order] ** power
+    return float((weights * values[order]).sum() / weights.sum())
+
+
+def grid_settings(bounds, pixel_size, power=2, k_neighbours=None, search_radius=None, block_bytes=4096):
+    columns, rows, cell_x, cell_y = idw.idw_grid(bounds, pixel_size)
+    settings = {'x0': bounds[0], 'y0': bounds[3], 'cell_x': cell_x, 'cell_y': cell_y, 'power': power,
+                'k_neighbours': k_neighbours, 'search_radius': search_radius, 'block_bytes': block_bytes,
+                'ramp': None}
+    return columns, rows, settings
+
+
+def evaluate_grid(points, values, columns, rows, settings, tile_size):
+    """Evaluate every tile of the grid and assemble the raster."""
+    tree = idw.build_tree(points, settings)
+    raster = np.full((rows, columns), -1.0, dtype=np.float32)
+    for row in range(0, rows, tile_size):
+        for col in range(0, columns, tile_size):
+            tile = (row, col, min(tile_size, rows - row), min(tile_size, columns - col))
+            _, block, rgba, _, _ = idw.evaluate_idw_tile(tile, points, values, tree, settings)
+            assert rgba is None
+            raster[row:row + tile[2], col:col + tile[3]] = block
+    return raster
+
+
+def reference_grid(points, values, columns, rows, settings):
+    raster = np.empty((rows, columns))
+    for row in range(rows):
+        y = settings['y0'] - settings['cell_y'] * (row + 0.5)
+        for col in range(columns):
+            x = settings['x0'] + settings['cell_x'] * (col + 0.5)
+            raster[row, col] = reference_idw(x, y, points, values, settings['power'],
+                                             settings['k_neighbours'], settings['search_radius'])
+    return raster
+
+
+@pytest.fixture
+def mast_points():
+    rng = np.random.default_rng(4)
+    points = rng.uniform(0, 300, (25, 2))
+    values = rng.uniform(1, 20, 25)
+    return points, values
+
+
+@pytest.mark.parametrize('power', [2, 1.5])
+@pytest.mark.parametrize('k_neighbours, search_radius', [(None, None), (4, None), (None, 25.0), (4, 25.0)])
+def test_tiles_match_reference_idw(mast_points, power, k_neighbours, search_radius):
+    points, values = mast_points
+    bounds = (points[:, 0].min(), points[:, 1].min(), points[:, 0].max(), points[:, 1].max())
+    columns, rows, settings = grid_settings(bounds, 9.0, power, k_neighbours, search_radius)
+
+    raster = evaluate_grid(points, values, columns, rows, settings, tile_size=7)
+
+    expected = reference_grid(points, values, columns, rows, settings)
+    np.testing.assert_allclose(raster, expected.astype(np.float32), rtol=1e-6, equal_nan=True)
+    if search_radius is not None:
+        assert np.isnan(raster).any()
+
+
+def test_pixel_on_point_takes_point_value():
+    points = np.array([[5.0, 5.0], [15.0, 15.0], [25.0, 5.0]])
+    values = np.array([1.0, 2.0, 3.0])
+    pixels = np.array([[5.0, 5.0], [15.0, 15.0], [10.0, 10.0]])
+
+    result = idw.idw_values(pixels, points, values)
+
+    assert result[:2].tolist() == [1.0, 2.0]
+    assert result[2] == pytest.approx(reference_idw(10.0, 10.0, points, values))
+
+
+def test_tile_colorized_with_ramp(mast_points):
+    points, values = mast_points
+    bounds = (0.0, 0.0, 300.0, 300.0)
+    columns, rows, settings = grid_settings(bounds, 30.0)
+    stops = [values.min(), values.max()]
+    settings['ramp'] = (stops, np.array([[0, 0, 255, 255], [255, 0, 0, 255]], dtype=np.uint8))
+
+    _, block, rgba, _, _ = idw.evaluate_idw_tile((0, 0, rows, columns), points, values, None, settings)
+
+    assert rgba.shape == (4, rows, columns)
+    scale = (block.astype(np.float64) - stops[0]) / (stops[1] - stops[0])
+    np.testing.assert_array_equal(rgba[0], np.trunc(255 * scale).astype(np.uint8))
+    np.testing.assert_array_equal(rgba[2], np.trunc(255 - 255 * scale).astype(np.uint8))
+    assert (rgba[3] == 255).all()
+
+
+def test_idw_grid_covers_extent():
+    columns, rows, cell_x, cell_y = idw.idw_grid((0.0, 0.0, 100.0, 40.0), 10.0)
+    assert (columns, rows) == (11, 5)
+    assert columns * cell_x == pytest.approx(100.0)
+    assert rows * cell_y == pytest.approx(40.0)
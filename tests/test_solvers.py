@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Tests of compute.solvers against brute force on small RSS matrices."""
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from compute import solvers
+
+
+def random_rss(seed, n_turbines=9, n_masts=10, missing=0.2):
+    """float32 turbine x mast RSS matrix with NaN for missing combinations."""
+    rng = np.random.default_rng(seed)
+    rss_values = rng.uniform(0.5, 20.0, (n_turbines, n_masts)).astype(np.float32)
+    rss_values[rng.random(rss_values.shape) < missing] = np.nan
+    return rss_values
+
+
+def set_total(rss_values, masts):
+    """Summed per-turbine minimum RSS of a set of masts, inf if a turbine is not covered."""
+    per_turbine = np.fmin.reduce(rss_values[:, list(masts)].astype(np.float64), axis=1)
+    return float(per_turbine.sum()) if np.isfinite(per_turbine).all() else float('inf')
+
+
+def brute_force_totals(rss_values, k):
+    return {masts: set_total(rss_values, masts) for masts in combinations(range(rss_values.shape[1]), k)}
+
+
+@pytest.mark.parametrize('seed', range(12))
+@pytest.mark.parametrize('k', [1, 2, 3, 4])
+def test_optimize_k_masts_matches_brute_force(seed, k):
+    rss_values = random_rss(seed)
+    optimum = min(brute_force_totals(rss_values, k).values())
+
+    selected, total = solvers.optimize_k_masts(rss_values, k)
+
+    assert len(selected) == k == len(set(selected))
+    assert selected == sorted(selected)
+    if np.isinf(optimum):
+        assert np.isinf(total)
+    else:
+        assert total == pytest.approx(optimum, rel=1e-9)
+        assert set_total(rss_values, selected) == pytest.approx(optimum, rel=1e-9)
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_approximate_k_masts_is_bounded(seed):
+    rss_values = random_rss(seed, missing=0.05)
+    k = 3
+    optimum = min(brute_force_totals(rss_values, k).values())
+
+    selected, total, lower_bound = solvers.approximate_k_masts(rss_values, k, time_budget=5.0)
+
+    assert total == pytest.approx(set_total(rss_values, selected), rel=1e-9)
+    assert total >= optimum * (1 - 1e-9)
+    assert lower_bound <= optimum * (1 + 1e-9)
+
+
+def test_k_masts_rejects_k_above_mast_count():
+    rss_values = random_rss(0)
+    with pytest.raises(ValueError):
+        solvers.optimize_k_masts(rss_values, rss_values.shape[1] + 1)
+    with pytest.raises(ValueError):
+        solvers.approximate_k_masts(rss_values, 0)
+
+
+def test_optimize_k_masts_progress_can_stop_search():
+    class Stop(Exception):
+        pass
+
+    def progress(percent):
+        raise Stop()
+
+    with pytest.raises(Stop):
+        solvers.optimize_k_masts(random_rss(0), 3, progress=progress)
+
+
+@pytest.mark.parametrize('seed', range(8))
+@pytest.mark.parametrize('tile_bytes', [64, 8 * 1024 * 1024])
+def test_top_pairs_match_brute_force(seed, tile_bytes):
+    rss_values = random_rss(seed, n_masts=15)
+    n_masts = rss_values.shape[1]
+    totals = brute_force_totals(rss_values, 2)
+    ranked = sorted((total, pair) for pair, total in totals.items() if np.isfinite(total))
+    top_k = 5
+
+    scores = np.empty(n_masts * (n_masts - 1) // 2)
+    best, top_pairs, scores = solvers.evaluate_mast_pairs(rss_values, top_k=top_k, scores_out=scores,
+                                                          tile_bytes=tile_bytes)
+
+    assert [(i, j) for i, j, _ in top_pairs] == [pair for _, pair in ranked[:top_k]]
+    np.testing.assert_allclose([total for _, _, total in top_pairs], [total for total, _ in ranked[:top_k]],
+                               rtol=1e-9)
+    assert best[:2] == ranked[0][1]
+    # Every pair score, in itertools.combinations order, NaN when not covering
+    expected = np.array([totals[pair] for pair in combinations(range(n_masts), 2)])
+    np.testing.assert_allclose(np.where(np.isfinite(scores), scores, np.inf), expected, rtol=1e-9)
+
+
+def test_pairs_below_threshold_match_brute_force():
+    rss_values = random_rss(3, n_masts=15)
+    totals = brute_force_totals(rss_values, 2)
+    threshold = float(np.median([total for total in totals.values() if np.isfinite(total)]))
+    expected = sorted((total, pair) for pair, total in totals.items() if total <= threshold)
+
+    _, top_pairs, _ = solvers.evaluate_mast_pairs(rss_values, top_k=None, score_threshold=threshold,
+                                                  tile_bytes=64)
+
+    assert [(i, j) for i, j, _ in top_pairs] == [pair for _, pair in expected]
+
+
+@pytest.mark.parametrize('seed', range(8))
+def test_best_pair_matches_two_masts(seed):
+    rss_values = random_rss(seed)
+    best, _, _ = solvers.evaluate_mast_pairs(rss_values, top_k=1)
+    _, total = solvers.optimize_k_masts(rss_values, 2)
+    if best is None:
+        assert np.isinf(total)
+    else:
+        assert best[2] == pytest.approx(total, rel=1e-9)
+
+
+def test_best_single_mast_lowest_mean():
+    rss_values = random_rss(5)
+    mean_rss = np.nanmean(rss_values.astype(np.float64), axis=0)
+
+    best, best_rss = solvers.best_single_mast(rss_values)
+
+    assert best == int(np.argmin(mean_rss))
+    assert best_rss == pytest.approx(mean_rss.min())
+
+
+def test_condensed_pair_index_round_trip():
+    n_masts = 11
+    pairs = list(combinations(range(n_masts), 2))
+    index = solvers.condensed_pair_index([i for i, _ in pairs], [j for _, j in pairs], n_masts)
+    np.testing.assert_array_equal(index, np.arange(len(pairs)))
+    i, j = solvers.pair_from_condensed_index(index, n_masts)
+    assert list(zip(i.tolist(), j.tolist())) == pairs
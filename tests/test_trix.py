@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""Tests of compute.trix: streamed aggregation and the parsed TRIX cache."""
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from compute import trix
+
+
+def baseline_aggregate(path):
+    """
+    The original in-memory aggregation of the plugin: read the whole
+    table, number the distinct turbines and masts, correct the RSS
+    uncertainty and average it per mast.
+    """
+    with open(path) as f:
+        data_lines = []
+        for line in f:
+            if line.startswith(('Assumptions:', '*')):
+                break
+            data_lines.append(line)
+    data = pd.read_csv(io.StringIO(''.join(data_lines)), sep='\t', engine='c')
+    data.columns = data.columns.str.strip()
+
+    turbines = data[trix.TURBINE_COLUMNS].drop_duplicates().reset_index(drop=True)
+    turbines['turbine_id'] = ['WTG_{:02d}'.format(i + 1) for i in range(len(turbines))]
+    data = pd.merge(data, turbines, on=trix.TURBINE_COLUMNS, how='left')
+    masts = data[trix.MAST_COLUMNS].drop_duplicates().reset_index(drop=True)
+    masts['mast_id'] = ['Mast_{:02d}'.format(i + 1) for i in range(len(masts))]
+    data = pd.merge(data, masts, on=trix.MAST_COLUMNS, how='left')
+
+    for col in trix.TRIX_UNCERTAINTY_COLUMNS:
+        data[col] = pd.to_numeric(data[col], errors='coerce')
+    horiz = data['Horiz. Uc increase due to horiz. distance [%]'].fillna(100)
+    vert = data['Horiz. Uc increase due to vert. distance [%]'].fillna(100)
+    data['adj_RSS_uncertainty'] = np.sqrt((horiz + data['Horizontal Distance [m]'] / 1000 + vert) ** 2
+                                          + data['Vertical uncertainty increase [%]'] ** 2)
+    mast_rss = data.groupby(trix.MAST_COLUMNS + ['mast_id'], as_index=False).agg(
+        {'adj_RSS_uncertainty': 'mean'})
+    return data, turbines, masts, mast_rss
+
+
+def assert_same_aggregation(result, expected):
+    for key in ('turbines', 'masts', 'mast_rss'):
+        pd.testing.assert_frame_equal(result[key], expected[key])
+    np.testing.assert_array_equal(result['rss_matrix'], expected['rss_matrix'])
+    for key in ('turbine_index', 'mast_index'):
+        np.testing.assert_array_equal(result[key]['ids'], expected[key]['ids'])
+        np.testing.assert_array_equal(result[key]['coords'], expected[key]['coords'])
+
+
+@pytest.mark.parametrize('chunksize', [7, 100000])
+def test_aggregate_matches_baseline(trix_file, chunksize):
+    path = trix_file()
+    data, turbines, masts, mast_rss = baseline_aggregate(path)
+
+    result = trix.aggregate_trix(path, chunksize=chunksize)
+
+    assert list(result['turbines']['turbine_id']) == list(turbines['turbine_id'])
+    assert list(result['masts']['mast_id']) == list(masts['mast_id'])
+    np.testing.assert_allclose(result['turbines'][trix.TURBINE_COLUMNS].to_numpy(np.float64),
+                               turbines[trix.TURBINE_COLUMNS].to_numpy(np.float64), rtol=1e-6)
+    np.testing.assert_allclose(result['masts'][trix.MAST_COLUMNS].to_numpy(np.float64),
+                               masts[trix.MAST_COLUMNS].to_numpy(np.float64), rtol=1e-6)
+
+    mean_rss = result['mast_rss'].set_index('mast_id')['adj_RSS_uncertainty']
+    expected_rss = mast_rss.set_index('mast_id')['adj_RSS_uncertainty']
+    np.testing.assert_allclose(mean_rss.loc[expected_rss.index], expected_rss, rtol=1e-12)
+
+    # One matrix cell per TRIX row, NaN for the combinations left out
+    matrix = result['rss_matrix']
+    rows = result['turbine_index']['position']
+    columns = result['mast_index']['position']
+    turbine_pos = data['turbine_id'].map(rows).to_numpy()
+    mast_pos = data['mast_id'].map(columns).to_numpy()
+    np.testing.assert_allclose(matrix[turbine_pos, mast_pos], data['adj_RSS_uncertainty'], rtol=1e-6)
+    assert np.isfinite(matrix).sum() == len(data)
+
+
+def test_cache_hit_matches_cold_run(trix_file, tmp_path, monkeypatch):
+    path = trix_file()
+    entry = trix.trix_cache_entry(str(tmp_path / 'cache'), trix.trix_content_hash(path))
+
+    cold = trix.aggregate_trix(path, chunksize=50, cache_entry=entry, full_csv=str(tmp_path / 'cold.csv'))
+
+    # The second run is served from the cache, without parsing the file
+    def no_parse(*args, **kwargs):
+        raise AssertionError('TRIX file parsed on a cache hit')
+    monkeypatch.setattr(trix, 'read_trix_chunks', no_parse)
+    hot = trix.aggregate_trix(path, chunksize=50, cache_entry=entry, full_csv=str(tmp_path / 'hot.csv'))
+
+    assert_same_aggregation(hot, cold)
+    assert (tmp_path / 'hot.csv').read_bytes() == (tmp_path / 'cold.csv').read_bytes()
+
+
+def test_coerced_cache_hit_matches_cold_run(trix_file, tmp_path):
+    # Text in an uncertainty column: the file is parsed again with coercion
+    # and whole-number chunks must not truncate the cached values
+    path = trix_file(text='unknown')
+    entry = trix.trix_cache_entry(str(tmp_path / 'cache'), trix.trix_content_hash(path))
+
+    cold = trix.aggregate_trix(path, chunksize=1, cache_entry=entry, full_csv=str(tmp_path / 'cold.csv'))
+    hot = trix.aggregate_trix(path, chunksize=1, cache_entry=entry, full_csv=str(tmp_path / 'hot.csv'))
+
+    assert_same_aggregation(hot, cold)
+    assert (tmp_path / 'hot.csv').read_bytes() == (tmp_path / 'cold.csv').read_bytes()
+    assert np.isnan(pd.read_csv(tmp_path / 'cold.csv')['Vertical uncertainty increase [%]'].iloc[0])
+
+
+def test_aggregate_cancel_discards_cache(trix_file, tmp_path):
+    class Canceled:
+        def isCanceled(self):
+            return True
+
+        def setProgress(self, percent):
+            pass
+
+    path = trix_file()
+    entry = trix.trix_cache_entry(str(tmp_path / 'cache'), trix.trix_content_hash(path))
+    with pytest.raises(trix.PipelineCanceled):
+        trix.aggregate_trix(path, chunksize=50, cache_entry=entry, feedback=Canceled())
+    assert not (tmp_path / 'cache').exists() or not any((tmp_path / 'cache').iterdir())